@@ -1,13 +1,27 @@
+import sys
 from dataclasses import dataclass
-from typing import Union, List, TYPE_CHECKING, Optional
+from typing import Union, List, TYPE_CHECKING, Optional, Dict, Tuple
 
-from routeros_diff.settings import Settings
-from routeros_diff.utilities import quote, unescape_string
+from routeros_diff.settings import Settings, DEFAULT_SETTINGS
+from routeros_diff.utilities import quote, unescape_string, IndexedList
 from routeros_diff.exceptions import CannotDiff
 
 if TYPE_CHECKING:
     from routeros_diff.expressions import Expression
 
+# The table used by ArgValue.intern(). It is cleared once it reaches
+# this size, so that it cannot grow without limit in long-running processes
+MAX_INTERNED_VALUES = 100_000
+
+# Values which are quoted (force_quote=True) are kept separately, as this
+# avoids creating a (value, force_quote) tuple for every value
+_interned_values: Dict[str, "ArgValue"] = {}
+_interned_quoted_values: Dict[str, "ArgValue"] = {}
+
+# Arg lists shorter than this are searched directly rather than being indexed by key.
+# Most expressions only have a few args, and this saves creating an index for each
+ARG_INDEX_MIN_LENGTH = 8
+
 
 @dataclass
 class AbstractArgValue:
@@ -20,11 +34,13 @@ class AbstractArgValue:
     The values are `core` and `10.127.0.88`.
     """
 
+    __slots__ = ("value",)
+
     value: Union[str, "Expression"]
 
     def __eq__(self, other):
         other_value = other.value if isinstance(other, AbstractArgValue) else str(other)
-        return id(self) == id(other) or self.value == other_value
+        return self is other or self.value == other_value
 
     def __hash__(self):
         return hash(self.value)
@@ -58,11 +74,37 @@ class ArgValue(AbstractArgValue):
     The values are `core` and `10.127.0.88`. These are just simple values, nothing special
     """
 
+    __slots__ = ("force_quote", "_hash")
+
     value: str
 
     def __init__(self, value: str, force_quote: bool = False):
         self.value = unescape_string(value)
         self.force_quote = force_quote
+        self._hash = hash(self.value)
+
+    @staticmethod
+    def intern(value: str, force_quote: bool = False) -> "ArgValue":
+        """Get a shared ArgValue for the given value
+
+        The same values appear many times over in a configuration (`yes`, `accept`,
+        `bridge1` etc), so parsed args share a single ArgValue object for each value.
+        This saves memory, and also means equal values can usually be compared by
+        identity. ArgValues should therefore never be modified.
+        """
+        interned = _interned_quoted_values if force_quote else _interned_values
+        try:
+            return interned[value]
+        except KeyError:
+            pass
+
+        if len(interned) >= MAX_INTERNED_VALUES:
+            interned.clear()
+        arg_value = interned[value] = ArgValue(value, force_quote=force_quote)
+        return arg_value
+
+    def __hash__(self):
+        return self._hash
 
     def quote(self) -> str:
         return quote(self.value, force=self.force_quote)
@@ -82,6 +124,8 @@ class ExpressionArgValue(AbstractArgValue):
     The value `[ find where comment~ID:3 ]` is an expression value.
     """
 
+    __slots__ = ()
+
     value: "Expression"
 
     def quote(self) -> str:
@@ -108,10 +152,12 @@ class Arg:
     The first argument would have a key of `core` and value of `None`.
     """
 
+    __slots__ = ("key", "value", "comparator", "settings")
+
     key: str
     value: Union[ArgValue, ExpressionArgValue, None]
     # Common comparators are = or ~
-    comparator: str = "="
+    comparator: str
 
     settings: Settings
 
@@ -122,25 +168,27 @@ class Arg:
         comparator: str = "=",
         settings: Settings = None,
     ):
-        from routeros_diff.expressions import Expression
-
-        self.key = key
-        self.comparator = comparator
-        self.settings = settings or Settings()
+        # Keys & comparators are repeated many times, so intern them
+        self.key = sys.intern(key)
+        self.comparator = sys.intern(comparator)
+        self.settings = settings or DEFAULT_SETTINGS
 
         # Normalise our value into some kind of AbstractArgValue
         if isinstance(value, str):
             # Always quote regex expressions, otherwise RouterOS tends to ignore them
             force_quote = comparator == "~"
-            self.value = ArgValue(value, force_quote=force_quote)
-        elif isinstance(value, Expression):
-            self.value = ExpressionArgValue(value)
+            self.value = ArgValue.intern(value, force_quote=force_quote)
         elif value is None:
             self.value = None
         elif isinstance(value, AbstractArgValue):
             self.value = value
         else:
-            raise ValueError(f"Invalid arg value: {value}")
+            from routeros_diff.expressions import Expression
+
+            if isinstance(value, Expression):
+                self.value = ExpressionArgValue(value)
+            else:
+                raise ValueError(f"Invalid arg value: {value}")
 
     def __str__(self):
         """Render this argument as a string"""
@@ -163,15 +211,26 @@ class Arg:
             key = s
             value = None
 
+        assert (
+            key != "["
+        ), "Something went wrong, failed to detect find expression correctly"
+        return Arg.from_token(key, value, section_path=section_path, settings=settings)
+
+    @staticmethod
+    def from_token(
+        key: str,
+        value: Union[str, "Expression", None],
+        comparator: str = "=",
+        section_path: str = "",
+        settings: Settings = None,
+    ):
+        """Create an argument from an already-tokenized key, comparator & value"""
         # IPv6 addresses need normalising as RouterOS omits any /64 prefix
         if section_path == "/ipv6 address" and key == "address":
-            if "/" not in value:
+            if isinstance(value, str) and "/" not in value:
                 value = f"{value}/64"
 
-        assert (
-            key != "["
-        ), "Something went wrong, failed to detect find expression correctly"
-        return Arg(key=key, value=value)
+        return Arg(key=key, value=value, comparator=comparator, settings=settings)
 
     @property
     def is_positional(self):
@@ -211,14 +270,23 @@ class Arg:
 
         if natural_key == "comment-id":
             natural_key = "comment"
-        if natural_key and self.key == natural_key:
+        if natural_key and (
+            self.key == natural_key
+            or (isinstance(natural_key, tuple) and self.key in natural_key)
+        ):
             html = f'<span class="ros-nat">{html}</span>'
 
         return html
 
 
-class ArgList(list):
-    """A list of several arguments"""
+class ArgList(IndexedList):
+    """A list of several arguments
+
+    Arguments are indexed by key, so finding an argument by
+    its key does not require searching the entire list.
+    """
+
+    __slots__ = ()
 
     def __str__(self):
         """Turn this parsed list of args back into a config string"""
@@ -229,28 +297,41 @@ class ArgList(list):
             [f'<span class="ros-a">{a.__html__(natural_key)}</span>' for a in self]
         )
 
+    def _build_index(self) -> Dict[str, int]:
+        # The position of the first arg with each key
+        positions = {}
+        for i, arg in enumerate(self):
+            positions.setdefault(arg.key, i)
+        return positions
+
     def __getitem__(self, item):
         """Key an item by index or by key"""
         if isinstance(item, str):
             # By key
-            for arg in self:
-                if arg.key == item:
-                    return arg.value
-            raise KeyError(item)
+            if len(self) < ARG_INDEX_MIN_LENGTH:
+                for arg in self:
+                    if arg.key == item:
+                        return arg.value
+                raise KeyError(item)
+            return super().__getitem__(self._get_index()[item]).value
         else:
             # By index
             return super().__getitem__(item)
 
     def __contains__(self, key):
         """Do these args contain an argument with the given key?"""
-        return key in self.keys()
+        if len(self) < ARG_INDEX_MIN_LENGTH:
+            for arg in self:
+                if arg.key == key:
+                    return True
+            return False
+        return key in self._get_index()
 
     def __delitem__(self, key):
         """Delete the arg with the given key"""
         if isinstance(key, str):
-            for i, arg in enumerate(self):
-                if arg.key == key:
-                    del self[i]
+            if key in self:
+                self[:] = [arg for arg in self if arg.key != key]
         else:
             return super().__delitem__(key)
 
@@ -276,50 +357,23 @@ class ArgList(list):
         * Return args which which appear in both lists but with different values
         * Return args which do not appear in this list, in which case their values will be set to ""
         """
-        added = []
-        removed = []
-        modified = []
         old_keys = old.keys()
         new_keys = self.keys()
         diffed_arg_list = ArgList()
 
-        if self[0].is_positional != old[0].is_positional:
-            raise CannotDiff(
-                f"Diffing arguments in different formats. One has a positional starting argument "
-                f"and the other does not:\n"
-                f"    Old: {old}\n"
-                f"    New: {self}\n"
-            )
-
+        self._check_diffable(old)
         if self[0].is_positional:
-            if self[0].key != old[0].key:
-                raise CannotDiff(
-                    f"Diffing arguments in different formats. Initial positional arguments "
-                    f"do not match, so they are explicitly trying to modify different things:\n"
-                    f"    Old: {old}\n"
-                    f"    New: {self}\n"
-                )
-            else:
-                # Make sure we keep the positional arg
-                diffed_arg_list.append(Arg(key=self[0].key, value=None))
+            # Make sure we keep the positional arg
+            diffed_arg_list.append(Arg(key=self[0].key, value=None))
 
+        removed = set()
         for k in old_keys:
-            if k not in new_keys:
+            if k not in self:
                 if k == "disabled" and old[k] == "yes":
                     # disabled=yes has been removed, so let's enable it
                     diffed_arg_list.append(Arg("disabled", "no"))
                 else:
-                    removed.append(k)
-
-        for k in new_keys:
-            if k not in old_keys:
-                # key is not present in the old list, so it must be new
-                added.append(k)
-
-        for k in set(old_keys).intersection(new_keys):
-            # key is in both lists, but the value has changed
-            if self[k] != old[k]:
-                modified.append(k)
+                    removed.add(k)
 
         for k in old_keys:
             if k in removed:
@@ -327,15 +381,75 @@ class ArgList(list):
                 diffed_arg_list.append(Arg(key=f"{k}", value=""))
 
         for k in new_keys:
-            if k in added or k in modified:
-                # Added keys are added with their value only if
-                # their value does not match the value in the
-                # old verbose output
-                if old_verbose is None or self[k] != old_verbose.get(k):
-                    diffed_arg_list.append(Arg(key=k, value=self[k]))
+            new_value = self[k]
+            if k in old:
+                # key is in both lists, so include it only if the value has changed.
+                # Values are interned, so equal values are usually the same object
+                old_value = old[k]
+                if new_value is old_value or new_value == old_value:
+                    continue
+
+            # Added & modified keys are included with their value only if
+            # their value does not match the value in the old verbose output
+            if old_verbose is None or new_value != old_verbose.get(k):
+                diffed_arg_list.append(Arg(key=k, value=new_value))
 
         return diffed_arg_list
 
+    def has_changes(
+        self,
+        old: "ArgList",
+        old_verbose: Optional["ArgList"] = None,
+        ignore_keys: Tuple[str, ...] = (),
+    ) -> bool:
+        """Would `diff()` return any key-value args (other than those with the given keys)?
+
+        This gives the same result as checking the args returned by `diff()`, and raises
+        CannotDiff in the same cases. However, no args are created, and this stops as soon
+        as any change is found.
+        """
+        self._check_diffable(old)
+
+        for arg in old:
+            # Removed keys are given a blank value (or disabled=no)
+            if arg.key not in self and arg.key not in ignore_keys:
+                return True
+
+        for arg in self:
+            k = arg.key
+            if k in ignore_keys:
+                continue
+            new_value = self[k]
+            if new_value is None:
+                # Positional args are never key-value args
+                continue
+            if k in old:
+                old_value = old[k]
+                if new_value is old_value or new_value == old_value:
+                    continue
+            if old_verbose is None or new_value != old_verbose.get(k):
+                return True
+
+        return False
+
+    def _check_diffable(self, old: "ArgList"):
+        """Raise CannotDiff if this list cannot be diffed with the old list"""
+        if self[0].is_positional != old[0].is_positional:
+            raise CannotDiff(
+                f"Diffing arguments in different formats. One has a positional starting argument "
+                f"and the other does not:\n"
+                f"    Old: {old}\n"
+                f"    New: {self}\n"
+            )
+
+        if self[0].is_positional and self[0].key != old[0].key:
+            raise CannotDiff(
+                f"Diffing arguments in different formats. Initial positional arguments "
+                f"do not match, so they are explicitly trying to modify different things:\n"
+                f"    Old: {old}\n"
+                f"    New: {self}\n"
+            )
+
     def sort(self):
         """Sort the list by key
 
@@ -0,0 +1,250 @@
+import hashlib
+import marshal
+import os
+import tempfile
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Union, Optional
+
+from routeros_diff.arguments import Arg, ArgList, ArgValue
+from routeros_diff.columns import compact_expressions
+from routeros_diff.expressions import Expression
+from routeros_diff.parser import RouterOSConfig
+from routeros_diff.sections import Section
+from routeros_diff.settings import Settings
+from routeros_diff.utilities import gc_paused
+
+# Increment this whenever the parser output or the format of the cache
+# entries changes. Existing entries will then no longer be used.
+CACHE_FORMAT_VERSION = 1
+
+CACHE_FILE_SUFFIX = ".rosparse"
+
+
+class ParseCache:
+    """A persistent on-disk cache of parsed configurations
+
+    Useful when the same configurations are parsed over and over again
+    (for example, a template which is diffed against many routers). For example:
+
+        cache = ParseCache("~/.cache/routeros-diff")
+        config = cache.parse(config_string)
+
+    Entries are keyed on a hash of the configuration text plus a fingerprint
+    of the settings (see `Settings.fingerprint()`). A cache hit loads the parsed
+    sections & expressions directly, without any tokenizing or parsing.
+
+    The least recently used entries are removed once the cache is larger than
+    `max_size` bytes, or once it contains more than `max_entries` entries.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        max_size: int = 100_000_000,
+        max_entries: int = None,
+    ):
+        self.directory = Path(directory).expanduser()
+        self.max_size = max_size
+        self.max_entries = max_entries
+
+    def parse(
+        self, s: str, settings: Union[Settings, dict] = None, workers: int = None
+    ) -> RouterOSConfig:
+        """Parse the given configuration, using the cache where possible
+
+        Takes the same arguments as `RouterOSConfig.parse()`
+        """
+        settings = RouterOSConfig._normalise_settings(settings)
+        path = self.directory / f"{self.key(s, settings)}{CACHE_FILE_SUFFIX}"
+
+        config = self._load(path, settings)
+        if config is None:
+            config = RouterOSConfig.parse(s, settings, workers=workers)
+            self._store(path, config)
+            self._evict()
+        return config
+
+    def key(self, s: str, settings: Settings) -> str:
+        """Get the cache key for the given configuration & settings"""
+        hash_ = hashlib.blake2b(digest_size=20)
+        hash_.update(
+            f"{CACHE_FORMAT_VERSION}:{marshal.version}:{settings.fingerprint()}:".encode(
+                "utf8"
+            )
+        )
+        hash_.update(s.encode("utf8", "surrogatepass"))
+        return hash_.hexdigest()
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        for path in self.directory.glob(f"*{CACHE_FILE_SUFFIX}"):
+            _remove(path)
+
+    def _load(self, path: Path, settings: Settings) -> Optional[RouterOSConfig]:
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        try:
+            with gc_paused():
+                tree = marshal.loads(zlib.decompress(data))
+                config = _config_from_tree(tree, settings)
+        except (EOFError, ValueError, TypeError, zlib.error):
+            # Corrupt entry, so discard it and parse again
+            _remove(path)
+            return None
+
+        # Update the modification time, which we use to find the least recently used entries
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return config
+
+    def _store(self, path: Path, config: RouterOSConfig):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        data = zlib.compress(marshal.dumps(_config_to_tree(config)), 1)
+
+        # Write to a temporary file first, so that other processes
+        # never see partially written entries
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            _remove(Path(temp_path))
+            raise
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache is within its limits"""
+        entries = []
+        for path in self.directory.glob(f"*{CACHE_FILE_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        # Most recently used first
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+
+        total_size = 0
+        for i, (_, size, path) in enumerate(entries):
+            total_size += size
+            too_large = self.max_size is not None and total_size > self.max_size
+            too_many = self.max_entries is not None and i >= self.max_entries
+            if too_large or too_many:
+                _remove(path)
+
+
+def _remove(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+# The cache stores each configuration as a tree of tuples, which marshal
+# can serialise & load far faster than it could be parsed (the result
+# is then compressed using zlib):
+#
+#   config:     (timestamp, router_os_version, (section, ...))
+#   section:    (path, (expression, ...))
+#   expression: (command, find_expression, ((key, comparator, value), ...))
+#
+# Where value is None (for positional args), a string, or another expression.
+
+
+def _config_to_tree(config: RouterOSConfig) -> tuple:
+    # Marshal only writes each object once, so use the same object for
+    # equal strings (keys, commands, common values, etc)
+    strings = {}
+    return (
+        config.timestamp.isoformat() if config.timestamp else None,
+        config.router_os_version,
+        tuple(
+            (
+                section.path,
+                tuple(_expression_to_tree(e, strings) for e in section.expressions),
+            )
+            for section in config.sections
+        ),
+    )
+
+
+def _expression_to_tree(expression: Expression, strings: dict) -> tuple:
+    args = []
+    for arg in expression.args:
+        if arg.value is None:
+            value = None
+        elif isinstance(arg.value, ArgValue):
+            value = strings.setdefault(arg.value.value, arg.value.value)
+        else:
+            value = _expression_to_tree(arg.value.value, strings)
+        args.append(
+            (
+                strings.setdefault(arg.key, arg.key),
+                strings.setdefault(arg.comparator, arg.comparator),
+                value,
+            )
+        )
+
+    return (
+        strings.setdefault(expression.command, expression.command),
+        _expression_to_tree(expression.find_expression, strings)
+        if expression.find_expression
+        else None,
+        tuple(args),
+    )
+
+
+def _config_from_tree(tree: tuple, settings: Settings) -> RouterOSConfig:
+    timestamp, router_os_version, sections = tree
+    return RouterOSConfig(
+        timestamp=datetime.fromisoformat(timestamp) if timestamp else None,
+        router_os_version=router_os_version,
+        sections=[
+            Section(
+                path=path,
+                # Large sections are stored as columns again, just as when parsing
+                expressions=compact_expressions(
+                    [_expression_from_tree(e, path, settings) for e in expressions],
+                    path,
+                    settings,
+                ),
+                settings=settings,
+            )
+            for path, expressions in sections
+        ],
+        settings=settings,
+    )
+
+
+def _expression_from_tree(tree: tuple, section_path: str, settings: Settings):
+    command, find_expression, args = tree
+    return Expression(
+        section_path=section_path,
+        command=command,
+        find_expression=_expression_from_tree(find_expression, section_path, settings)
+        if find_expression
+        else None,
+        args=ArgList(
+            [
+                Arg(
+                    key=key,
+                    value=_expression_from_tree(value, section_path, settings)
+                    if isinstance(value, tuple)
+                    else value,
+                    comparator=comparator,
+                    settings=settings,
+                )
+                for key, comparator, value in args
+            ]
+        ),
+        settings=settings,
+    )
@@ -0,0 +1,337 @@
+from array import array
+from collections.abc import Sequence
+from typing import Dict, Hashable, Iterable, List, Optional, Union
+
+from routeros_diff.arguments import Arg, ArgList, ArgValue
+from routeros_diff.expressions import (
+    Expression,
+    COMMENT_ID,
+    Classification,
+    normalise_natural_id,
+    expression_fingerprint,
+    combine_fingerprints,
+)
+from routeros_diff.settings import Settings
+
+# Sections with fewer expressions than this are always stored as a list of expressions
+COLUMNAR_MIN_EXPRESSIONS = 1000
+
+
+class ExpressionColumns(Sequence):
+    """A section's expressions, stored as one array per key rather than as Expression objects
+
+    Large sections such as `/ip firewall address-list` often contain thousands of
+    rows with the same few keys. For example:
+
+        add address=10.0.0.1 list=blocked
+        add address=10.0.0.2 list=blocked comment=foo
+
+    This is stored as a table of strings (`10.0.0.1`, `blocked`, `10.0.0.2`, `foo`),
+    plus an array for each of `address`, `list` and `comment`. Each array holds the
+    position of the row's value in the string table (plus one, as zero is used
+    where the row does not have the key).
+
+    This behaves as a read-only list of expressions. Expressions are created
+    on demand as they are accessed. Only sections in which every expression is
+    an `add` command with only key=value arguments can be stored in this way.
+    """
+
+    __slots__ = (
+        "section_path",
+        "keys",
+        "columns",
+        "strings",
+        "settings",
+        "_length",
+        "_natural_id_positions",
+        "_fingerprint",
+    )
+
+    def __init__(
+        self,
+        section_path: str,
+        keys: List[str],
+        columns: Dict[str, array],
+        strings: List[str],
+        length: int,
+        settings: Settings,
+    ):
+        self.section_path = section_path
+        # The keys in the order they appear in each expression
+        self.keys = keys
+        self.columns = columns
+        self.strings = strings
+        self.settings = settings
+        self._length = length
+        self._natural_id_positions = None
+        self._fingerprint = None
+
+    @classmethod
+    def from_expressions(
+        cls, expressions: Iterable[Expression], section_path: str, settings: Settings
+    ) -> Optional["ExpressionColumns"]:
+        """Store the given expressions as columns
+
+        Returns None if the expressions cannot be stored as columns
+        """
+        keys: List[str] = []
+        columns: Dict[str, array] = {}
+        strings: List[str] = []
+        string_indexes: Dict[str, int] = {}
+        length = 0
+
+        for expression in expressions:
+            if expression.command != "add" or expression.find_expression:
+                return None
+
+            for column in columns.values():
+                column.append(0)
+
+            # The position of the previous arg's key within keys
+            previous = -1
+            for arg in expression.args:
+                value = arg.value
+                if (
+                    not isinstance(value, ArgValue)
+                    or arg.comparator != "="
+                    or value.force_quote
+                ):
+                    # Positional args, sub-expressions & regexes
+                    return None
+
+                column = columns.get(arg.key)
+                if column is None:
+                    # A new key, which goes directly after the previous key
+                    previous += 1
+                    keys.insert(previous, arg.key)
+                    column = columns[arg.key] = array("I", [0]) * (length + 1)
+                else:
+                    position = keys.index(arg.key)
+                    if position <= previous:
+                        # Keys are not in the same order as in previous expressions
+                        # (or the key appears twice)
+                        return None
+                    previous = position
+
+                string_index = string_indexes.get(value.value)
+                if string_index is None:
+                    strings.append(value.value)
+                    string_index = string_indexes[value.value] = len(strings)
+                column[length] = string_index
+
+            length += 1
+
+        if not length:
+            return None
+
+        return cls(
+            section_path=section_path,
+            keys=keys,
+            columns=columns,
+            strings=strings,
+            length=length,
+            settings=settings,
+        )
+
+    @classmethod
+    def concat(cls, parts: List["ExpressionColumns"]) -> Optional["ExpressionColumns"]:
+        """Join several sets of columns (for the same section) into one
+
+        Returns None if the keys of each part are not in a consistent order
+        """
+        keys = list(parts[0].keys)
+        for part in parts[1:]:
+            previous = -1
+            for key in part.keys:
+                if key in keys:
+                    position = keys.index(key)
+                    if position <= previous:
+                        return None
+                    previous = position
+                else:
+                    previous += 1
+                    keys.insert(previous, key)
+
+        strings: List[str] = []
+        string_indexes: Dict[str, int] = {}
+        columns = {key: array("I") for key in keys}
+        for part in parts:
+            # Map the part's string indexes to those in the combined string table
+            mapping = [0]
+            for string in part.strings:
+                string_index = string_indexes.get(string)
+                if string_index is None:
+                    strings.append(string)
+                    string_index = string_indexes[string] = len(strings)
+                mapping.append(string_index)
+
+            for key, column in columns.items():
+                part_column = part.columns.get(key)
+                if part_column is None:
+                    column.extend(array("I", [0]) * len(part))
+                else:
+                    column.extend(array("I", map(mapping.__getitem__, part_column)))
+
+        return cls(
+            section_path=parts[0].section_path,
+            keys=keys,
+            columns=columns,
+            strings=strings,
+            length=sum(len(part) for part in parts),
+            settings=parts[0].settings,
+        )
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("Expression index out of range")
+
+        args = ArgList()
+        for key in self.keys:
+            string_index = self.columns[key][index]
+            if string_index:
+                args.append(
+                    Arg(key, self.strings[string_index - 1], settings=self.settings)
+                )
+
+        return Expression(
+            section_path=self.section_path,
+            command="add",
+            find_expression=None,
+            args=args,
+            settings=self.settings,
+        )
+
+    def __eq__(self, other):
+        if isinstance(other, (ExpressionColumns, list)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"<ExpressionColumns {self.section_path} ({self._length} expressions)>"
+
+    def row_values(self) -> List[frozenset]:
+        """Get the (key, value) pairs for each row
+
+        This avoids creating any Expression objects, and is used to quickly
+        find rows which are unchanged between two sections.
+        """
+        rows = [[] for _ in range(self._length)]
+        for key in self.keys:
+            strings = self.strings
+            for row, string_index in zip(rows, self.columns[key]):
+                if string_index:
+                    row.append((key, strings[string_index - 1]))
+        return [frozenset(row) for row in rows]
+
+    def natural_ids(self) -> List[Optional[Hashable]]:
+        """Get the natural ID for each row
+
+        This gives the same IDs as Expression.natural_key_and_id, but avoids
+        creating any Expression objects. Expressions stored as columns never have
+        find expressions or positional arguments, so we only need to check for
+        comment IDs and natural keys.
+        """
+        natural_key = self.settings.get_natural_key(self.section_path)
+        comments = self.columns.get("comment")
+        compound = isinstance(natural_key, tuple)
+        keys = natural_key if compound else (natural_key,)
+        # The columns for each of the natural keys
+        values = [self.columns.get(key) for key in keys]
+        if None in values:
+            values = None
+
+        natural_ids = []
+        for i in range(self._length):
+            natural_id = None
+            if comments is not None and comments[i]:
+                matches = COMMENT_ID.search(self.strings[comments[i] - 1])
+                if matches:
+                    natural_id = matches.group(1)
+
+            if natural_id is None and values is not None:
+                row = [column[i] for column in values]
+                if all(row):
+                    parts = tuple(
+                        normalise_natural_id(
+                            self.section_path, key, self.strings[string_index - 1]
+                        )
+                        for key, string_index in zip(keys, row)
+                    )
+                    natural_id = parts if compound else parts[0]
+
+            natural_ids.append(natural_id)
+        return natural_ids
+
+    def natural_id_positions(self) -> Dict[Optional[Hashable], int]:
+        """Get the position of the row with each natural ID
+
+        Where several rows have the same natural ID, this gives the position of the first.
+        The columns cannot change, so this is only built once.
+        """
+        if self._natural_id_positions is None:
+            positions = {}
+            for i, natural_id in enumerate(self.natural_ids()):
+                positions.setdefault(natural_id, i)
+            self._natural_id_positions = positions
+        return self._natural_id_positions
+
+    def fingerprint(self, ordered: bool) -> bytes:
+        """Get a hash of these expressions, without creating any Expression objects
+
+        This is the same as `ExpressionList.fingerprint()` for the same expressions
+        """
+        if self._fingerprint is None or self._fingerprint[0] != ordered:
+            strings = self.strings
+            rows = [[] for _ in range(self._length)]
+            for key in self.keys:
+                for row, string_index in zip(rows, self.columns[key]):
+                    if string_index:
+                        row.append((key, "=", strings[string_index - 1]))
+
+            self._fingerprint = (
+                ordered,
+                combine_fingerprints(
+                    (expression_fingerprint("add", "", [], row) for row in rows),
+                    ordered,
+                ),
+            )
+        return self._fingerprint[1]
+
+    def classify(self) -> Classification:
+        """Classify these expressions
+
+        Columns only ever contain `add` expressions without find expressions, so
+        we only need to check for natural IDs.
+        """
+        return Classification(
+            single_object=False,
+            default_only=False,
+            any_default=False,
+            natural_ids=None not in self.natural_id_positions(),
+        )
+
+
+def compact_expressions(
+    expressions: List[Expression], section_path: str, settings: Settings
+) -> Union[List[Expression], ExpressionColumns]:
+    """Store the expressions as columns if the section is large and suitable
+
+    Otherwise the list of expressions is returned as-is
+    """
+    if len(expressions) >= COLUMNAR_MIN_EXPRESSIONS and settings.is_columnar(
+        section_path
+    ):
+        columns = ExpressionColumns.from_expressions(
+            expressions, section_path, settings
+        )
+        if columns is not None:
+            return columns
+    return expressions
@@ -1,4 +1,5 @@
 import argparse
+import sys
 from pathlib import Path
 
 from routeros_diff.parser import RouterOSConfig
@@ -10,8 +11,29 @@ def run():
     )
     parser.add_argument("old", metavar="OLD", type=str, help="Path to the old file")
     parser.add_argument("new", metavar="NEW", type=str, help="Path to the new file")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Parse & diff using a pool of this many worker processes (useful for very large files)",
+    )
     args = parser.parse_args()
 
-    old = RouterOSConfig.parse(Path(args.old).read_text())
-    new = RouterOSConfig.parse(Path(args.new).read_text())
-    print(old.diff(new))
+    with Path(args.old).open() as f:
+        old = RouterOSConfig.parse_lines(f, workers=args.workers)
+    with Path(args.new).open() as f:
+        new = RouterOSConfig.parse_lines(f, workers=args.workers)
+
+    # Write each section as soon as it has been diffed, rather than waiting for the whole diff
+    section_path = None
+    for path, expression in old.iter_diff(new, workers=args.workers):
+        if path != section_path:
+            if section_path is not None:
+                # The previous section is complete
+                sys.stdout.write("\n")
+                sys.stdout.flush()
+            sys.stdout.write(f"{path}\n")
+            section_path = path
+        sys.stdout.write(f"{expression}\n")
+    sys.stdout.write("\n")
+    sys.stdout.flush()
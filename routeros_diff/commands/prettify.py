@@ -11,6 +11,13 @@ def run():
     parser.add_argument(
         "file", metavar="FILE", type=str, help="Path to the RouterOS configuration file"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Parse using a pool of this many worker processes (useful for very large files)",
+    )
     args = parser.parse_args()
 
-    print(RouterOSConfig.parse(Path(args.file).read_text()))
+    with Path(args.file).open() as f:
+        print(RouterOSConfig.parse_lines(f, workers=args.workers))
@@ -1,14 +1,27 @@
+import hashlib
 import re
-import shlex
 from dataclasses import dataclass, replace
 from ipaddress import ip_address
-from typing import Optional, List, Tuple
+from operator import itemgetter
+from typing import Optional, List, Tuple, Dict, Hashable, NamedTuple, Iterable
 
 from routeros_diff.arguments import ArgList, Arg
-from routeros_diff.settings import Settings
-from routeros_diff.utilities import find_expression
+from routeros_diff.settings import Settings, DEFAULT_SETTINGS, NaturalKey
+from routeros_diff.tokenizer import tokenize, Word
+from routeros_diff.utilities import find_expression, IndexedList, EXPRESSION_CHANGES
 from routeros_diff.exceptions import CannotDiff
 
+# The attributes of an expression which are changes to the expression itself
+# (rather than cached values) when set after the expression has been created
+_EXPRESSION_FIELDS = frozenset(
+    ("section_path", "command", "find_expression", "args", "settings")
+)
+
+_object_setattr = object.__setattr__
+
+# Matches IDs within comments. Eg: "blah blah [ ID:12345 ]"
+COMMENT_ID = re.compile(r"\[\s?ID:([a-zA-Z0-9-_]+)\s?\]")
+
 
 @dataclass
 class Expression:
@@ -22,6 +35,16 @@ class Expression:
 
     """
 
+    __slots__ = (
+        "section_path",
+        "command",
+        "find_expression",
+        "args",
+        "settings",
+        "_natural_key_and_id",
+        "_properties",
+    )
+
     # Eg: "/ip/address"
     section_path: str
 
@@ -36,12 +59,58 @@ class Expression:
 
     settings: Settings
 
-    def __post_init__(self):
+    def __init__(
+        self,
+        section_path: str,
+        command: str,
+        find_expression: Optional["Expression"],
+        args: ArgList,
+        settings: Settings,
+    ):
+        # Set directly, as __setattr__() is only for changes made after creation
+        _set = _object_setattr
+        _set(self, "section_path", section_path)
+        _set(self, "command", command)
+        _set(self, "find_expression", find_expression)
+        _set(self, "args", args)
+        _set(self, "settings", settings)
+        if isinstance(args, ArgList):
+            args.change_counter = EXPRESSION_CHANGES
+
         assert "=" not in self.command, (
             f"Not a valid command: {self.command}. "
             f"It looks like you have parsed an expression which does not start with a command."
         )
 
+    def __setattr__(self, name, value):
+        _object_setattr(self, name, value)
+        if name in _EXPRESSION_FIELDS:
+            # Changed in place, so lists of expressions must check for changes
+            if isinstance(value, ArgList):
+                value.change_counter = EXPRESSION_CHANGES
+            EXPRESSION_CHANGES.changed()
+
+    def _cache_key(self) -> tuple:
+        """Identifies everything which the cached properties are calculated from
+
+        Cached properties are discarded if any attribute is replaced, or if the args
+        (or those of the find expression) are changed in place. Note that
+        `dataclasses.replace()` creates a new expression, which will have no cached properties.
+        """
+        args = self.args
+        find_expression_ = self.find_expression
+        return (
+            self.section_path,
+            self.command,
+            self.settings,
+            args,
+            getattr(args, "version", None),
+            find_expression_,
+            getattr(find_expression_.args, "version", None)
+            if find_expression_
+            else None,
+        )
+
     def __str__(self):
         """Format this parsed expresion into a valid RouterOS string"""
         if self.find_expression:
@@ -85,43 +154,52 @@ class Expression:
 
             Expression.parse("add area=core network=100.127.0.0/24", "/routing ospf area")
         """
-        settings = settings or Settings()
+        settings = settings or DEFAULT_SETTINGS
 
-        # Remove escaped new lines where a key=value pair has been split by a new line
-        s = re.sub(r"= *\\\n *", "=", s)
+        try:
+            return Expression.from_words(tokenize(s), section_path, settings)
+        except ValueError as e:
+            raise ValueError(f"Error parsing line: {s}") from e
 
-        # Add whitespace around escaped new lines to ensure Python's shlex interprets
-        # them as escaped new lines, and not as values containing a new line character
-        s = s.replace("\\\n", " \\\n ")
+    @staticmethod
+    def from_words(words: List[Word], section_path: str, settings: Settings):
+        """Create an Expression from words produced by the tokenizer
+
+        The first word is the command. This may be followed by a sub-expression
+        (the find expression), and then by the expression's arguments.
+        """
+        if not words or words[0][0] is None or words[0][2] is not None:
+            raise ValueError("Expressions must start with a command")
 
-        # Sanity check
-        assert s.count("[") <= 1, f"Too many sub-expressions, cannot parse: {s}"
+        command = words[0][0]
+        words = words[1:]
 
-        # Regex matching for find expressions (using a regex isn't ideal, but it works)
-        find_expression_ = re.search(r"\[\s*(find.*?)\]", s)
-        if find_expression_:
-            find_expression_ = find_expression_.group(1).strip()
-            s = re.sub(r"\[.*?\]", "", s)
-            find_expression_ = Expression.parse(
-                find_expression_, section_path, settings
+        if words and words[0][0] is None:
+            # Eg: set [ find name=foo ] mtu=1500
+            find_expression_ = Expression.from_words(
+                words[0][2], section_path, settings
             )
+            words = words[1:]
         else:
             find_expression_ = None
 
-        # Use python's shlex module for the smart parsing
-        try:
-            command, *args = shlex.split(s)
-        except ValueError:
-            raise ValueError(f"Error parsing line: {s}")
-
-        # Parse the args (and drop out new lines)
-        args = [
-            Arg.parse(arg, section_path=section_path, settings=settings)
-            for arg in args
-            if arg != "\n"
-        ]
-
-        # And return our new Expression
+        args = []
+        for key, comparator, value in words:
+            if key is None:
+                raise ValueError(f"Unexpected sub-expression: [ {value} ]")
+            if isinstance(value, list):
+                # Eg: place-before=[ find name=foo ]
+                value = Expression.from_words(value, section_path, settings)
+            args.append(
+                Arg.from_token(
+                    key,
+                    value,
+                    comparator,
+                    section_path=section_path,
+                    settings=settings,
+                )
+            )
+
         return Expression(
             command=command,
             find_expression=find_expression_,
@@ -138,28 +216,8 @@ class Expression:
         Returns an expression which will migrate the old expression to
         be the new expression
         """
+        self._check_diffable(old)
         new_natural_key, new_natural_id = self.natural_key_and_id
-        old_natural_key, old_natural_id = old.natural_key_and_id
-
-        error_details = f"\n" f"    Old: {old}\n" f"    New: {self}\n"
-
-        if self.section_path != old.section_path:
-            raise CannotDiff(f"Section paths do not match.{error_details}")
-
-        if new_natural_key != old_natural_key:
-            raise CannotDiff(
-                f"Cannot diff expressions with mismatched natural Keys.{error_details}"
-            )
-
-        if not new_natural_id:
-            raise CannotDiff(
-                f"Cannot diff expressions which lack natural ID.{error_details}"
-            )
-
-        if new_natural_id != old_natural_id:
-            raise CannotDiff(
-                f"Cannot diff expressions with mismatched natural IDs.{error_details}"
-            )
 
         try:
             old_verbose_args = old_verbose.args if old_verbose else None
@@ -170,9 +228,11 @@ class Expression:
                 self.as_create(),
             ]
 
-        # No need to include the natural key
-        if new_natural_key and new_natural_key in diffed_args:
-            del diffed_args[new_natural_key]
+        # No need to include the natural key (or keys)
+        if new_natural_key:
+            for key in natural_key_parts(new_natural_key):
+                if key in diffed_args:
+                    del diffed_args[key]
 
         if not new_natural_key:
             # Positional ID
@@ -203,74 +263,159 @@ class Expression:
                 )
             ]
 
+    def has_changes(
+        self, old: "Expression", old_verbose: Optional["Expression"] = None
+    ) -> bool:
+        """Would diffing with the old expression give any expressions with key-value args?
+
+        This gives the same result as checking the expressions returned by `diff()`, and
+        raises CannotDiff in the same cases. However, no expressions are created unless the
+        args cannot be diffed (in which case the old expression would be deleted & recreated).
+        """
+        self._check_diffable(old)
+        natural_key = self.natural_key_and_id[0]
+        try:
+            return self.args.has_changes(
+                old.args,
+                old_verbose.args if old_verbose else None,
+                ignore_keys=natural_key_parts(natural_key) if natural_key else (),
+            )
+        except CannotDiff:
+            delete = old.as_delete()
+            create = self.as_create()
+            return bool(
+                (delete and delete.has_kw_args) or (create and create.has_kw_args)
+            )
+
+    def _check_diffable(self, old: "Expression"):
+        """Raise CannotDiff if this expression cannot be diffed with the old expression"""
+        new_natural_key, new_natural_id = self.natural_key_and_id
+        old_natural_key, old_natural_id = old.natural_key_and_id
+
+        if self.section_path != old.section_path:
+            problem = "Section paths do not match"
+        elif new_natural_key != old_natural_key:
+            problem = "Cannot diff expressions with mismatched natural Keys"
+        elif not new_natural_id:
+            problem = "Cannot diff expressions which lack natural ID"
+        elif new_natural_id != old_natural_id:
+            problem = "Cannot diff expressions with mismatched natural IDs"
+        else:
+            return
+
+        raise CannotDiff(f"{problem}.\n" f"    Old: {old}\n" f"    New: {self}\n")
+
     @property
     def natural_key_and_id(self) -> Tuple[Optional[str], Optional[str]]:
-        """Returns (key, id)"""
-
-        def _get():
-            # ID is in comment
-            if "comment" in self.args:
-                # Format: "blah blah [ ID:12345 ]"
-                matches = re.search(
-                    r"\[\s?ID:([a-zA-Z0-9-_]+)\s?\]", self.args["comment"].value
-                )
-                if matches:
-                    # Use the special key 'comment-id'
-                    return "comment-id", matches.group(1)
+        """Returns (key, id)
 
-            natural_key = self.settings.get_natural_key(self.section_path)
+        This is only calculated once, unless the expression is changed
+        """
+        cache_key = self._cache_key()
+        cached = getattr(self, "_natural_key_and_id", None)
+        if cached is not None and cached[0] == cache_key:
+            return cached[1]
+
+        natural_key_and_id = self._find_natural_key_and_id()
+        self._natural_key_and_id = (cache_key, natural_key_and_id)
+        return natural_key_and_id
+
+    def _find_natural_key_and_id(
+        self,
+    ) -> Tuple[Optional[NaturalKey], Optional[Hashable]]:
+        # ID is in comment
+        if "comment" in self.args:
+            # Format: "blah blah [ ID:12345 ]"
+            matches = COMMENT_ID.search(self.args["comment"].value)
+            if matches:
+                # Use the special key 'comment-id'
+                return "comment-id", matches.group(1)
+
+        natural_key = self.settings.get_natural_key(self.section_path)
+        if isinstance(natural_key, tuple):
+            # Compound key, so we need the value of every key.
+            # Eg: add list=blocked address=1.2.3.4
+            for args in (self.args, self.find_expression and self.find_expression.args):
+                if args and all(key in args for key in natural_key):
+                    return natural_key, tuple(
+                        normalise_natural_id(self.section_path, key, args[key])
+                        for key in natural_key
+                    )
+        else:
             # ID is in args
             try:
-                return natural_key, self.args[natural_key]
+                return natural_key, normalise_natural_id(
+                    self.section_path, natural_key, self.args[natural_key]
+                )
             except KeyError:
                 pass
 
-            # ID is in find expression
-            if self.find_expression:
-                # Eg: [ find name=foo ]
-                if natural_key in self.find_expression.args:
-                    return natural_key, self.find_expression.args[natural_key]
-
-                # Eg [ find where comment~ID:foo ]
-                args = self.find_expression.args
-                if (
-                    len(args) >= 2
-                    and args[0].key == "where"
-                    and args[1].key == "comment"
-                    and args[1].comparator == "~"
-                    and str(args[1].value).startswith("ID:")
-                ):
-                    return "comment-id", str(args[1].value).split(":", 1)[1]
-
-            # ID is positional arg
-            if self.args and self.args[0].is_positional:
-                return None, self.args[0].key
-
-            return None, None
-
-        def _post_process(natural_key, natural_id):
-            if self.section_path == "/ip address" and natural_key == "address":
-                # Normalise IPv4 addresses to contain the /32 prefix as this is required
-                # from find expressions to work
-                if "/" not in natural_id and ip_address(natural_id).version == 4:
-                    natural_id = f"{natural_id}/32"
-            return natural_key, natural_id
-
-        return _post_process(*_get())
+            # Eg: [ find name=foo ]
+            if self.find_expression and natural_key in self.find_expression.args:
+                return natural_key, normalise_natural_id(
+                    self.section_path,
+                    natural_key,
+                    self.find_expression.args[natural_key],
+                )
+
+        # ID is in find expression
+        if self.find_expression:
+            # Eg [ find where comment~ID:foo ]
+            args = self.find_expression.args
+            if (
+                len(args) >= 2
+                and args[0].key == "where"
+                and args[1].key == "comment"
+                and args[1].comparator == "~"
+                and str(args[1].value).startswith("ID:")
+            ):
+                return "comment-id", str(args[1].value).split(":", 1)[1]
+
+        # ID is positional arg
+        if self.args and self.args[0].is_positional:
+            return None, self.args[0].key
+
+        return None, None
+
+    def _get_properties(self) -> tuple:
+        """Get (has_kw_args, finds_by_default, is_single_object_expression)
+
+        These are only calculated once, unless the expression is changed
+        """
+        cache_key = self._cache_key()
+        cached = getattr(self, "_properties", None)
+        if cached is not None and cached[0] == cache_key:
+            return cached
+
+        has_kw_args = any(not a.is_positional for a in self.args)
+        finds_by_default = (
+            self.find_expression
+            and self.find_expression.args
+            and self.find_expression.args[0].key == "default"
+        )
+        is_single_object_expression = (
+            self.command == "set"
+            and self.args
+            and self.args[0].is_key_value
+            and not self.find_expression
+        )
+        cached = self._properties = (
+            cache_key,
+            has_kw_args,
+            finds_by_default,
+            is_single_object_expression,
+        )
+        return cached
 
     @property
     def has_kw_args(self):
         """Does this expression contain any kwargs?"""
-        return any(not a.is_positional for a in self.args)
+        return self._get_properties()[1]
 
     @property
     def finds_by_default(self):
         """Does this expression select it's target by selecting default=yes / default=no"""
-        return (
-            self.find_expression
-            and self.find_expression.args
-            and self.find_expression.args[0].key == "default"
-        )
+        return self._get_properties()[2]
 
     def as_delete(self):
         """Return this expression as a deletion"""
@@ -353,13 +498,203 @@ class Expression:
 
         For example, `/system/identity`
         """
-        return (
-            self.command == "set"
-            and self.args
-            and self.args[0].is_key_value
-            and not self.find_expression
-        )
+        return self._get_properties()[3]
 
     def with_ordered_args(self):
         """Return a new Expression where the arguments have been deterministically ordered"""
         return replace(self, args=self.args.sort())
+
+    def fingerprint(self) -> bytes:
+        """Get a hash of this expression
+
+        Expressions have the same fingerprint if they would be equal once their args
+        are ordered (see `with_ordered_args()`). Quoting is ignored.
+        """
+        positional = []
+        key_values = []
+        for arg in self.args:
+            if arg.is_positional:
+                positional.append(arg.key)
+            else:
+                key_values.append((arg.key, arg.comparator, str(arg.value)))
+        return expression_fingerprint(
+            self.command,
+            str(self.find_expression) if self.find_expression else "",
+            positional,
+            key_values,
+        )
+
+
+def expression_fingerprint(
+    command: str,
+    find_expression_: str,
+    positional: List[str],
+    key_values: List[Tuple[str, str, str]],
+) -> bytes:
+    """Hash the parts of an expression (see `Expression.fingerprint()`)
+
+    Takes the expression's positional args, plus a (key, comparator, value) tuple for
+    every other arg. These may be in any order.
+    """
+    key_values.sort(key=itemgetter(0))
+    parts = [command, find_expression_, *positional, "\x1e"]
+    for key_value in key_values:
+        parts.extend(key_value)
+    return hashlib.blake2b(
+        "\x1f".join(parts).encode("utf8", "surrogatepass"), digest_size=16
+    ).digest()
+
+
+def combine_fingerprints(fingerprints: Iterable[bytes], ordered: bool) -> bytes:
+    """Hash several fingerprints together
+
+    If `ordered` is not set then the order of the fingerprints is ignored
+    """
+    if not ordered:
+        fingerprints = sorted(fingerprints)
+    return hashlib.blake2b(b"".join(fingerprints), digest_size=16).digest()
+
+
+def normalise_natural_id(section_path: str, natural_key: str, natural_id):
+    """Normalise the value of a natural key, as needed for find expressions to work"""
+    if section_path == "/ip address" and natural_key == "address":
+        # Normalise IPv4 addresses to contain the /32 prefix as this is required
+        # from find expressions to work
+        if "/" not in natural_id and ip_address(str(natural_id)).version == 4:
+            natural_id = f"{natural_id}/32"
+    return natural_id
+
+
+def natural_key_parts(natural_key: NaturalKey) -> Tuple[str, ...]:
+    """Get the individual keys within a (possibly compound) natural key"""
+    return natural_key if isinstance(natural_key, tuple) else (natural_key,)
+
+
+class Classification(NamedTuple):
+    """Describes how the expressions in a section identify their entities
+
+    This decides how the section is diffed (see `Section.diff()`)
+    """
+
+    # Every expression sets values on a single object. Eg. /system identity
+    single_object: bool
+    # Every expression finds the default entity. Eg. set [ find default=yes ] foo=bar
+    default_only: bool
+    # At least one expression finds the default entity
+    any_default: bool
+    # Every expression has a natural ID
+    natural_ids: bool
+
+
+class ExpressionList(IndexedList):
+    """The list of expressions within a section
+
+    This indexes the expressions by their natural IDs, so that
+    expressions can be found by ID without searching the entire list.
+    The list's classification is also calculated only once.
+
+    These are discarded if the list changes, or if any expression is changed
+    in place (see `Expression._cache_key()`). Changes to expressions are counted
+    by `EXPRESSION_CHANGES`, so the expressions only need to be checked again
+    if some expression has changed since they were last checked.
+    """
+
+    __slots__ = (
+        "_classification",
+        "_fingerprint",
+        "_expression_keys",
+        "_checked_changes",
+    )
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._classification = None
+        self._fingerprint = None
+        self._expression_keys = None
+        self._checked_changes = None
+
+    def _changed(self):
+        super()._changed()
+        self._classification = None
+        self._fingerprint = None
+        self._expression_keys = None
+        self._checked_changes = None
+
+    def _check_expressions(self):
+        """Discard our cached values if any expression has changed since they were calculated
+
+        This is constant time unless an expression (in any list) has been changed in place
+        since the last check, in which case every expression is checked.
+        """
+        changes = EXPRESSION_CHANGES.count
+        if changes == self._checked_changes:
+            return
+
+        keys = self._expression_keys
+        if keys is not None:
+            for expression, key in zip(self, keys):
+                if expression._cache_key() != key:
+                    self._changed()
+                    keys = None
+                    break
+
+        if keys is None:
+            # Share the keys cached by each expression, rather than creating more
+            keys = self._expression_keys = []
+            for expression in self:
+                expression.natural_key_and_id
+                keys.append(expression._natural_key_and_id[0])
+        self._checked_changes = changes
+
+    def fingerprint(self, ordered: bool) -> bytes:
+        """Get a hash of these expressions (see `Expression.fingerprint()`)
+
+        If `ordered` is not set then the order of the expressions is ignored. This is
+        only calculated once, unless the list or its expressions change.
+        """
+        self._check_expressions()
+        if self._fingerprint is None or self._fingerprint[0] != ordered:
+            self._fingerprint = (
+                ordered,
+                combine_fingerprints((e.fingerprint() for e in self), ordered),
+            )
+        return self._fingerprint[1]
+
+    def natural_id_positions(self) -> Dict[Optional[Hashable], int]:
+        """Get the position of the expression with each natural ID
+
+        Where several expressions have the same natural ID, this gives the position of the first
+        """
+        self._check_expressions()
+        return self._get_index()
+
+    def _build_index(self) -> Dict[Optional[Hashable], int]:
+        positions = {}
+        for i, expression in enumerate(self):
+            positions.setdefault(expression.natural_key_and_id[1], i)
+        return positions
+
+    def classify(self) -> Classification:
+        """Classify these expressions, in a single pass
+
+        This is only calculated once, unless the list or its expressions change
+        """
+        self._check_expressions()
+        if self._classification is None:
+            single_object = default_only = bool(self)
+            any_default = False
+            for expression in self:
+                if expression.finds_by_default:
+                    any_default = True
+                else:
+                    default_only = False
+                if not expression.is_single_object_expression:
+                    single_object = False
+
+            self._classification = Classification(
+                single_object=single_object,
+                default_only=default_only,
+                any_default=any_default,
+                natural_ids=None not in self._get_index(),
+            )
+        return self._classification
@@ -0,0 +1,200 @@
+import io
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import (
+    Hashable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from routeros_diff.parser import RouterOSConfig
+from routeros_diff.settings import Settings
+
+# The number of routers waiting to be diffed by each worker process. This keeps
+# the workers busy without holding every router's configuration in memory at once
+FLEET_QUEUE_SIZE_PER_WORKER = 4
+
+# A configuration, either as text or already parsed
+Config = Union[str, RouterOSConfig]
+
+
+class FleetResult(NamedTuple):
+    """The diff for a single router"""
+
+    key: Hashable
+    # The diff, or None if the router could not be diffed
+    diff: Optional[RouterOSConfig]
+    # Why the router could not be parsed or diffed
+    error: Optional[Exception] = None
+
+
+class FleetDiffer:
+    """Diff one new configuration (such as a template) against many old configurations
+
+    The new configuration is parsed & indexed only once, and is then reused for every
+    diff. For example:
+
+        differ = FleetDiffer(template)
+        for result in differ.diff_many(exports.items(), workers=8):
+            print(result.key, result.diff)
+        print(differ.routers_per_second)
+
+    Each old configuration is given as a (key, old) or (key, old, old_verbose) tuple, where
+    the key identifies the router. Configurations may be strings or parsed `RouterOSConfig`s.
+    """
+
+    def __init__(self, new: Config, settings: Union[Settings, dict] = None):
+        if isinstance(new, str):
+            new = RouterOSConfig.parse(new, settings)
+        self.new = new
+        self.settings = new.settings
+
+        # Build the indexes & classifications now, so that every diff can reuse them
+        for section in self.new.sections.by_path().values():
+            section.classify()
+            section.natural_id_positions()
+
+        self.routers_diffed = 0
+        self.seconds = 0.0
+
+    @property
+    def routers_per_second(self) -> float:
+        """The throughput of the most recent (or current) call to diff_many()"""
+        return self.routers_diffed / self.seconds if self.seconds else 0.0
+
+    def diff(self, old: Config, old_verbose: Optional[Config] = None) -> RouterOSConfig:
+        """Diff the new configuration against a single old configuration"""
+        return self.new.diff(self._parse(old), self._parse(old_verbose))
+
+    def diff_many(
+        self,
+        olds: Iterable[Tuple[Hashable, Config]],
+        workers: int = None,
+    ) -> Iterator[FleetResult]:
+        """Diff the new configuration against each old configuration
+
+        Yields a `FleetResult` for each router as soon as it has been diffed.
+        Set `workers` to parse & diff using a pool of that many worker processes.
+        The new configuration is then sent to each worker only once, and results
+        are yielded in the order they finish (rather than the order given).
+        """
+        self.routers_diffed = 0
+        self.seconds = 0.0
+        start = time.perf_counter()
+
+        if not workers or workers <= 1:
+            for key, *old in olds:
+                yield self._diff_one(key, *old)
+                self.routers_diffed += 1
+                self.seconds = time.perf_counter() - start
+            return
+
+        with io.BytesIO() as f:
+            self.new.dump(f)
+            new_data = f.getvalue()
+
+        olds = iter(olds)
+        pending = set()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(new_data, self.settings),
+        ) as executor:
+            while True:
+                # Keep the queue topped up
+                while len(pending) < workers * FLEET_QUEUE_SIZE_PER_WORKER:
+                    try:
+                        key, *old = next(olds)
+                    except StopIteration:
+                        break
+                    pending.add(
+                        executor.submit(_diff_in_worker, key, *map(_encode_config, old))
+                    )
+                if not pending:
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, data, error = future.result()
+                    diff = None
+                    if data is not None:
+                        with io.BytesIO(data) as f:
+                            diff = RouterOSConfig.load(f, self.settings)
+                    yield FleetResult(key=key, diff=diff, error=error)
+                    self.routers_diffed += 1
+                    self.seconds = time.perf_counter() - start
+
+    def _diff_one(
+        self, key: Hashable, old: Config, old_verbose: Optional[Config] = None
+    ) -> FleetResult:
+        # A router which cannot be parsed or diffed should not stop the others being diffed
+        try:
+            return FleetResult(key=key, diff=self.diff(old, old_verbose))
+        except Exception as e:
+            return FleetResult(key=key, diff=None, error=e)
+
+    def _parse(self, config: Optional[Config]) -> Optional[RouterOSConfig]:
+        if isinstance(config, str):
+            return RouterOSConfig.parse(config, self.settings)
+        return config
+
+
+# The FleetDiffer within each worker process (see _init_worker())
+_worker_differ: Optional[FleetDiffer] = None
+
+
+def _init_worker(new_data: bytes, settings: Settings):
+    """Load the new configuration once per worker process"""
+    global _worker_differ
+    with io.BytesIO(new_data) as f:
+        new = RouterOSConfig.load(f, settings)
+
+    _worker_differ = FleetDiffer(new)
+
+
+def _encode_config(config: Optional[Config]) -> Union[str, bytes, None]:
+    """Parsed configurations are sent to workers as snapshots"""
+    if isinstance(config, RouterOSConfig):
+        with io.BytesIO() as f:
+            config.dump(f)
+            return f.getvalue()
+    return config
+
+
+def _decode_config(config: Union[str, bytes, None]) -> Optional[Config]:
+    if isinstance(config, bytes):
+        with io.BytesIO(config) as f:
+            return RouterOSConfig.load(f, _worker_differ.settings)
+    return config
+
+
+def _diff_in_worker(
+    key: Hashable, old: Union[str, bytes], old_verbose: Union[str, bytes, None] = None
+) -> Tuple[Hashable, Optional[bytes], Optional[Exception]]:
+    """Diff a single router, returning the diff as a snapshot. Runs within a worker process"""
+    try:
+        old, old_verbose = _decode_config(old), _decode_config(old_verbose)
+    except Exception as e:
+        return key, None, _picklable(e)
+
+    result = _worker_differ._diff_one(key, old, old_verbose)
+    if result.diff is None:
+        return key, None, _picklable(result.error)
+
+    with io.BytesIO() as f:
+        result.diff.dump(f)
+        return key, f.getvalue(), None
+
+
+def _picklable(error: Exception) -> Exception:
+    """Errors are sent back from worker processes, so must be able to be pickled"""
+    try:
+        pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+    return error
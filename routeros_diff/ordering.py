@@ -0,0 +1,192 @@
+from bisect import bisect_left
+from typing import Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+# Sections without natural IDs are aligned (see align()) rather than being wiped & recreated,
+# but only if they differ by no more than this many removals & additions. Alignment time is
+# proportional to the section size multiplied by this, and memory to the square of this.
+ALIGNMENT_MAX_EDITS = 1000
+
+
+class Placement(NamedTuple):
+    """An expression which must be created or moved in order to be correctly positioned"""
+
+    natural_id: Hashable
+    # The ID of the expression to place this one before. None places it at the end
+    before: Optional[Hashable]
+    # Does this expression need to be created (rather than moved)?
+    create: bool
+
+
+def longest_increasing_subsequence(values: Sequence[int]) -> List[int]:
+    """Get the positions of a longest (strictly) increasing subsequence of values
+
+    For example, `[3, 1, 2, 5, 4]` gives `[1, 2, 3]` (ie. the values `1, 2, 5`).
+
+    This runs in O(n log n) time. We keep the position of the smallest value which
+    ends an increasing subsequence of each length, along with the position of the
+    previous value in each subsequence (which we then follow back to recover the
+    subsequence itself).
+    """
+    # tails[k] is the position of the smallest value ending a subsequence of length k + 1
+    tails: List[int] = []
+    tail_values: List[int] = []
+    previous: List[Optional[int]] = [None] * len(values)
+
+    for i, value in enumerate(values):
+        k = bisect_left(tail_values, value)
+        if k:
+            previous[i] = tails[k - 1]
+        if k == len(tails):
+            tails.append(i)
+            tail_values.append(value)
+        else:
+            tails[k] = i
+            tail_values[k] = value
+
+    subsequence = []
+    i = tails[-1] if tails else None
+    while i is not None:
+        subsequence.append(i)
+        i = previous[i]
+    subsequence.reverse()
+    return subsequence
+
+
+def plan_placements(
+    new_ids: Sequence[Hashable], old_positions: Dict[Hashable, int]
+) -> List[Placement]:
+    """Plan how to order the old expressions in the same way as the new expressions
+
+    `new_ids` is the natural ID of each new expression (in order), and `old_positions`
+    gives the position of each natural ID in the old section. Expressions which
+    have been removed are ignored, as they will already have been deleted.
+
+    The expressions which appear in both sections and which form the longest increasing
+    subsequence of old positions are already in the correct order, and are left where they
+    are. Every other surviving expression is moved, and new expressions are created. This
+    is the minimum number of moves.
+
+    Each placement is relative to the next expression which is left in place (these never
+    move), or is at the end if there is no such expression. The placements must therefore
+    be applied in the order given, so that expressions placed before the same expression
+    end up in the correct order.
+    """
+    seen = set()
+    ids = []
+    for natural_id in new_ids:
+        # Only the first expression with each ID is used (as in Section.diff())
+        if natural_id not in seen:
+            seen.add(natural_id)
+            ids.append(natural_id)
+
+    surviving = [natural_id for natural_id in ids if natural_id in old_positions]
+    stable = {
+        surviving[i]
+        for i in longest_increasing_subsequence(
+            [old_positions[natural_id] for natural_id in surviving]
+        )
+    }
+
+    placements = []
+    before = None
+    for natural_id in reversed(ids):
+        if natural_id in stable:
+            before = natural_id
+        else:
+            placements.append(
+                Placement(
+                    natural_id=natural_id,
+                    before=before,
+                    create=natural_id not in old_positions,
+                )
+            )
+    placements.reverse()
+    return placements
+
+
+def align(
+    old: Sequence[Hashable],
+    new: Sequence[Hashable],
+    max_edits: int = None,
+) -> Optional[List[Tuple[int, int]]]:
+    """Find a longest common subsequence of old & new
+
+    Returns the (old position, new position) of each value in the common subsequence.
+    All other values in old need to be removed, and all other values in new need to be
+    added. Returns None if this would need more than `max_edits` removals & additions
+    (`ALIGNMENT_MAX_EDITS` by default).
+
+    This uses Myers' algorithm, which takes O((N + M) D) time (where D is the number of
+    edits), after first skipping any common prefix & suffix. Values are compared for
+    equality only, so should be cheap to compare (ideally small integers).
+    """
+    if max_edits is None:
+        max_edits = ALIGNMENT_MAX_EDITS
+
+    n, m = len(old), len(new)
+    prefix = 0
+    while prefix < n and prefix < m and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < n - prefix
+        and suffix < m - prefix
+        and old[n - suffix - 1] == new[m - suffix - 1]
+    ):
+        suffix += 1
+
+    common = [(i, i) for i in range(prefix)]
+    a = old[prefix : n - suffix]
+    b = new[prefix : m - suffix]
+    n, m = len(a), len(b)
+
+    # v[k + offset] is the furthest x reached on diagonal k (where k = x - y). We keep
+    # the part of v which was in use before each round, so we can then trace back
+    offset = max_edits + 1
+    v = [0] * (2 * offset + 1)
+    trace = []
+    for d in range(max_edits + 1):
+        trace.append(v[offset - d - 1 : offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                # Move down (an addition)
+                x = v[offset + k + 1]
+            else:
+                # Move right (a removal)
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                break
+        else:
+            continue
+        break
+    else:
+        return None
+
+    # Trace back from the end, collecting each diagonal (ie. common) step
+    middle = []
+    x, y = n, m
+    for d in range(len(trace) - 1, -1, -1):
+        v_d = trace[d]
+        k = x - y
+        # v_d covers diagonals -d - 1 to d + 1
+        if k == -d or (k != d and v_d[k + d] < v_d[k + d + 2]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = v_d[previous_k + d + 1]
+        previous_y = previous_x - previous_k
+        while x > previous_x and y > previous_y:
+            x -= 1
+            y -= 1
+            middle.append((prefix + x, prefix + y))
+        x, y = previous_x, previous_y
+    middle.reverse()
+
+    common.extend(middle)
+    common.extend((len(old) - suffix + i, len(new) - suffix + i) for i in range(suffix))
+    return common
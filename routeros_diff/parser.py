@@ -1,14 +1,36 @@
+import io
+import hashlib
+import itertools
+import mmap
+import os
 import re
-from copy import copy
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Tuple, Optional, Dict, Union
+from pathlib import Path
+from typing import List, Tuple, Optional, Dict, Union, Iterable, Iterator, BinaryIO
 
 import dateutil.parser
 
-from routeros_diff.settings import Settings
+from routeros_diff import snapshot
+from routeros_diff.settings import Settings, DEFAULT_SETTINGS
 from routeros_diff.exceptions import CannotDiff
-from routeros_diff.sections import Section
+from routeros_diff.expressions import Expression, combine_fingerprints
+from routeros_diff.sections import Section, SectionList
+
+_LEADING_WHITESPACE = re.compile(rb"\s*")
+
+# Configurations smaller than this (in characters) are always parsed within the
+# current process, as the overhead of a process pool would outweigh any benefit
+PARALLEL_PARSE_MIN_SIZE = 1_000_000
+
+# Sections with fewer expressions than this (counting both the new & old section)
+# are always diffed within the current process when diffing with a process pool
+PARALLEL_DIFF_MIN_EXPRESSIONS = 5_000
+
+# Sections larger than this (in characters) are split up when parsing
+# with a process pool, so that they can be parsed by several workers at once
+PARALLEL_PARSE_CHUNK_SIZE = 100_000
 
 
 @dataclass
@@ -30,6 +52,21 @@ class RouterOSConfig:
 
     settings: Settings = None
 
+    # A hash of the source text of each section, used by reparse()
+    section_digests: Optional[Dict[str, bytes]] = field(
+        default=None, repr=False, compare=False
+    )
+
+    # The normalised source text, from which section_digests
+    # are calculated when first needed by reparse()
+    _source: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name, value):
+        # Sections are stored in a SectionList, which indexes them by path
+        if name == "sections" and not isinstance(value, SectionList):
+            value = SectionList(value)
+        super().__setattr__(name, value)
+
     def __str__(self):
         return "\n".join(str(s) for s in self.sections if s.expressions)
 
@@ -38,11 +75,22 @@ class RouterOSConfig:
         return f'<span class="ros">{html}</span>'
 
     @classmethod
-    def parse(cls, s: str, settings: Union[Settings, dict] = None):
-        """Takes an entire RouterOS configuration blob"""
-        settings = settings or Settings()
-        if isinstance(settings, dict):
-            settings = Settings(**settings)
+    def parse(
+        cls,
+        s: str,
+        settings: Union[Settings, dict] = None,
+        workers: int = None,
+        lazy: bool = False,
+    ):
+        """Takes an entire RouterOS configuration blob
+
+        Set `workers` to parse sections using a pool of that many worker processes.
+        Small configurations will always be parsed within the current process.
+
+        Set `lazy` to only parse each section when its expressions are first
+        accessed. Sections which are never accessed will never be parsed.
+        """
+        settings = cls._normalise_settings(settings)
 
         # Normalise new lines
         s = s.strip().replace("\r\n", "\n")
@@ -50,115 +98,698 @@ class RouterOSConfig:
         # Parse out version & timestamp
         first_line: str
         first_line, *_ = s.split("\n", maxsplit=1)
-        if first_line.startswith("#") and " by RouterOS " in first_line:
-            first_line = first_line.strip("#").strip()
-            timestamp, *_ = first_line.split(" by ")
-            timestamp = dateutil.parser.parse(timestamp)
-            router_os_version = re.search(r"(\d\.[\d\.]+\d)", first_line).group(1)
-            router_os_version = tuple([int(x) for x in router_os_version.split(".")])
-        else:
-            timestamp = None
-            router_os_version = None
+        timestamp, router_os_version = cls._parse_header(first_line)
+
+        if lazy:
+            config = cls(
+                timestamp=timestamp,
+                router_os_version=router_os_version,
+                sections=[
+                    Section.lazy(path, s, section_spans, settings=settings)
+                    for path, section_spans in cls._section_spans(s).items()
+                ],
+                settings=settings,
+            )
+            config._source = s
+            return config
 
         # Split on lines that start with a slash as these are our sections
         sections = ("\n" + s).split("\n/")
         # Add the slash back in, and skip off the first comment
         sections = ["/" + s for s in sections[1:]]
 
-        # Note that this dict will maintain it's ordering
-        parsed_sections: Dict[str, Section] = {}
-        for section in sections:
-            # Parse the section
-            parsed_section = Section.parse(section, settings=settings)
-            if parsed_section.path not in parsed_sections:
-                # Not seen this section, so store it as normal
-                parsed_sections[parsed_section.path] = parsed_section
+        config = cls._from_sections(
+            timestamp=timestamp,
+            router_os_version=router_os_version,
+            sections=cls._parse_sections(sections, settings, workers),
+            settings=settings,
+        )
+        config._source = s
+        return config
+
+    @classmethod
+    def reparse(
+        cls,
+        s: str,
+        previous: "RouterOSConfig",
+        settings: Union[Settings, dict] = None,
+    ):
+        """Parse an updated configuration, reusing unchanged sections from a previous parse
+
+        Only sections whose text has changed since `previous` was parsed will
+        be parsed again. All other sections are reused as-is (so make sure
+        `previous` has not been modified). For example:
+
+            config = RouterOSConfig.parse(template)
+            ...
+            config = RouterOSConfig.reparse(edited_template, config)
+
+        Settings default to those used by `previous`. Nothing can be reused if
+        `previous` was not created by `parse()` or `reparse()`, or if different
+        settings are used.
+        """
+        settings = cls._normalise_settings(settings or previous.settings)
+
+        previous_digests = previous._get_section_digests() or {}
+        if settings is not previous.settings and (
+            previous.settings is None
+            or settings.fingerprint() != previous.settings.fingerprint()
+        ):
+            previous_digests = {}
+        previous_sections = previous.sections.by_path()
+
+        # Normalise new lines
+        s = s.strip().replace("\r\n", "\n")
+
+        # Parse out version & timestamp
+        first_line, *_ = s.split("\n", maxsplit=1)
+        timestamp, router_os_version = cls._parse_header(first_line)
+
+        sections = []
+        section_digests = {}
+        for path, section_spans in cls._section_spans(s).items():
+            digest = section_digests[path] = _section_digest(s, section_spans)
+            if previous_digests.get(path) == digest and path in previous_sections:
+                # Unchanged, so no need to parse it again
+                sections.append(previous_sections[path])
             else:
-                # This is a duplicate section, so append its expressions to the existing section
-                parsed_sections[parsed_section.path].expressions.extend(
-                    parsed_section.expressions
+                sections.append(
+                    Section.merge(
+                        [
+                            Section.parse(s[start:end], settings=settings)
+                            for start, end in section_spans
+                        ]
+                    )
                 )
 
         return cls(
             timestamp=timestamp,
             router_os_version=router_os_version,
-            sections=list(parsed_sections.values()),
+            sections=sections,
             settings=settings,
+            section_digests=section_digests,
         )
 
-    def keys(self):
-        """Get all section paths in this config file"""
-        return [section.path for section in self.sections]
+    def _get_section_digests(self) -> Optional[Dict[str, bytes]]:
+        """Get the section digests, calculating them from the source text if needed"""
+        if self.section_digests is None and self._source is not None:
+            self.section_digests = {
+                path: _section_digest(self._source, section_spans)
+                for path, section_spans in self._section_spans(self._source).items()
+            }
+        return self.section_digests
 
-    def __getitem__(self, path):
-        """Get the section at the given path"""
-        for section in self.sections:
-            if section.path == path:
-                return section
-        raise KeyError(path)
+    @staticmethod
+    def _section_spans(s: str) -> Dict[str, List[Tuple[int, int]]]:
+        """Find where each section appears in the string, keyed by section path
 
-    def __contains__(self, path):
-        """Is the given section path in this config file?"""
-        return path in self.keys()
+        Sections which appear more than once will have more than one span
+        """
+        # Note that this dict will maintain its ordering
+        spans: Dict[str, List[Tuple[int, int]]] = {}
+        for start, end in _iter_section_spans(s, 0, len(s)):
+            path_end = s.find("\n", start, end)
+            path = s[start : end if path_end == -1 else path_end].strip()
+            spans.setdefault(path, []).append((start, end))
+        return spans
 
-    def get(self, path, default=None):
-        """Get the section for the given section path"""
-        try:
-            return self[path]
-        except KeyError:
-            return default
+    @classmethod
+    def parse_lines(
+        cls,
+        lines: Iterable[str],
+        settings: Union[Settings, dict] = None,
+        workers: int = None,
+    ):
+        """Takes a RouterOS configuration as a file object or an iterable of lines
 
-    def diff(
-        self, old: "RouterOSConfig", old_verbose: Optional["RouterOSConfig"] = None
+        Unlike `parse()`, the configuration is never held in memory as a single
+        string (unless `workers` is set, see `iter_parse()`). For example:
+
+            with open("config.rsc") as f:
+                config = RouterOSConfig.parse_lines(f)
+        """
+        settings = cls._normalise_settings(settings)
+        lines = iter(lines)
+
+        # Parse out version & timestamp from the first non-blank line
+        first_line = ""
+        for first_line in lines:
+            if first_line.strip():
+                break
+        timestamp, router_os_version = cls._parse_header(first_line.strip())
+
+        return cls._from_sections(
+            timestamp=timestamp,
+            router_os_version=router_os_version,
+            sections=cls.iter_parse(
+                itertools.chain([first_line], lines), settings, workers
+            ),
+            settings=settings,
+        )
+
+    @classmethod
+    def parse_buffer(
+        cls,
+        buffer: Union[bytes, bytearray, mmap.mmap],
+        settings: Union[Settings, dict] = None,
+        encoding: str = "utf8",
     ):
-        """Diff this config file with an old config file
+        """Takes an entire RouterOS configuration as bytes, or as a bytes-like buffer
 
-        Will return a new config file which can be used to
-        migrate from the old config to the new config.
+        Section boundaries and line continuations are found within the buffer
+        itself, and only the individual lines are decoded as they are parsed.
+        This is most useful with a memory-mapped file, see `parse_file()`.
+        """
+        settings = cls._normalise_settings(settings)
+        start = _LEADING_WHITESPACE.match(buffer).end()
+        end = len(buffer)
+
+        # Parse out version & timestamp
+        first_line_end = buffer.find(b"\n", start)
+        first_line = buffer[start : end if first_line_end == -1 else first_line_end]
+        timestamp, router_os_version = cls._parse_header(
+            first_line.decode(encoding).strip()
+        )
+
+        return cls._from_sections(
+            timestamp=timestamp,
+            router_os_version=router_os_version,
+            sections=cls._iter_parse_buffer(buffer, start, end, settings, encoding),
+            settings=settings,
+        )
+
+    @classmethod
+    def parse_file(
+        cls,
+        path: Union[str, Path],
+        settings: Union[Settings, dict] = None,
+        encoding: str = "utf8",
+    ):
+        """Takes the path to a RouterOS configuration file, and parses it via a memory map
+
+        This avoids reading the entire file into memory, which is useful
+        for very large configurations.
+        """
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be memory-mapped
+                return cls.parse("", settings)
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return cls.parse_buffer(buffer, settings, encoding)
+
+    @staticmethod
+    def _iter_parse_buffer(
+        buffer: Union[bytes, bytearray, mmap.mmap],
+        start: int,
+        end: int,
+        settings: Settings,
+        encoding: str,
+    ) -> Iterator[Section]:
+        """Parse sections from buffer[start:end]"""
+        for section_start, section_end in _iter_section_spans(buffer, start, end):
+            yield Section.parse_buffer(
+                buffer,
+                section_start,
+                section_end,
+                settings=settings,
+                encoding=encoding,
+            )
+
+    @classmethod
+    def iter_parse(
+        cls,
+        lines: Iterable[str],
+        settings: Union[Settings, dict] = None,
+        workers: int = None,
+    ) -> Iterator[Section]:
+        """Parse sections from a file object or an iterable of lines
+
+        Each section is yielded as soon as it has been read in its entirety,
+        so memory use is bounded by the size of the largest section rather than
+        by the size of the file. Note that duplicate sections are yielded
+        as-is, they are not merged.
+
+        Set `workers` to parse sections using a pool of that many worker processes.
+        In this case all lines will be read upfront, and large sections may be
+        yielded in several parts.
+        """
+        settings = cls._normalise_settings(settings)
+        return cls._parse_sections(cls._iter_section_texts(lines), settings, workers)
+
+    @staticmethod
+    def _iter_section_texts(lines: Iterable[str]) -> Iterator[str]:
+        """Group lines into the text of each section"""
+        section_lines = []
+
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not section_lines:
+                # Skip any header comments preceding the first section
+                line = line.lstrip()
+                if line.startswith("/"):
+                    section_lines.append(line)
+            elif line.startswith("/"):
+                # A new section, so the current section is complete
+                yield "\n".join(section_lines)
+                section_lines = [line]
+            else:
+                section_lines.append(line)
+
+        if section_lines:
+            yield "\n".join(section_lines)
+
+    @staticmethod
+    def _parse_sections(
+        section_texts: Iterable[str], settings: Settings, workers: Optional[int]
+    ) -> Iterator[Section]:
+        """Parse the text of each section, in order
+
+        Uses a process pool if `workers` is set and there is enough to parse.
+        """
+        section_texts = iter(section_texts)
+        if not workers or workers <= 1:
+            for section_text in section_texts:
+                yield Section.parse(section_text, settings=settings)
+            return
+
+        # Only use the pool for larger configurations
+        buffered_texts = []
+        size = 0
+        for section_text in section_texts:
+            buffered_texts.append(section_text)
+            size += len(section_text)
+            if size >= PARALLEL_PARSE_MIN_SIZE:
+                break
+        else:
+            for section_text in buffered_texts:
+                yield Section.parse(section_text, settings=settings)
+            return
+
+        # Split up large sections so that they can be shared between workers.
+        # The parts will be merged back together as duplicate sections.
+        chunks = (
+            chunk
+            for section_text in itertools.chain(buffered_texts, section_texts)
+            for chunk in _split_section_text(section_text, PARALLEL_PARSE_CHUNK_SIZE)
+        )
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Parsed sections are sent back as snapshots, as these are
+            # much faster to load than pickled sections
+            for data in executor.map(
+                _parse_section, chunks, itertools.repeat(settings)
+            ):
+                with io.BytesIO(data) as f:
+                    yield from snapshot.load(f, settings)[2]
+
+    def _pair_sections(
+        self, old: "RouterOSConfig", old_verbose: Optional["RouterOSConfig"] = None
+    ) -> Iterator[Tuple[Section, Section, Optional[Section]]]:
+        """Get the (new, old, old verbose) sections to diff, for each section path
+
+        Sections which are present in only one config are paired with an empty section,
+        and sections which are identical in both configs are skipped.
         """
-        new_sections = self.keys()
-        old_sections = old.keys()
-        diffed_sections = []
+        new_sections = self.sections.by_path()
+        old_sections = old.sections.by_path()
 
         # Sanity checks
-        if len(new_sections) != len(set(new_sections)):
+        if len(new_sections) != len(self.sections):
             raise CannotDiff("Duplicate section names present in new config")
 
-        if len(old_sections) != len(set(old_sections)):
+        if len(old_sections) != len(old.sections):
             raise CannotDiff("Duplicate section names present in old config")
 
         # Create a list of sections paths which are present in
         # either config file
-        section_paths = copy(new_sections)
+        section_paths = list(new_sections)
         for section_path in old_sections:
             if section_path not in new_sections:
                 section_paths.append(section_path)
 
-        # Diff each section
         for section_path in section_paths:
-            if section_path in new_sections:
-                new_section = self[section_path]
-            else:
+            new_section = new_sections.get(section_path)
+            old_section = old_sections.get(section_path)
+            if (
+                new_section is not None
+                and old_section is not None
+                and new_section.fingerprint() == old_section.fingerprint()
+            ):
+                # Identical sections, so there is nothing to diff
+                continue
+
+            if new_section is None:
                 # Section not found in new config, so just create a dummy empty section
                 new_section = Section(
                     path=section_path, expressions=[], settings=self.settings
                 )
 
-            if section_path in old_sections:
-                old_section = old[section_path]
-            else:
+            if old_section is None:
                 # Section not found in old config, so just create a dummy empty section
                 old_section = Section(
                     path=section_path, expressions=[], settings=self.settings
                 )
 
             old_section_verbose = old_verbose.get(section_path) if old_verbose else None
-            diffed_sections.append(
-                new_section.diff(old_section, old_verbose=old_section_verbose)
+            yield new_section, old_section, old_section_verbose
+
+    def has_changes(
+        self, old: "RouterOSConfig", old_verbose: Optional["RouterOSConfig"] = None
+    ) -> bool:
+        """Would diffing this config with the old config produce any changes?
+
+        This is the same as `bool(self.diff(old, old_verbose).sections)`, but stops as soon
+        as the first change is found, and avoids creating the diff where possible
+        (see `Section.has_changes()`).
+        """
+        return any(
+            new_section.has_changes(old_section, old_section_verbose)
+            for new_section, old_section, old_section_verbose in self._pair_sections(
+                old, old_verbose
+            )
+        )
+
+    def changed_sections(
+        self, old: "RouterOSConfig", old_verbose: Optional["RouterOSConfig"] = None
+    ) -> List[str]:
+        """Get the paths of the sections which would appear when diffing with the old config
+
+        These are in the same order as the sections of `self.diff(old, old_verbose)`
+        """
+        return [
+            new_section.path
+            for new_section, old_section, old_section_verbose in self._pair_sections(
+                old, old_verbose
             )
+            if new_section.has_changes(old_section, old_section_verbose)
+        ]
+
+    def diff_many(
+        self, olds: Iterable[Tuple], workers: int = None
+    ) -> Iterator["FleetResult"]:
+        """Diff this config file against many old config files
+
+        Each old config is given as a (key, old) or (key, old, old_verbose) tuple.
+        Yields a `FleetResult` for each as it is diffed. See `fleet.FleetDiffer`,
+        which also reports the throughput.
+        """
+        from routeros_diff.fleet import FleetDiffer
+
+        return FleetDiffer(self).diff_many(olds, workers=workers)
+
+    def _iter_diff_sections(
+        self,
+        pairs: Iterable[Tuple[Section, Section, Optional[Section]]],
+        workers: Optional[int],
+    ) -> Iterator[Section]:
+        """Diff each (new, old, old verbose) section, yielding the diffs in the same order
+
+        Uses a process pool if `workers` is set and any sections are large enough.
+        """
+        if not workers or workers <= 1:
+            for new, old, verbose in pairs:
+                yield new.diff(old, old_verbose=verbose)
+            return
+
+        pairs = list(pairs)
+        # The number of expressions to diff for each pair
+        sizes = [
+            len(new.expressions)
+            + len(old.expressions)
+            + (len(verbose.expressions) if verbose else 0)
+            for new, old, verbose in pairs
+        ]
+        large = [
+            i for i, size in enumerate(sizes) if size >= PARALLEL_DIFF_MIN_EXPRESSIONS
+        ]
+        if not large:
+            yield from self._iter_diff_sections(pairs, workers=None)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Send the largest sections first, so that we are not left
+            # waiting on one large section at the end
+            futures = {}
+            for i in sorted(large, key=sizes.__getitem__, reverse=True):
+                # Each section is sent with its own settings, as the old config
+                # may have been parsed using different settings
+                sections = []
+                for section in pairs[i]:
+                    if section is not None:
+                        with io.BytesIO() as f:
+                            snapshot.dump(f, None, None, [section])
+                            sections.append((f.getvalue(), section.settings))
+                futures[i] = executor.submit(_diff_section_pair, sections)
+
+            # Yield in order, diffing the smaller sections ourselves while the workers are busy
+            for i, (new, old, verbose) in enumerate(pairs):
+                future = futures.get(i)
+                if future is None:
+                    yield new.diff(old, old_verbose=verbose)
+                else:
+                    with io.BytesIO(future.result()) as f:
+                        yield snapshot.load(f, new.settings)[2][0]
+
+    @staticmethod
+    def _normalise_settings(settings: Union[Settings, dict, None]) -> Settings:
+        settings = settings or DEFAULT_SETTINGS
+        if isinstance(settings, dict):
+            settings = Settings(**settings)
+        return settings
+
+    @staticmethod
+    def _parse_header(
+        first_line: str,
+    ) -> Tuple[Optional[datetime], Optional[Tuple[int, int, int]]]:
+        """Parse the timestamp & RouterOS version from the header comment (if present)"""
+        if first_line.startswith("#") and " by RouterOS " in first_line:
+            first_line = first_line.strip("#").strip()
+            timestamp, *_ = first_line.split(" by ")
+            timestamp = dateutil.parser.parse(timestamp)
+            router_os_version = re.search(r"(\d\.[\d\.]+\d)", first_line).group(1)
+            router_os_version = tuple([int(x) for x in router_os_version.split(".")])
+            return timestamp, router_os_version
+        else:
+            return None, None
+
+    @classmethod
+    def _from_sections(
+        cls,
+        timestamp: Optional[datetime],
+        router_os_version: Optional[Tuple[int, int, int]],
+        sections: Iterable[Section],
+        settings: Settings,
+    ):
+        """Create a config from parsed sections, merging any duplicate sections"""
+        # Note that this dict will maintain it's ordering
+        parsed_sections: Dict[str, List[Section]] = {}
+        for parsed_section in sections:
+            parsed_sections.setdefault(parsed_section.path, []).append(parsed_section)
+
+        return cls(
+            timestamp=timestamp,
+            router_os_version=router_os_version,
+            # Duplicate sections are merged into one
+            sections=[Section.merge(s) for s in parsed_sections.values()],
+            settings=settings,
+        )
+
+    def dump(self, f: BinaryIO):
+        """Write a compact binary snapshot of this configuration to the binary file f
+
+        The snapshot can be loaded again using `RouterOSConfig.load()`, which is
+        much faster than parsing the configuration. For example:
+
+            with open("config.snapshot", "wb") as f:
+                config.dump(f)
+
+        Use an `io.BytesIO` object if you need the snapshot as bytes.
+        Note that settings are not included in the snapshot.
+        """
+        snapshot.dump(f, self.timestamp, self.router_os_version, self.sections)
+
+    @classmethod
+    def load(cls, f: BinaryIO, settings: Union[Settings, dict] = None):
+        """Load a configuration from a snapshot created by `dump()`"""
+        settings = cls._normalise_settings(settings)
+        timestamp, router_os_version, sections = snapshot.load(f, settings)
+        return cls(
+            timestamp=timestamp,
+            router_os_version=router_os_version,
+            sections=sections,
+            settings=settings,
+        )
+
+    @staticmethod
+    def load_section(
+        f: BinaryIO, path: str, settings: Union[Settings, dict] = None
+    ) -> Optional[Section]:
+        """Load a single section from a snapshot created by `dump()`
+
+        Only the requested section will be decoded. Returns None if the snapshot
+        contains no section with the given path.
+        """
+        settings = RouterOSConfig._normalise_settings(settings)
+        return snapshot.load_section(f, path, settings)
 
+    def keys(self):
+        """Get all section paths in this config file"""
+        return [section.path for section in self.sections]
+
+    def __getitem__(self, path):
+        """Get the section at the given path"""
+        return self.sections.by_path()[path]
+
+    def __contains__(self, path):
+        """Is the given section path in this config file?"""
+        return path in self.sections.by_path()
+
+    def get(self, path, default=None):
+        """Get the section for the given section path"""
+        try:
+            return self[path]
+        except KeyError:
+            return default
+
+    def fingerprint(self) -> str:
+        """Get a hash which identifies the content of this configuration
+
+        This is built from the fingerprint of each section (see `Section.fingerprint()`).
+        Configurations with the same fingerprint will produce the same diffs, so this can
+        be used to find duplicate configurations. The timestamp, RouterOS version, order
+        of sections, and any empty sections are ignored.
+        """
+        return combine_fingerprints(
+            (s.fingerprint() for s in self.sections if s.expressions), ordered=False
+        ).hex()
+
+    def diff(
+        self,
+        old: "RouterOSConfig",
+        old_verbose: Optional["RouterOSConfig"] = None,
+        workers: int = None,
+    ):
+        """Diff this config file with an old config file
+
+        Will return a new config file which can be used to
+        migrate from the old config to the new config.
+
+        Set `workers` to diff large sections using a pool of that many worker
+        processes. The result is the same as when diffing within the current process.
+        """
+        diffed_sections = self._iter_diff_sections(
+            self._pair_sections(old, old_verbose), workers
+        )
         return RouterOSConfig(
             timestamp=None,
             router_os_version=None,
             sections=[s for s in diffed_sections if s.expressions],
         )
+
+    def iter_diff(
+        self,
+        old: "RouterOSConfig",
+        old_verbose: Optional["RouterOSConfig"] = None,
+        workers: int = None,
+    ) -> Iterator[Tuple[str, Expression]]:
+        """Diff this config file with an old config file, yielding each expression of the diff
+
+        Yields (section path, expression) pairs in the same order as `diff()`. Each
+        section's expressions are yielded as soon as that section has been diffed,
+        so the whole diff never needs to be held in memory. For example:
+
+            for section_path, expression in new.iter_diff(old):
+                ...
+
+        Takes the same arguments as `diff()`.
+        """
+        for diffed in self._iter_diff_sections(
+            self._pair_sections(old, old_verbose), workers
+        ):
+            for expression in diffed.expressions:
+                yield diffed.path, expression
+
+
+def _diff_section_pair(sections: List[Tuple[bytes, Settings]]) -> bytes:
+    """Diff a new, old (and optionally old verbose) section
+
+    Each section is sent as a snapshot, along with its settings. Returns the
+    diffed section as a snapshot. Runs within a worker process
+    """
+    loaded = []
+    for data, settings in sections:
+        with io.BytesIO(data) as f:
+            loaded.extend(snapshot.load(f, settings)[2])
+
+    new_section, old_section, *old_section_verbose = loaded
+    diffed = new_section.diff(
+        old_section, old_verbose=old_section_verbose[0] if old_section_verbose else None
+    )
+    with io.BytesIO() as f:
+        snapshot.dump(f, None, None, [diffed])
+        return f.getvalue()
+
+
+def _parse_section(section_text: str, settings: Settings) -> bytes:
+    """Parse a single section, and return it as a snapshot. Runs within a worker process"""
+    with io.BytesIO() as f:
+        snapshot.dump(f, None, None, [Section.parse(section_text, settings=settings)])
+        return f.getvalue()
+
+
+def _section_digest(s: str, spans: List[Tuple[int, int]]) -> bytes:
+    """Hash the text of a section (which may appear in several places within s)"""
+    hash_ = hashlib.blake2b(digest_size=16)
+    for start, end in spans:
+        hash_.update(s[start:end].encode("utf8", "surrogatepass"))
+        hash_.update(b"\0")
+    return hash_.digest()
+
+
+def _split_section_text(section_text: str, chunk_size: int) -> Iterator[str]:
+    """Split a section into several smaller sections with the same path
+
+    Sections are only split on new lines which are not escaped.
+    """
+    if len(section_text) <= chunk_size:
+        yield section_text
+        return
+
+    path, _, body = section_text.partition("\n")
+    start = 0
+    while start < len(body):
+        end = body.find("\n", start + chunk_size)
+        while end != -1 and body[end - 1] == "\\":
+            end = body.find("\n", end + 1)
+        if end == -1:
+            end = len(body)
+
+        yield f"{path}\n{body[start:end]}"
+        start = end + 1
+
+
+def _iter_section_spans(
+    buffer: Union[str, bytes, bytearray, mmap.mmap], start: int, end: int
+) -> Iterator[Tuple[int, int]]:
+    """Get the (start, end) position of each section within buffer[start:end]
+
+    Works with both strings and bytes-like buffers. Sections start on
+    lines that start with a slash.
+    """
+    separator = "\n/" if isinstance(buffer, str) else b"\n/"
+
+    if buffer[start : start + 1] == separator[1:]:
+        section_start = start
+    else:
+        section_start = buffer.find(separator, start, end)
+        if section_start == -1:
+            return
+        section_start += 1
+
+    while True:
+        section_end = buffer.find(separator, section_start, end)
+        if section_end == -1:
+            yield section_start, end
+            return
+        yield section_start, section_end
+        section_start = section_end + 1
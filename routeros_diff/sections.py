@@ -1,14 +1,25 @@
+import hashlib
 import itertools
 import re
 from dataclasses import dataclass, replace
-from typing import List, Optional
-
-from routeros_diff.arguments import Arg, ArgList
-from routeros_diff.settings import Settings
-from routeros_diff.expressions import Expression
-from routeros_diff.utilities import find_expression
+from mmap import mmap
+from operator import itemgetter
+from typing import List, Optional, Iterable, Iterator, Union, Tuple, Dict, Hashable
+
+from routeros_diff.arguments import Arg, ArgList, ArgValue
+from routeros_diff.columns import ExpressionColumns, compact_expressions
+from routeros_diff.settings import Settings, DEFAULT_SETTINGS
+from routeros_diff.expressions import Expression, ExpressionList, Classification
+from routeros_diff.ordering import align, plan_placements
+from routeros_diff.utilities import find_expression, IndexedList
 from routeros_diff.exceptions import CannotDiff
 
+# Lines at the start of an expression which contain nothing but an escape
+_ESCAPE_ONLY_LINES = re.compile(r"^(?:\\[ \t]*(?:\r?\n|$)\s*)+")
+
+_BACKSLASH = ord("\\")
+_CARRIAGE_RETURN = ord("\r")
+
 
 @dataclass
 class Section:
@@ -22,11 +33,80 @@ class Section:
 
     """
 
+    __slots__ = ("path", "expressions", "settings", "_lazy_source", "_lazy_spans")
+
     path: str
     expressions: List[Expression]
 
     settings: Settings
 
+    def __setattr__(self, name, value):
+        # Expressions are stored in an ExpressionList, which indexes them by natural ID
+        if name == "expressions" and not isinstance(
+            value, (ExpressionList, ExpressionColumns)
+        ):
+            value = ExpressionList(value)
+        super().__setattr__(name, value)
+
+    @classmethod
+    def lazy(
+        cls,
+        path: str,
+        source: str,
+        spans: List[Tuple[int, int]],
+        settings: Settings = None,
+    ):
+        """Create a section which will only be parsed when its expressions are first accessed
+
+        The section's text is given as (start, end) positions within `source`. There
+        will be more than one span if the section appears more than once in the source.
+        """
+        section = cls.__new__(cls)
+        section.path = path
+        section.settings = settings or DEFAULT_SETTINGS
+        section._lazy_source = source
+        section._lazy_spans = spans
+        return section
+
+    def __getattr__(self, name):
+        # Only called for missing attributes, which will be the case for
+        # the expressions of a section created using Section.lazy()
+        spans = getattr(self, "_lazy_spans", None) if name == "expressions" else None
+        if spans is not None:
+            sections = []
+            for start, end in spans:
+                section = Section.parse(
+                    self._lazy_source[start:end], settings=self.settings
+                )
+                assert section.path == self.path, "Lazy section has the wrong path"
+                sections.append(section)
+
+            expressions = self.expressions = Section.merge(sections).expressions
+            del self._lazy_source
+            del self._lazy_spans
+            return expressions
+
+        raise AttributeError(
+            f"'{self.__class__.__name__}' object has no attribute '{name}'"
+        )
+
+    def __getstate__(self):
+        # Parse lazy sections before pickling, rather than pickling their source.
+        # This is in the (dict, slots) form expected by pickle & copy
+        return (
+            None,
+            dict(path=self.path, expressions=self.expressions, settings=self.settings),
+        )
+
+    @property
+    def is_parsed(self):
+        """Has this section been parsed?
+
+        This will only be False for sections created using Section.lazy()
+        which have not yet been accessed.
+        """
+        return getattr(self, "_lazy_spans", None) is None
+
     def __str__(self):
         """Convert this parsed expression into a valid RouterOS configuration"""
         s = f"{self.path}\n"
@@ -51,7 +131,7 @@ class Section:
             add area=core network=10.100.0.0/24
             add area=towers network=100.126.0.0/29
         """
-        settings = settings or Settings()
+        settings = settings or DEFAULT_SETTINGS
         s = s.strip()
         assert s.startswith("/"), "Was not passed a section block"
 
@@ -65,33 +145,103 @@ class Section:
         # Split on any new line which is not preceded by a \
         lines = re.split(r"(?<!\\)\n", s)
 
-        # Remove blank lines and comments
-        lines = [
-            l.strip() for l in lines if l.strip() and not l.strip().startswith("#")
-        ]
+        return cls.from_lines(lines, settings=settings)
 
-        path = lines[0]
+    @classmethod
+    def parse_buffer(
+        cls,
+        buffer: Union[bytes, bytearray, mmap],
+        start: int = 0,
+        end: int = None,
+        settings: Settings = None,
+        encoding: str = "utf8",
+    ):
+        """Parse a section directly from a bytes-like buffer, such as a memory-mapped file
+
+        The section is read from `buffer[start:end]`. Line continuations are found
+        within the buffer itself, and each line is only decoded as it is parsed into
+        an expression. The section text is therefore never held in memory in its entirety.
+        """
+        if end is None:
+            end = len(buffer)
+        return cls.from_lines(
+            _iter_buffer_lines(buffer, start, end, encoding), settings=settings
+        )
 
-        # Santity checks
-        assert path.startswith(
-            "/"
-        ), f"Section path must start with a '/'. It was: {path}"
-        for l in lines[1:]:
-            assert not l.startswith(
-                "/"
-            ), f"Expression must not start with a '/'. It was: {path}"
+    @classmethod
+    def from_lines(cls, lines: Iterable[str], settings: Settings = None):
+        """Create a Section from its lines
 
-        expressions = [
-            Expression.parse(l, section_path=path, settings=settings) for l in lines[1:]
-        ]
+        The first line must be the section path. Lines may still contain
+        escaped new lines (i.e. line continuations)
+        """
+        settings = settings or DEFAULT_SETTINGS
+        path = None
+        expressions = []
+
+        for l in lines:
+            l = l.strip()
+            if l.startswith("\\"):
+                # Remove any empty lines that only contain an escape
+                l = _ESCAPE_ONLY_LINES.sub("", l)
+            # Remove any trailing escapes
+            l = l.rstrip("\\")
+
+            # Skip blank lines and comments
+            if not l or l.startswith("#"):
+                continue
+
+            if path is None:
+                path = l
+                # Santity check
+                assert path.startswith(
+                    "/"
+                ), f"Section path must start with a '/'. It was: {path}"
+            else:
+                # Santity check
+                assert not l.startswith(
+                    "/"
+                ), f"Expression must not start with a '/'. It was: {path}"
+                expressions.append(
+                    Expression.parse(l, section_path=path, settings=settings)
+                )
+
+        assert path is not None, "Was not passed a section block"
         return cls(
-            path=path, expressions=[e for e in expressions if e], settings=settings
+            path=path,
+            expressions=compact_expressions(expressions, path, settings),
+            settings=settings,
         )
 
+    @classmethod
+    def merge(cls, sections: List["Section"]) -> "Section":
+        """Merge several sections with the same path into a single section"""
+        first, *others = sections
+        if not others:
+            return first
+
+        expressions = None
+        if all(isinstance(s.expressions, ExpressionColumns) for s in sections):
+            # Join the columns directly, rather than creating every expression
+            expressions = ExpressionColumns.concat([s.expressions for s in sections])
+
+        if expressions is None:
+            expressions = compact_expressions(
+                [e for section in sections for e in section.expressions],
+                first.path,
+                first.settings,
+            )
+
+        return cls(path=first.path, expressions=expressions, settings=first.settings)
+
+    def classify(self) -> Classification:
+        """Classify this section's expressions (this is only calculated once)"""
+        return self.expressions.classify()
+
     @property
     def uses_natural_ids(self):
         """Does this section use natural IDs to identify its entities?"""
-        return not any(i is None for i in self.natural_ids)
+        return self.classify().natural_ids
 
     @property
     def modifies_default_only(self):
@@ -102,12 +252,12 @@ class Section:
 
             set [ default=yes ] foo=bar
         """
-        return self.expressions and all(i.finds_by_default for i in self.expressions)
+        return self.classify().default_only
 
     @property
     def has_any_default_entry(self):
         """Does any expression in this section find based upon defaults entities"""
-        return self.expressions and any(i.finds_by_default for i in self.expressions)
+        return self.classify().any_default
 
     @property
     def is_single_object_section(self):
@@ -115,15 +265,37 @@ class Section:
 
         For example, `/system/identity`
         """
-        return self.expressions and all(
-            i.is_single_object_expression for i in self.expressions
-        )
+        return self.classify().single_object
+
+    def fingerprint(self) -> bytes:
+        """Get a hash of this section's path & expressions
+
+        Sections with the same fingerprint will always have an empty diff. The order of
+        the expressions is only included if it is important (see
+        `Settings.is_expression_order_important()`). This is calculated only once,
+        unless the expressions change.
+        """
+        ordered = self.settings.is_expression_order_important(self.path)
+        return hashlib.blake2b(
+            self.path.encode("utf8", "surrogatepass")
+            + b"\0"
+            + self.expressions.fingerprint(ordered),
+            digest_size=16,
+        ).digest()
+
+    def natural_id_positions(self) -> Dict[Optional[Hashable], int]:
+        """Get the position of the expression with each natural ID
+
+        This index is only rebuilt when the section's expressions change (including
+        when an expression is changed in place)
+        """
+        return self.expressions.natural_id_positions()
 
     def expression_index_for_natural_key(self, natural_key, natural_id):
         """Get the position of the expression identified by the given natural key & id"""
-        for i, expression in enumerate(self.expressions):
-            if expression.natural_key_and_id == (natural_key, natural_id):
-                return i
+        i = self.natural_id_positions().get(natural_id)
+        if i is not None and self.expressions[i].natural_key_and_id[0] == natural_key:
+            return i
         raise KeyError(f"({natural_key}, {natural_id})")
 
     def diff(
@@ -139,19 +311,29 @@ class Section:
         """
         if self.path != old.path:
             raise CannotDiff(f"Section paths do not match")
-        if self.is_single_object_section or old.is_single_object_section:
+        if isinstance(self.expressions, ExpressionColumns) and isinstance(
+            old.expressions, ExpressionColumns
+        ):
+            # Large sections stored as columns
+            return self._diff_columns(old, old_verbose)
+        # Each section is only classified once, so this is a constant time decision
+        new_class = self.classify()
+        old_class = old.classify()
+        order_important = self.settings.is_expression_order_important(self.path)
+
+        if new_class.single_object or old_class.single_object:
             # Eg. /system/identity
             diff = self._diff_single_object(old, old_verbose)
-        elif self.modifies_default_only and old.modifies_default_only:
+        elif new_class.default_only and old_class.default_only:
             # Both sections only change the default record
             diff = self._diff_default_only(old, old_verbose)
-        elif self.modifies_default_only and not old.expressions:
+        elif new_class.default_only and not old.expressions:
             # The new one sets values on the default entry, but the entry
             # isn't mentioned in the old section (probably because it has
             # entirely default values)
             return self
-        elif old.modifies_default_only:
-            if not self.has_any_default_entry:
+        elif old_class.default_only:
+            if not new_class.any_default:
                 # Old config modifies default entry, and the new config
                 # makes no mention of it. We cannot delete default entries,
                 # so just ignore it. We ignore it by removing it and starting
@@ -163,55 +345,23 @@ class Section:
                 raise CannotDiff(
                     "Cannot handle section which contain a mix of default setting and non-default setting"
                 )
-        elif old.uses_natural_ids and self.uses_natural_ids:
+        elif old_class.natural_ids and new_class.natural_ids:
             # We have natural keys * ids, so do a diff using those
-            diff = self._diff_by_id(old, old_verbose)
+            # (which also takes care of ordering if needed)
+            diff = self._diff_by_id(old, old_verbose, ordered=order_important)
         else:
             # Well we lack natural keys/ids, so just compare values and do the
             # best we can. This will result in additions/deletions, but no
             # modifications.
             diff = self._diff_by_value(old, old_verbose)
 
-        # Handle ordering if we need to, and if we have changes
-        if self.settings.is_expression_order_important(self.path) and diff.expressions:
-            if self.uses_natural_ids and old.uses_natural_ids:
-                # We can ID each record, so apply the correct ordering
-                for i, diff_expression in enumerate(diff.expressions):
-                    natural_key, natural_id = diff_expression.natural_key_and_id
-                    try:
-                        new_expression_index = self.expression_index_for_natural_key(
-                            natural_key, natural_id
-                        )
-                    except KeyError:
-                        diff.expressions[i] = diff_expression.as_delete()
-                        break
-
-                    new_expression = self.expressions[new_expression_index]
-
-                    # Find the next expression which also appears in the old section
-                    next_expression = None
-                    for expression in self.expressions[new_expression_index + 1 :]:
-                        try:
-                            _, natural_id = expression.natural_key_and_id
-                            next_expression = old[natural_id]
-                            # We will now place our new statement before that expression
-                            break
-                        except KeyError:
-                            pass
-
-                    # Update with place-before value if next_expression is available.
-                    # Otherwise this is the last expression in the list, so just add
-                    # it as normal (as this will append it to the end, which is what we want)
-                    if next_expression:
-                        new_expression.args.append(
-                            Arg(
-                                key="place-before",
-                                value=find_expression(
-                                    *next_expression.natural_key_and_id, self.settings
-                                ),
-                            )
-                        )
-            else:
+        if order_important and not (new_class.natural_ids and old_class.natural_ids):
+            # We cannot identify each expression, so align the expressions by value
+            # instead (this also catches expressions which have only been reordered)
+            aligned = self._align_by_value(old)
+            if aligned is not None:
+                diff = replace(self, expressions=aligned)
+            elif diff.expressions or _is_reordered(self, old):
                 # Cannot be smart, so do a full wipe and recreate
                 wipe_expression = Expression(
                     section_path=self.path,
@@ -226,6 +376,321 @@ class Section:
 
         return diff
 
+    def has_changes(
+        self, old: "Section", old_verbose: Optional["Section"] = None
+    ) -> bool:
+        """Would diffing this section with the old section produce any expressions?
+
+        This gives the same result as `bool(self.diff(old, old_verbose).expressions)`.
+        Sections which use natural IDs or are stored as columns are checked without
+        creating the diff, and the check stops as soon as any change is found.
+        """
+        if self.path != old.path:
+            raise CannotDiff(f"Section paths do not match")
+        if self.fingerprint() == old.fingerprint():
+            return False
+        if isinstance(self.expressions, ExpressionColumns) and isinstance(
+            old.expressions, ExpressionColumns
+        ):
+            return self._has_changes_columns(old, old_verbose)
+
+        new_class = self.classify()
+        old_class = old.classify()
+        # The same cases in which diff() uses _diff_by_id()
+        by_id = (
+            not (new_class.single_object or old_class.single_object)
+            and not old_class.default_only
+            and not (new_class.default_only and not old.expressions)
+            and new_class.natural_ids
+            and old_class.natural_ids
+        )
+        if by_id:
+            return self._has_changes_by_id(
+                old,
+                old_verbose,
+                ordered=self.settings.is_expression_order_important(self.path),
+            )
+        return bool(self.diff(old, old_verbose).expressions)
+
+    def _has_changes_columns(
+        self, old: "Section", old_verbose: Optional["Section"] = None
+    ) -> bool:
+        """Would _diff_columns() produce any expressions?
+
+        As in `_diff_columns()`, unchanged rows are found by comparing the columns
+        directly. Expressions are then only created for the changed rows.
+        """
+        # The indexes are built only once for each set of columns, and contain
+        # fewer entries than there are rows only if some IDs are duplicated
+        new_positions = self.expressions.natural_id_positions()
+        old_positions = old.expressions.natural_id_positions()
+        by_id = None not in new_positions and None not in old_positions
+
+        if by_id and (
+            len(new_positions) < len(self.expressions)
+            or len(old_positions) < len(old.expressions)
+        ):
+            # Duplicate IDs, which _diff_columns() leaves to the standard diff
+            return bool(self._diff_columns(old, old_verbose).expressions)
+
+        new_rows = self.expressions.row_values()
+        old_rows = old.expressions.row_values()
+        old_row_set = set(old_rows)
+        changed_new = [i for i, row in enumerate(new_rows) if row not in old_row_set]
+        new_row_set = set(new_rows)
+        changed_old = [i for i, row in enumerate(old_rows) if row not in new_row_set]
+        if not changed_new and not changed_old:
+            return False
+
+        changed_new = replace(
+            self, expressions=[self.expressions[i] for i in changed_new]
+        )
+        changed_old = replace(
+            old, expressions=[old.expressions[i] for i in changed_old]
+        )
+        if by_id:
+            return changed_new._has_changes_by_id(changed_old, old_verbose)
+        else:
+            return changed_new._has_changes_by_value(changed_old)
+
+    def _has_changes_by_id(
+        self,
+        old: "Section",
+        old_verbose: Optional["Section"] = None,
+        ordered: bool = False,
+    ) -> bool:
+        """Would _diff_by_id() produce any expressions?"""
+        new_positions = self.natural_id_positions()
+        old_positions = old.natural_id_positions()
+        verbose_positions = old_verbose.natural_id_positions() if old_verbose else {}
+
+        for natural_id, i in old_positions.items():
+            if natural_id not in new_positions:
+                # Deletion
+                if old.expressions[i].as_delete() is not None:
+                    return True
+
+        for natural_id, i in new_positions.items():
+            new_expression = self.expressions[i]
+            j = old_positions.get(natural_id)
+            if j is None:
+                # Creation
+                if self.settings.creation_allowed(self.path):
+                    return True
+                continue
+
+            old_expression = old.expressions[j]
+            if new_expression.args == old_expression.args:
+                # Unchanged, so no need to diff
+                continue
+
+            k = verbose_positions.get(natural_id)
+            old_expression_verbose = None if k is None else old_verbose.expressions[k]
+            if new_expression.has_changes(old_expression, old_expression_verbose):
+                return True
+
+        if ordered:
+            # Expressions will be moved unless those in both sections are in the same
+            # order (new_positions is ordered by position, so we follow the new order)
+            previous = -1
+            for natural_id in new_positions:
+                j = old_positions.get(natural_id)
+                if j is not None:
+                    if j < previous:
+                        return True
+                    previous = j
+
+        return False
+
+    def _place_by_id(self, old: "Section") -> List[Expression]:
+        """Create & move expressions so that old will be in the same order as this section
+
+        Expressions are either created with `place-before`, or are moved
+        using `move ... destination=`. See `ordering.plan_placements()`.
+        """
+        old_positions = old.natural_id_positions()
+        new_positions = self.natural_id_positions()
+
+        def find(natural_id):
+            # Existing entities are found as they are identified in the old section
+            expression = old.expressions[old_positions[natural_id]]
+            return find_expression(*expression.natural_key_and_id, self.settings)
+
+        expressions = []
+        for placement in plan_placements(self.natural_ids, old_positions):
+            if placement.create:
+                expression = self.expressions[
+                    new_positions[placement.natural_id]
+                ].as_create()
+                if expression is None:
+                    continue
+                if placement.before is not None:
+                    # Copy the args, as as_create() shares them with the new expression
+                    expression = replace(
+                        expression,
+                        args=ArgList(
+                            list(expression.args)
+                            + [Arg("place-before", find(placement.before))]
+                        ),
+                    )
+            else:
+                expression = Expression(
+                    section_path=self.path,
+                    command="move",
+                    find_expression=find(placement.natural_id),
+                    args=ArgList(
+                        []
+                        if placement.before is None
+                        else [Arg("destination", find(placement.before))]
+                    ),
+                    settings=self.settings,
+                )
+            expressions.append(expression)
+        return expressions
+
+    def _align_by_value(self, old: "Section") -> Optional[List[Expression]]:
+        """Remove & add individual expressions so that old will match this section
+
+        This is used for order-important sections which lack natural IDs. Expressions are
+        compared by value (see `_value_key()`) and aligned using `ordering.align()`.
+        Expressions which only appear in old are removed, and those which only appear in
+        this section are added using `place-before`. Expressions are found by all
+        of their values (for example, `[ find chain=input action=drop ]`).
+
+        Returns None if this cannot be done safely, in which case the section must be
+        wiped and recreated. This is the case if a removal would also find an expression
+        we are keeping, if an expression we place before cannot be found unambiguously,
+        or if the sections differ by more than `ordering.ALIGNMENT_MAX_EDITS` expressions.
+        """
+        if not self.settings.deletion_allowed(
+            self.path
+        ) or not self.settings.creation_allowed(self.path):
+            return None
+        for expression in itertools.chain(self.expressions, old.expressions):
+            if (
+                expression.command != "add"
+                or expression.find_expression
+                or not expression.args
+                or any(arg.is_positional for arg in expression.args)
+            ):
+                return None
+
+        # Number each distinct expression value, so we align lists of integers
+        numbers = {}
+        old_rows = [
+            numbers.setdefault(_value_key(e), len(numbers)) for e in old.expressions
+        ]
+        new_rows = [
+            numbers.setdefault(_value_key(e), len(numbers)) for e in self.expressions
+        ]
+        common = align(old_rows, new_rows)
+        if common is None:
+            return None
+
+        kept_old = {i for i, _ in common}
+        kept_new = {j for _, j in common}
+        old_finder = _ValueFinder(old.expressions)
+        new_finder = _ValueFinder(self.expressions)
+
+        expressions = []
+        removed = set()
+        for i, expression in enumerate(old.expressions):
+            if i in kept_old or old_rows[i] in removed:
+                continue
+            # Identical expressions are all removed at once
+            removed.add(old_rows[i])
+            found = old_finder.find(i)
+            if found is None or not kept_old.isdisjoint(found):
+                return None
+            expressions.append(
+                replace(
+                    expression,
+                    command="remove",
+                    find_expression=_find_by_value(expression),
+                    args=ArgList(),
+                )
+            )
+
+        # Each added expression is placed before the next expression we keep. Added
+        # expressions can also be found by the place-before, so we check against the
+        # new expressions (rather than the old).
+        before = None
+        additions = []
+        for j in range(len(self.expressions) - 1, -1, -1):
+            expression = self.expressions[j]
+            if j in kept_new:
+                before = j
+                continue
+            expression = expression.as_create()
+            if before is not None:
+                if new_finder.find(before) != [before]:
+                    return None
+                expression = replace(
+                    expression,
+                    args=ArgList(
+                        list(expression.args)
+                        + [
+                            Arg(
+                                "place-before",
+                                _find_by_value(self.expressions[before]),
+                            )
+                        ]
+                    ),
+                )
+            additions.append(expression)
+
+        additions.reverse()
+        return expressions + additions
+
+    def _diff_columns(
+        self, old: "Section", old_verbose: Optional["Section"] = None
+    ) -> "Section":
+        """Diff two sections which are both stored as columns
+
+        Rows which are unchanged can never appear in the diff, so we find these by
+        comparing the columns directly. Only the remaining rows are then created as
+        expressions and diffed as normal.
+        """
+        new_ids = self.expressions.natural_ids()
+        old_ids = old.expressions.natural_ids()
+        by_id = None not in new_ids and None not in old_ids
+
+        if by_id and (
+            len(set(new_ids)) < len(new_ids) or len(set(old_ids)) < len(old_ids)
+        ):
+            # Duplicate IDs, so we cannot be sure which rows are paired with each
+            # other. Let the standard diff decide
+            return replace(self, expressions=list(self.expressions)).diff(
+                replace(old, expressions=list(old.expressions)), old_verbose
+            )
+
+        new_rows = self.expressions.row_values()
+        old_rows = old.expressions.row_values()
+        new_row_set = set(new_rows)
+        old_row_set = set(old_rows)
+
+        changed_new = replace(
+            self,
+            expressions=[
+                self.expressions[i]
+                for i, row in enumerate(new_rows)
+                if row not in old_row_set
+            ],
+        )
+        changed_old = replace(
+            old,
+            expressions=[
+                old.expressions[i]
+                for i, row in enumerate(old_rows)
+                if row not in new_row_set
+            ],
+        )
+
+        if by_id:
+            return changed_new._diff_by_id(changed_old, old_verbose)
+        else:
+            return changed_new._diff_by_value(changed_old, old_verbose)
+
     def _diff_single_object(
         self, old: "Section", old_verbose: Optional["Section"] = None
     ) -> "Section":
@@ -287,13 +752,26 @@ class Section:
         else:
             expressions = []
 
-        return Section(path=self.path, expressions=expressions, settings=self.settings,)
+        return Section(
+            path=self.path,
+            expressions=expressions,
+            settings=self.settings,
+        )
 
     def _diff_by_id(
-        self, old: "Section", old_verbose: Optional["Section"] = None
+        self,
+        old: "Section",
+        old_verbose: Optional["Section"] = None,
+        ordered: bool = False,
     ) -> "Section":
-        """Diff using natural keys/ids"""
-        all_natural_ids = sorted(set(self.natural_ids) | set(old.natural_ids))
+        """Diff using natural keys/ids
+
+        If `ordered` is set, expressions are also created and moved so
+        that they will be in the same order as in this section
+        """
+        all_natural_ids = sorted(
+            set(self.natural_ids) | set(old.natural_ids), key=_natural_id_sort_key
+        )
         new_expression: Optional[Expression]
         old_expression: Optional[Expression]
 
@@ -301,28 +779,31 @@ class Section:
         modify = []
         create = []
 
+        # Fetch the indexes once, as each fetch checks for expressions changed in place
+        new_positions = self.natural_id_positions()
+        old_positions = old.natural_id_positions()
+        verbose_positions = old_verbose.natural_id_positions() if old_verbose else {}
+
         for natural_id in all_natural_ids:
-            try:
-                new_expression = self[natural_id]
-            except KeyError:
-                new_expression = None
+            i = new_positions.get(natural_id)
+            new_expression = None if i is None else self.expressions[i]
 
-            try:
-                old_expression = old[natural_id]
-            except KeyError:
-                old_expression = None
+            j = old_positions.get(natural_id)
+            old_expression = None if j is None else old.expressions[j]
 
             if old_expression and not new_expression:
                 # Deletion
                 remove.append(old_expression.as_delete())
 
             elif new_expression and not old_expression:
-                # Creation
-                create.append(new_expression.as_create())
+                # Creation (unless ordered, in which case see below)
+                if not ordered:
+                    create.append(new_expression.as_create())
             else:
                 # Modification
+                k = verbose_positions.get(natural_id)
                 old_expression_verbose = (
-                    old_verbose.get(natural_id) if old_verbose else None
+                    None if k is None else old_verbose.expressions[k]
                 )
                 modify.extend(
                     new_expression.diff(old_expression, old_expression_verbose)
@@ -331,6 +812,10 @@ class Section:
         # No point modifying if nothing needs changing
         modify = [e for e in modify if e.has_kw_args]
 
+        if ordered:
+            # Create new expressions in position, and move any which are out of order
+            create = self._place_by_id(old)
+
         # Note we remove first, as this avoids issue with value conflicts
         expressions = remove + modify + create
         return Section(
@@ -351,18 +836,18 @@ class Section:
         remove = []
         create = []
 
-        old_expressions = {str(e.with_ordered_args()): e for e in old.expressions}
-        new_expressions = {str(e.with_ordered_args()): e for e in self.expressions}
+        old_expressions = {_value_key(e): e for e in old.expressions}
+        new_expressions = {_value_key(e): e for e in self.expressions}
 
-        for old_expression_str, old_expression in old_expressions.items():
+        for old_expression_key, old_expression in old_expressions.items():
             if (
-                old_expression_str not in new_expressions
+                old_expression_key not in new_expressions
                 and old_expression.args.get("disabled") != "yes"
             ):
                 remove.append(old_expression.as_delete())
 
-        for new_expression_str, new_expression in new_expressions.items():
-            if new_expression_str not in old_expressions:
+        for new_expression_key, new_expression in new_expressions.items():
+            if new_expression_key not in old_expressions:
                 create.append(new_expression.as_create())
 
         expressions = remove + create
@@ -372,6 +857,29 @@ class Section:
             settings=self.settings,
         )
 
+    def _has_changes_by_value(self, old: "Section") -> bool:
+        """Would _diff_by_value() produce any expressions?"""
+        new_keys = {_value_key(e) for e in self.expressions}
+        old_keys = set()
+        for old_expression in old.expressions:
+            old_key = _value_key(old_expression)
+            old_keys.add(old_key)
+            if (
+                old_key not in new_keys
+                and old_expression.args.get("disabled") != "yes"
+                and old_expression.as_delete()
+            ):
+                return True
+
+        for new_expression in self.expressions:
+            if (
+                _value_key(new_expression) not in old_keys
+                and new_expression.as_create()
+            ):
+                return True
+
+        return False
+
     @property
     def natural_ids(self) -> List[str]:
         """Get all the natural IDs for expressions in this section"""
@@ -379,11 +887,10 @@ class Section:
 
     def __getitem__(self, natural_id):
         """Get an expression by its natural ID"""
-        for expression in self.expressions:
-            natural_id_ = expression.natural_key_and_id[-1]
-            if natural_id == natural_id_:
-                return expression
-        raise KeyError(natural_id)
+        i = self.natural_id_positions().get(natural_id)
+        if i is None:
+            raise KeyError(natural_id)
+        return self.expressions[i]
 
     def get(self, natural_id, default=None):
         """Get the expression for the given natural ID"""
@@ -403,3 +910,136 @@ class Section:
         return replace(
             self, expressions=[e for e in self.expressions if e.command != "remove"]
         )
+
+
+class SectionList(IndexedList):
+    """The list of sections within a configuration
+
+    This indexes the sections by their paths, so that sections
+    can be found by path without searching the entire list.
+    """
+
+    __slots__ = ()
+
+    def by_path(self) -> Dict[str, Section]:
+        """Get each section keyed by its path
+
+        Where several sections have the same path, this gives the first
+        """
+        return self._get_index()
+
+    def _build_index(self) -> Dict[str, Section]:
+        sections = {}
+        for section in self:
+            sections.setdefault(section.path, section)
+        return sections
+
+
+def _natural_id_sort_key(natural_id) -> tuple:
+    """Sort compound IDs (tuples) after other IDs, as the two cannot be compared"""
+    return isinstance(natural_id, tuple), natural_id
+
+
+def _value_key(expression: Expression) -> tuple:
+    """Get a key which identifies an expression by its value
+
+    Expressions have equal keys if they would be equal once their args are ordered
+    (see Expression.with_ordered_args()). Keys and values are interned, so
+    comparing keys mostly compares objects by identity rather than by value.
+    """
+    positional = []
+    key_value = []
+    for arg in expression.args:
+        if arg.is_positional:
+            positional.append(arg.key)
+        elif isinstance(arg.value, ArgValue):
+            key_value.append((arg.key, arg.comparator, arg.value))
+        else:
+            # Expression values, such as place-before=[ find ... ]
+            key_value.append((arg.key, arg.comparator, str(arg)))
+
+    # Sort by key only, as there should only ever be one of each key
+    key_value.sort(key=itemgetter(0))
+    return (
+        expression.command,
+        str(expression.find_expression) if expression.find_expression else None,
+        tuple(positional),
+        tuple(key_value),
+    )
+
+
+def _is_reordered(new: Section, old: Section) -> bool:
+    """Are the expressions of new & old in a different order?
+
+    Only meaningful if the expressions have the same values (ie. a diff by value is empty)
+    """
+    return [_value_key(e) for e in new.expressions] != [
+        _value_key(e) for e in old.expressions
+    ]
+
+
+def _find_by_value(expression: Expression) -> Expression:
+    """Create a find expression which finds the given expression by all of its values"""
+    return Expression(
+        section_path="",
+        command="find",
+        find_expression=None,
+        args=expression.args,
+        settings=expression.settings,
+    )
+
+
+class _ValueFinder:
+    """Determines which expressions `_find_by_value()` would find
+
+    A find expression will find every expression which has all of the same values,
+    whether or not it also has other values. Each expression's values are indexed,
+    so we only need to check those expressions which share the least common value.
+    """
+
+    # Expressions sharing a value with more than this many others are treated as
+    # ambiguous, which keeps each search quick
+    MAX_CANDIDATES = 100
+
+    def __init__(self, expressions: Iterable[Expression]):
+        self.rows = []
+        self.index = {}
+        for i, expression in enumerate(expressions):
+            row = frozenset((arg.key, str(arg.value)) for arg in expression.args)
+            self.rows.append(row)
+            for value in row:
+                self.index.setdefault(value, []).append(i)
+
+    def find(self, i: int) -> Optional[List[int]]:
+        """Get the positions of every expression found when finding expression i
+
+        Returns None if there are too many expressions to check
+        """
+        row = self.rows[i]
+        candidates = min((self.index[value] for value in row), key=len)
+        if len(candidates) > self.MAX_CANDIDATES:
+            return None
+        return [c for c in candidates if row <= self.rows[c]]
+
+
+def _iter_buffer_lines(
+    buffer: Union[bytes, bytearray, mmap], start: int, end: int, encoding: str
+) -> Iterator[str]:
+    """Decode the lines within buffer[start:end], keeping escaped new lines intact"""
+    line_start = start
+    while line_start < end:
+        # Find the next new line which is not escaped with a backslash
+        i = buffer.find(b"\n", line_start, end)
+        while i != -1 and _is_escaped_new_line(buffer, line_start, i):
+            i = buffer.find(b"\n", i + 1, end)
+
+        line_end = end if i == -1 else i
+        yield buffer[line_start:line_end].decode(encoding)
+        line_start = line_end + 1
+
+
+def _is_escaped_new_line(buffer: Union[bytes, bytearray, mmap], start: int, i: int):
+    """Is the new line at position i escaped? (allowing for CRLF new lines)"""
+    if i > start and buffer[i - 1] == _CARRIAGE_RETURN:
+        i -= 1
+    return i > start and buffer[i - 1] == _BACKSLASH
@@ -1,5 +1,25 @@
-from fnmatch import fnmatch
-from typing import Dict, List
+import hashlib
+import os
+import re
+from fnmatch import translate
+from typing import Dict, List, Iterable, Callable, Optional, Tuple, Union
+
+# A natural key is either a single key, or a tuple of keys which
+# together identify an entity (a compound key)
+NaturalKey = Union[str, Tuple[str, ...]]
+
+# Characters which indicate a section path contains wildcards
+WILDCARD_CHARACTERS = ("*", "?", "[")
+
+# Settings which contain section path patterns. The compiled
+# patterns are discarded whenever any of these are replaced
+PATTERN_SETTINGS = (
+    "natural_keys",
+    "no_deletions",
+    "no_creations",
+    "expression_order_important",
+    "columnar_sections",
+)
 
 
 class Settings:
@@ -26,6 +46,10 @@ class Settings:
                 "/ip firewall*",
                 ...
             },
+            columnar_sections={
+                "/ip firewall address-list",
+                ...
+            },
         ))
 
     Note that section paths can be specified using '*' wildcards.
@@ -36,11 +60,21 @@ class Settings:
     In this case, you can pass your customised class to the parser as follows:
 
         RouterOSConfig.parse(my_config, settings=MyCustomSettings())
+
+    The wildcard patterns are compiled when the settings are first used, and the
+    result for each section path is then remembered (see `compile()`).
     """
 
+    # The compiled patterns & remembered results. Created by compile()
+    _compiled: Optional["CompiledSettings"] = None
+
     # Natural keys for each section name.
     # 'name' will be used if none is found below
-    # (and only if the 'name' value is available)
+    # (and only if the 'name' value is available).
+    # Section names may contain wildcards, in which case the first
+    # matching entry is used (exact matches are always preferred).
+    # A tuple of keys can be given where several keys together
+    # identify each entity (all of the keys must be present)
     natural_keys = {
         "/interface ethernet": "default-name",
         "/interface bridge port": "interface",
@@ -56,6 +90,7 @@ class Settings:
         "/ipv6 nd": "interface",
         "/ipv6 nd prefix": "interface",
         "/ipv6 dhcp-client": "interface",
+        "/ip firewall address-list": ("list", "address"),
     }
 
     # Don't perform deletions in these sections
@@ -80,11 +115,19 @@ class Settings:
         "/ip firewall nat",
     }
 
+    # Large sections which may be stored as columns rather than as individual
+    # expressions (see ExpressionColumns). This is only used where every expression
+    # in the section has the same command and only contains key=value arguments.
+    # The expressions of these sections are read-only, so this is empty by default.
+    # For example: {"/ip firewall address-list", "/ip dhcp-server lease", "/ip route"}
+    columnar_sections = set()
+
     def __init__(
         self,
-        natural_keys: Dict[str, str] = None,
+        natural_keys: Dict[str, NaturalKey] = None,
         no_deletions: List[str] = None,
         no_creations: List[str] = None,
+        columnar_sections: List[str] = None,
     ):
         if natural_keys is not None:
             self.natural_keys = natural_keys
@@ -95,22 +138,218 @@ class Settings:
         if no_creations is not None:
             self.no_creations = no_creations
 
-    def get_natural_key(self, section_path: str):
+        if columnar_sections is not None:
+            self.columnar_sections = columnar_sections
+
+    def get_natural_key(self, section_path: str) -> NaturalKey:
         """Get the natural key for a given section path
 
-        Will default to 'name' if no entry is found in NATURAL_KEYS
+        Will default to 'name' if no entry is found in NATURAL_KEYS.
+        This may be a tuple of keys (a compound key)
         """
-        return self.natural_keys.get(section_path, "name")
+        results = self._get_compiled().natural_key_results
+        natural_key = results.get(section_path)
+        if natural_key is None:
+            natural_key = self._compiled.natural_key(section_path) or "name"
+            results[section_path] = natural_key
+        return natural_key
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in PATTERN_SETTINGS:
+            # Compile again when next used
+            self._compiled = None
+
+    def __getstate__(self):
+        # No need to pickle the compiled patterns, they will be compiled again when needed
+        state = self.__dict__.copy()
+        state.pop("_compiled", None)
+        return state
+
+    def compile(self) -> "Settings":
+        """Compile the wildcard patterns within these settings
+
+        This happens automatically when the settings are first used, so you should
+        not normally need to call this. However, the result for each section path
+        is remembered. You should therefore call this if you modify any of these settings
+        in place (for example, `settings.no_deletions.add("/ip pool")`). Replacing
+        a setting entirely (`settings.no_deletions = {...}`) is detected automatically.
+        """
+        self._compiled = CompiledSettings(self)
+        return self
+
+    def _get_compiled(self) -> "CompiledSettings":
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self.compile()._compiled
+        return compiled
 
     def deletion_allowed(self, section_path: str):
-        foo = [fnmatch(section_path, pattern) for pattern in self.no_deletions]
-        return not any(fnmatch(section_path, pattern) for pattern in self.no_deletions)
+        results = self._get_compiled().deletion_allowed_results
+        allowed = results.get(section_path)
+        if allowed is None:
+            allowed = not self._compiled.no_deletions(section_path)
+            results[section_path] = allowed
+        return allowed
 
     def creation_allowed(self, section_path: str):
-        return not any(fnmatch(section_path, pattern) for pattern in self.no_creations)
+        results = self._get_compiled().creation_allowed_results
+        allowed = results.get(section_path)
+        if allowed is None:
+            allowed = not self._compiled.no_creations(section_path)
+            results[section_path] = allowed
+        return allowed
 
     def is_expression_order_important(self, section_path: str):
-        return any(
-            fnmatch(section_path, pattern)
-            for pattern in self.expression_order_important
+        results = self._get_compiled().expression_order_important_results
+        important = results.get(section_path)
+        if important is None:
+            important = self._compiled.expression_order_important(section_path)
+            results[section_path] = important
+        return important
+
+    def is_columnar(self, section_path: str):
+        results = self._get_compiled().columnar_results
+        columnar = results.get(section_path)
+        if columnar is None:
+            # Note that is_expression_order_important() may be overridden
+            columnar = not self.is_expression_order_important(
+                section_path
+            ) and self._compiled.columnar_sections(section_path)
+            results[section_path] = columnar
+        return columnar
+
+    def fingerprint(self) -> str:
+        """Get a hash which identifies these settings
+
+        Two settings objects will have the same fingerprint if they are of the
+        same class and have the same values. Note that this cannot detect changes to
+        the logic within any overridden methods, so change your class name (or
+        clear any caches) if you make such changes.
+        """
+        cls = self.__class__
+        state = (
+            f"{cls.__module__}.{cls.__qualname__}",
+            sorted(self.natural_keys.items()),
+            sorted(self.no_deletions),
+            sorted(self.no_creations),
+            sorted(self.expression_order_important),
+            sorted(self.columnar_sections),
         )
+        return hashlib.blake2b(repr(state).encode("utf8"), digest_size=16).hexdigest()
+
+
+class CompiledSettings:
+    """The compiled wildcard patterns for a Settings object
+
+    Each set of patterns is compiled into a single regex. The results
+    for each section path are also stored here (see `Settings.compile()`).
+    """
+
+    __slots__ = (
+        "natural_key",
+        "no_deletions",
+        "no_creations",
+        "expression_order_important",
+        "columnar_sections",
+        "natural_key_results",
+        "deletion_allowed_results",
+        "creation_allowed_results",
+        "expression_order_important_results",
+        "columnar_results",
+    )
+
+    def __init__(self, settings: Settings):
+        # Function which finds the natural key for a section path
+        self.natural_key = compile_natural_keys(settings.natural_keys)
+
+        # Functions which check if a section path matches any of the patterns
+        self.no_deletions = compile_patterns(settings.no_deletions)
+        self.no_creations = compile_patterns(settings.no_creations)
+        self.expression_order_important = compile_patterns(
+            settings.expression_order_important
+        )
+        self.columnar_sections = compile_patterns(settings.columnar_sections)
+
+        # Results for each section path
+        self.natural_key_results: Dict[str, NaturalKey] = {}
+        self.deletion_allowed_results: Dict[str, bool] = {}
+        self.creation_allowed_results: Dict[str, bool] = {}
+        self.expression_order_important_results: Dict[str, bool] = {}
+        self.columnar_results: Dict[str, bool] = {}
+
+
+def compile_patterns(patterns: Iterable[str]) -> Callable[[str], bool]:
+    """Compile wildcard patterns into a function which checks if a section path matches any of them
+
+    This matches in the same way as `fnmatch.fnmatch()`, but checks every pattern using a single regex
+    """
+    patterns = sorted(patterns)
+    if not patterns:
+        return _match_nothing
+
+    regex = re.compile(
+        "|".join(f"(?:{translate(os.path.normcase(p))})" for p in patterns)
+    )
+
+    def matches(section_path: str) -> bool:
+        return regex.match(os.path.normcase(section_path)) is not None
+
+    return matches
+
+
+def _match_nothing(section_path: str) -> bool:
+    return False
+
+
+def compile_natural_keys(
+    natural_keys: Dict[str, NaturalKey]
+) -> Callable[[str], Optional[NaturalKey]]:
+    """Compile natural keys into a function which finds the natural key for a section path
+
+    Section paths are matched exactly where possible. Otherwise the first matching
+    wildcard pattern is used (all patterns are checked using a single regex). The function
+    returns None if there is no match.
+    """
+    exact = {}
+    patterns = []
+    for section_path, natural_key in natural_keys.items():
+        if not isinstance(natural_key, str):
+            # Eg. a list of keys, as may be given when loading settings from a file
+            natural_key = tuple(natural_key)
+            if len(natural_key) == 1:
+                natural_key = natural_key[0]
+
+        if any(c in section_path for c in WILDCARD_CHARACTERS):
+            patterns.append((section_path, natural_key))
+        else:
+            exact.setdefault(section_path, natural_key)
+
+    if not patterns:
+        return exact.get
+
+    # Each pattern is a named group, so we can tell which one matched.
+    # Alternatives are tried in order, so the first matching pattern wins
+    regex = re.compile(
+        "|".join(
+            f"(?P<p{i}>{translate(os.path.normcase(pattern))})"
+            for i, (pattern, _) in enumerate(patterns)
+        )
+    )
+
+    def natural_key(section_path: str) -> Optional[NaturalKey]:
+        if section_path in exact:
+            return exact[section_path]
+        match = regex.match(os.path.normcase(section_path))
+        if match is None:
+            return None
+        for i, (_, natural_key_) in enumerate(patterns):
+            if match.group(f"p{i}") is not None:
+                return natural_key_
+
+    return natural_key
+
+
+# Used whenever no settings are given. This is shared by all parsed objects, so
+# avoid modifying it (create your own Settings object instead)
+DEFAULT_SETTINGS = Settings()
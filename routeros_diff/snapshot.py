@@ -0,0 +1,278 @@
+import struct
+from datetime import datetime
+from typing import BinaryIO, Dict, List, Optional, Tuple, Callable
+
+from routeros_diff.arguments import Arg, ArgList, ArgValue
+from routeros_diff.columns import compact_expressions
+from routeros_diff.expressions import Expression
+from routeros_diff.sections import Section
+from routeros_diff.settings import Settings
+from routeros_diff.utilities import gc_paused
+
+# A compact binary format for parsed configurations
+#
+# See `RouterOSConfig.dump()` and `RouterOSConfig.load()`.
+#
+# A snapshot is laid out as follows:
+#
+#     magic           b"RSNP"
+#     version         1 byte
+#     header length   4 bytes, little endian
+#     header          string table, timestamp, RouterOS version & section index
+#     section data    the expressions for each section, one after another
+#
+# All strings (section paths, commands, keys, comparators and values) are stored
+# once in the string table, and are then referred to by their index. All integers
+# are encoded as varints, so most take only a single byte.
+#
+# The section index lists the path of each section along with the offset & length
+# of its data. This allows a single section to be loaded without decoding the others.
+MAGIC = b"RSNP"
+VERSION = 1
+
+_HEADER_LENGTH = struct.Struct("<I")
+
+# Arg values are encoded as a single varint. Positional args (which have no value)
+# and expression values are given these codes, and the code of any string value is its
+# index in the string table plus _VALUE_STRING_OFFSET
+_VALUE_NONE = 0
+_VALUE_EXPRESSION = 1
+_VALUE_STRING_OFFSET = 2
+
+
+def dump(
+    f: BinaryIO,
+    timestamp: Optional[datetime],
+    router_os_version: Optional[Tuple[int, ...]],
+    sections: List[Section],
+):
+    """Write a snapshot of the given configuration to the binary file f"""
+    strings: Dict[str, int] = {}
+
+    def string_index(s: str) -> int:
+        index = strings.get(s)
+        if index is None:
+            index = strings[s] = len(strings)
+        return index
+
+    # Encode the sections first, as this populates the string table
+    section_data = bytearray()
+    index = bytearray()
+    _write_varint(index, len(sections))
+    for section in sections:
+        data = bytearray()
+        _write_varint(data, len(section.expressions))
+        for expression in section.expressions:
+            _write_expression(data, expression, string_index)
+
+        _write_varint(index, string_index(section.path))
+        _write_varint(index, len(section_data))
+        _write_varint(index, len(data))
+        section_data += data
+
+    header = bytearray()
+    _write_varint(header, string_index(timestamp.isoformat()) + 1 if timestamp else 0)
+    _write_varint(header, len(router_os_version or ()))
+    for part in router_os_version or ():
+        _write_varint(header, part)
+    header += index
+
+    string_table = bytearray()
+    _write_varint(string_table, len(strings))
+    for s in strings:
+        encoded = s.encode("utf8")
+        _write_varint(string_table, len(encoded))
+        string_table += encoded
+
+    f.write(MAGIC)
+    f.write(bytes([VERSION]))
+    f.write(_HEADER_LENGTH.pack(len(string_table) + len(header)))
+    f.write(string_table)
+    f.write(header)
+    f.write(section_data)
+
+
+def load(
+    f: BinaryIO, settings: Settings
+) -> Tuple[Optional[datetime], Optional[Tuple[int, ...]], List[Section]]:
+    """Load a snapshot from the binary file f
+
+    Returns the timestamp, RouterOS version and sections
+    """
+    strings, timestamp, router_os_version, index = _read_header(f)
+    section_data = f.read()
+    sections = []
+    with gc_paused():
+        for path, offset, length in index:
+            sections.append(
+                _read_section(
+                    section_data[offset : offset + length], path, strings, settings
+                )
+            )
+    return timestamp, router_os_version, sections
+
+
+def load_section(f: BinaryIO, path: str, settings: Settings) -> Optional[Section]:
+    """Load only the section with the given path from the binary file f
+
+    Returns None if the snapshot has no such section.
+    """
+    strings, _, _, index = _read_header(f)
+    for section_path, offset, length in index:
+        if section_path == path:
+            break
+    else:
+        return None
+
+    if f.seekable():
+        f.seek(offset, 1)
+        data = f.read(length)
+    else:
+        data = f.read(offset + length)[offset:]
+
+    with gc_paused():
+        return _read_section(data, path, strings, settings)
+
+
+def _write_varint(out: bytearray, n: int):
+    """Encode a non-negative integer using 7 bits per byte, least significant first"""
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _write_expression(
+    out: bytearray, expression: Expression, string_index: Callable[[str], int]
+):
+    _write_varint(out, string_index(expression.command))
+    if expression.find_expression:
+        _write_varint(out, 1)
+        _write_expression(out, expression.find_expression, string_index)
+    else:
+        _write_varint(out, 0)
+
+    _write_varint(out, len(expression.args))
+    for arg in expression.args:
+        _write_varint(out, string_index(arg.key))
+        _write_varint(out, string_index(arg.comparator))
+        if arg.value is None:
+            _write_varint(out, _VALUE_NONE)
+        elif isinstance(arg.value, ArgValue):
+            _write_varint(out, string_index(arg.value.value) + _VALUE_STRING_OFFSET)
+        else:
+            _write_varint(out, _VALUE_EXPRESSION)
+            _write_expression(out, arg.value.value, string_index)
+
+
+def _read_varints(data: bytes) -> List[int]:
+    """Decode a sequence of varints"""
+    ints = []
+    n = 0
+    shift = 0
+    for byte in data:
+        if byte < 0x80:
+            ints.append(n | (byte << shift))
+            n = 0
+            shift = 0
+        else:
+            n |= (byte & 0x7F) << shift
+            shift += 7
+    return ints
+
+
+def _read_varint(data: bytes, i: int) -> Tuple[int, int]:
+    """Decode a single varint at position i, returning the value & the next position"""
+    n = 0
+    shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, i
+        shift += 7
+
+
+def _read_header(f: BinaryIO):
+    """Read the string table & section index
+
+    Leaves f positioned at the start of the section data
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a RouterOS configuration snapshot")
+
+    version = f.read(1)
+    if version != bytes([VERSION]):
+        raise ValueError(f"Unsupported snapshot version: {version!r}")
+
+    (header_length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+    header = f.read(header_length)
+    if len(header) != header_length:
+        raise ValueError("Snapshot is truncated")
+
+    # String table
+    count, i = _read_varint(header, 0)
+    strings = []
+    for _ in range(count):
+        length, i = _read_varint(header, i)
+        strings.append(header[i : i + length].decode("utf8"))
+        i += length
+
+    # The remainder of the header contains only varints
+    ints = iter(_read_varints(header[i:]))
+    timestamp = next(ints)
+    timestamp = datetime.fromisoformat(strings[timestamp - 1]) if timestamp else None
+    router_os_version = tuple(next(ints) for _ in range(next(ints))) or None
+
+    index = []
+    for _ in range(next(ints)):
+        index.append((strings[next(ints)], next(ints), next(ints)))
+
+    return strings, timestamp, router_os_version, index
+
+
+def _read_section(
+    data: bytes, path: str, strings: List[str], settings: Settings
+) -> Section:
+    next_int = iter(_read_varints(data)).__next__
+    expressions = [
+        _read_expression(next_int, strings, path, settings) for _ in range(next_int())
+    ]
+    # Large sections are stored as columns again, just as when parsing
+    return Section(
+        path=path,
+        expressions=compact_expressions(expressions, path, settings),
+        settings=settings,
+    )
+
+
+def _read_expression(
+    next_int: Callable[[], int], strings: List[str], section_path: str, settings
+) -> Expression:
+    command = strings[next_int()]
+    if next_int():
+        find_expression = _read_expression(next_int, strings, section_path, settings)
+    else:
+        find_expression = None
+
+    args = ArgList()
+    for _ in range(next_int()):
+        key = strings[next_int()]
+        comparator = strings[next_int()]
+        value = next_int()
+        if value == _VALUE_NONE:
+            value = None
+        elif value == _VALUE_EXPRESSION:
+            value = _read_expression(next_int, strings, section_path, settings)
+        else:
+            value = strings[value - _VALUE_STRING_OFFSET]
+        args.append(Arg(key, value, comparator, settings=settings))
+
+    return Expression(
+        section_path=section_path,
+        command=command,
+        find_expression=find_expression,
+        args=args,
+        settings=settings,
+    )
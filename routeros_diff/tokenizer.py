@@ -0,0 +1,167 @@
+import re
+from typing import List, Optional, Tuple, Union
+
+# A single word within an expression, in the form (key, comparator, value).
+#
+# For example, `name=core` is ("name", "=", "core"), `comment~ID:1` is
+# ("comment", "~", "ID:1"), and the positional word `telnet` is ("telnet", "=", None).
+#
+# Sub-expressions (`[ find name=core ]`) have a list of words as their value. A
+# sub-expression which is not the value of a key (such as a find expression) will
+# have a key of None.
+Word = Tuple[Optional[str], str, Union[str, list, None]]
+
+# Whitespace and line continuations, both of which separate words
+_WHITESPACE = re.compile(r"(?:[ \t\r\n]|\\\r?\n)*")
+
+# The common case of a word with no quoting or escaping. Eg: `name=core` or `telnet`
+_SIMPLE_WORD = re.compile(
+    r'([^ \t\r\n"\\=~\[\]]+)(?:=([^ \t\r\n"\\\[\]]*))?(?=[ \t\r\n\]]|\Z)'
+)
+
+# Runs of characters with no special meaning
+_PLAIN = re.compile(r'[^ \t\r\n"\\=~\]\[]+')
+_QUOTED_PLAIN = re.compile(r'[^"\\]+')
+
+# Keys which may be followed by a '~' comparator. Eg: `comment~ID:1`
+_KEY = re.compile(r"[a-zA-Z0-9_.-]+")
+
+# A value which has been split onto the next line, directly after its comparator
+_VALUE_CONTINUATION = re.compile(r"(?: *\\\r?\n *)+")
+
+# A line continuation within a string (with any indentation either side)
+_QUOTED_CONTINUATION = re.compile(r"\\\r?\n *(\\_)?")
+
+_SEPARATORS = frozenset(" \t\r\n")
+
+
+def tokenize(s: str) -> List[Word]:
+    """Split a RouterOS expression into words in a single left-to-right pass
+
+    Handles quoting, escaping, `\\` line continuations, `=`/`~` comparators, and
+    nested `[ ... ]` sub-expressions. Raises a ValueError if the expression
+    cannot be tokenized (for example, due to an unclosed quote).
+
+    Example:
+
+        >>> tokenize('set [ find name=core ] comment="A comment"')
+        [('set', '=', None), (None, '=', [('find', '=', None), ('name', '=', 'core')]), ('comment', '=', 'A comment')]
+    """
+    words, _ = _tokenize(s, 0, nested=False)
+    return words
+
+
+def _tokenize(s: str, i: int, nested: bool) -> Tuple[List[Word], int]:
+    """Read words from position i until the end of the string (or sub-expression)"""
+    words = []
+    n = len(s)
+    while True:
+        i = _WHITESPACE.match(s, i).end()
+        if i >= n:
+            if nested:
+                raise ValueError(f"Unclosed sub-expression: {s}")
+            return words, i
+
+        c = s[i]
+        if c == "]" and nested:
+            return words, i + 1
+        elif c == "[":
+            sub_expression, i = _tokenize(s, i + 1, nested=True)
+            words.append((None, "=", sub_expression))
+            continue
+
+        simple_word = _SIMPLE_WORD.match(s, i)
+        if simple_word and (nested or not s.startswith("]", simple_word.end())):
+            key, value = simple_word.groups()
+            words.append((key, "=", value))
+            i = simple_word.end()
+        else:
+            word, i = _read_word(s, i, nested)
+            words.append(word)
+
+
+def _read_word(s: str, i: int, nested: bool) -> Tuple[Word, int]:
+    """Read a single word, such as `name=core`, `comment="A comment"` or `telnet`"""
+    n = len(s)
+    buffer = []
+    key = None
+    comparator = "="
+    in_quotes = False
+
+    while i < n:
+        c = s[i]
+
+        if in_quotes:
+            if c == '"':
+                in_quotes = False
+                i += 1
+            elif c == "\\":
+                continuation = _QUOTED_CONTINUATION.match(s, i)
+                if continuation:
+                    # Line continuation within a string. Drop the new line and
+                    # any indentation either side of it. A `\_` following the
+                    # continuation represents a space.
+                    if buffer:
+                        buffer[-1] = buffer[-1].rstrip(" ")
+                    if continuation.group(1):
+                        buffer.append(" ")
+                    i = continuation.end()
+                elif s.startswith('"', i + 1) or s.startswith("\\", i + 1):
+                    buffer.append(s[i + 1])
+                    i += 2
+                else:
+                    # Preserve any other escape sequences as-is
+                    buffer.append(c)
+                    i += 1
+            else:
+                plain = _QUOTED_PLAIN.match(s, i)
+                buffer.append(plain.group())
+                i = plain.end()
+            continue
+
+        if c in _SEPARATORS or (c == "]" and nested):
+            break
+        elif c == "\\":
+            if s.startswith("\n", i + 1) or s.startswith("\r\n", i + 1):
+                # A line continuation outside of a string separates words
+                break
+            buffer.append(s[i + 1 : i + 2])
+            i += 2
+        elif c == '"':
+            in_quotes = True
+            i += 1
+        elif key is None and (
+            c == "=" or (c == "~" and _KEY.fullmatch("".join(buffer)))
+        ):
+            key = "".join(buffer)
+            comparator = c
+            buffer = []
+            i += 1
+
+            # Values may be split onto the next line, directly after the comparator
+            continuation = _VALUE_CONTINUATION.match(s, i)
+            if continuation:
+                i = continuation.end()
+
+            if s.startswith("[", i):
+                # The value is a sub-expression. Eg: place-before=[ find name=core ]
+                sub_expression, i = _tokenize(s, i + 1, nested=True)
+                return (key, comparator, sub_expression), i
+        else:
+            plain = _PLAIN.match(s, i)
+            if plain:
+                buffer.append(plain.group())
+                i = plain.end()
+            else:
+                # Special characters with no special meaning in this position
+                buffer.append(c)
+                i += 1
+
+    if in_quotes:
+        raise ValueError(f"No closing quotation: {s}")
+
+    if key is None:
+        # Positional word
+        return ("".join(buffer), "=", None), i
+    else:
+        return (key, comparator, "".join(buffer)), i
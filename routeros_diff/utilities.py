@@ -1,4 +1,7 @@
+import gc
 import re
+from contextlib import contextmanager
+from typing import Optional
 
 
 def find_expression(key, value, settings, *args):
@@ -15,6 +18,15 @@ def find_expression(key, value, settings, *args):
             args=ArgList([Arg("where", None), Arg("comment", f"ID:{value}", "~")]),
             settings=settings,
         )
+    elif isinstance(key, tuple):
+        # Compound key, so find using all of the keys. Eg: [ find list=a address=1.2.3.4 ]
+        return Expression(
+            section_path="",
+            command="find",
+            find_expression=None,
+            args=ArgList([Arg(k, v) for k, v in zip(key, value)]),
+            settings=settings,
+        )
     else:
         return Expression(
             section_path="",
@@ -43,6 +55,9 @@ def quote(s: str, force=False):
 
 def unescape_string(s: str):
     """Remove '\' escapes from a string value"""
+    if "\\\n" not in s:
+        # Nothing to unescape
+        return s
 
     # Remove escaped new lines where the new line starts with a \_
     # (\_ should be interpreted as space)
@@ -52,3 +67,133 @@ def unescape_string(s: str):
     s = re.sub(r" *\\\n *", "", s)
 
     return s
+
+
+@contextmanager
+def gc_paused():
+    """Pause the garbage collector while creating many objects at once
+
+    Parsed configurations contain no reference cycles, so there is no need for
+    the garbage collector to keep scanning them as they are created.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class ChangeCounter:
+    """Counts changes made to a group of objects
+
+    Anything calculated from those objects only needs to be checked again
+    if the count has changed since it was calculated.
+    """
+
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+    def changed(self):
+        self.count += 1
+
+
+# Counts changes made to expressions after they have been created (including changes
+# to their args). See `ExpressionList`, which only re-checks its expressions for changes
+# if this has changed.
+EXPRESSION_CHANGES = ChangeCounter()
+
+
+class IndexedList(list):
+    """A list which keeps an index of its items, such as a dict of items by key
+
+    The index is built when first needed (see `_build_index()`), and is
+    discarded whenever the list is changed, so it is always consistent
+    with the list's contents. `version` is also incremented whenever the
+    list is changed, which allows other cached values to be invalidated.
+    Changes are also counted by `change_counter`, if set.
+    """
+
+    __slots__ = ("_index", "_version", "change_counter")
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._index = None
+        self._version = 0
+        self.change_counter: Optional[ChangeCounter] = None
+
+    def __reduce__(self):
+        # Pickle & copy as a plain list of items. By default the items
+        # would be added before our slots have been restored
+        return self.__class__, (list(self),)
+
+    @property
+    def version(self) -> int:
+        """The number of times this list has been changed"""
+        return self._version
+
+    def _get_index(self) -> dict:
+        index = self._index
+        if index is None:
+            index = self._index = self._build_index()
+        return index
+
+    def _build_index(self) -> dict:
+        raise NotImplementedError()
+
+    def _changed(self):
+        self._index = None
+        self._version += 1
+        if self.change_counter is not None:
+            self.change_counter.count += 1
+
+    def __setitem__(self, key, value):
+        self._changed()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._changed()
+        super().__delitem__(key)
+
+    def __iadd__(self, other):
+        self._changed()
+        return super().__iadd__(other)
+
+    def __imul__(self, n):
+        self._changed()
+        return super().__imul__(n)
+
+    def append(self, item):
+        self._changed()
+        super().append(item)
+
+    def extend(self, items):
+        self._changed()
+        super().extend(items)
+
+    def insert(self, i, item):
+        self._changed()
+        super().insert(i, item)
+
+    def pop(self, i=-1):
+        self._changed()
+        return super().pop(i)
+
+    def remove(self, item):
+        self._changed()
+        super().remove(item)
+
+    def clear(self):
+        self._changed()
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self._changed()
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._changed()
+        super().reverse()
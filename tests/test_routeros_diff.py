@@ -1,13 +1,28 @@
+import copy
+import dataclasses
+import fnmatch
+import gc
+import io
+import os
+import pickle
+import tracemalloc
 from datetime import datetime
 from pathlib import Path
 
 import pytest
 
+import routeros_diff.arguments
+import routeros_diff.columns
 import routeros_diff.exceptions
 import routeros_diff.expressions
+import routeros_diff.ordering
 import routeros_diff.sections
+import routeros_diff.settings
 import routeros_diff.utilities
 from routeros_diff import parser
+from routeros_diff.cache import ParseCache
+from routeros_diff.fleet import FleetDiffer
+from routeros_diff.settings import Settings
 
 
 # fmt: off
@@ -478,10 +493,30 @@ def test_diff_section_order_important():
     )
 
     diffed = new.diff(old)
-    assert len(diffed.expressions) == 3
+    assert len(diffed.expressions) == 2
+    assert str(diffed.expressions[0]) == "remove [ find foo=a moo=b ]"
+    assert str(diffed.expressions[1]) == "add foo=a moo=new-value"
+
+
+def test_diff_section_order_important_wipe():
+    old = routeros_diff.sections.Section.parse(
+        "/ip firewall nat\n"
+        "add foo=bar moo=cow\n"
+        "add foo=a moo=b\n"
+        "add foo=a moo=b\n"
+    )
+    new = routeros_diff.sections.Section.parse(
+        "/ip firewall nat\n"
+        "add foo=bar moo=cow\n"
+        "add foo=a moo=b\n"
+        "add foo=a moo=new-value\n"
+    )
+
+    # Removing one of the duplicates would remove both, so wipe and recreate instead
+    diffed = new.diff(old)
+    assert len(diffed.expressions) == 4
     assert str(diffed.expressions[0]) == "remove [ find ]"
     assert str(diffed.expressions[1]) == "add foo=bar moo=cow"
-    assert str(diffed.expressions[2]) == "add foo=a moo=new-value"
 
 
 def test_diff_section_order_important_with_ids_modify_same_order():
@@ -891,6 +926,1519 @@ def test_duplicate_section():
     assert len(config.sections[0].expressions) == 2
 
 
+def test_parse_sub_expression_value():
+    expression = routeros_diff.expressions.Expression.parse(
+        'add chain=b place-before=[ find where comment~"ID:3" ]', "/ip firewall nat"
+    )
+    assert expression.find_expression is None
+    place_before = expression.args["place-before"].value
+    assert place_before.command == "find"
+    assert place_before.args[1].key == "comment"
+    assert place_before.args[1].comparator == "~"
+    assert place_before.args[1].value == "ID:3"
+    assert str(expression) == 'add chain=b place-before=[ find where comment~"ID:3" ]'
+
+
+def test_parse_find_by_comment_id():
+    expression = routeros_diff.expressions.Expression.parse(
+        'set [ find where comment~ID:main ] mtu=1500', "/interface bridge"
+    )
+    assert expression.natural_key_and_id == ("comment-id", "main")
+
+
+def test_parse_find_with_brackets_in_comment():
+    expression = routeros_diff.expressions.Expression.parse(
+        'set [ find name=core ] comment="Core [ ID:core ]"', "/routing ospf instance"
+    )
+    assert expression.find_expression.args["name"] == "core"
+    assert expression.args["comment"] == "Core [ ID:core ]"
+
+
+def test_parse_escapes_in_quoted_value():
+    expression = routeros_diff.expressions.Expression.parse(
+        'add comment="C:\\\\temp" name="a b"', "/foo"
+    )
+    assert expression.args["comment"] == "C:\\temp"
+    assert expression.args["name"] == "a b"
+
+
+def test_parse_unclosed_quote():
+    with pytest.raises(ValueError) as cm:
+        routeros_diff.expressions.Expression.parse('add comment="foo', "/foo")
+    assert "Error parsing line" in str(cm.value)
+
+
+def test_parse_lines():
+    config = parser.RouterOSConfig.parse_lines(ENTIRE_CONFIG.splitlines(keepends=True))
+    expected = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    assert config.timestamp == datetime(2021, 2, 21, 20, 53, 34)
+    assert config.router_os_version == (6, 46, 8)
+    assert str(config) == str(expected)
+
+
+def test_parse_lines_crlf():
+    config = parser.RouterOSConfig.parse_lines([
+        "/foo\r\n",
+        "add foo=bar \\\r\n",
+        "    moo=cow\r\n",
+    ])
+    assert str(config.sections[0].expressions[0]) == "add foo=bar moo=cow"
+
+
+def test_iter_parse_is_streamed():
+    consumed = []
+
+    def lines():
+        for line in ["# header", "/foo", "add name=a", "/bar", "add name=b", "/foo", "add name=c"]:
+            consumed.append(line)
+            yield line
+
+    sections = parser.RouterOSConfig.iter_parse(lines())
+    first = next(sections)
+    assert str(first) == "/foo\nadd name=a\n"
+    # Only read up to the start of the next section
+    assert consumed[-1] == "/bar"
+    assert [s.path for s in sections] == ["/bar", "/foo"]
+
+
+def test_parse_lines_duplicate_section():
+    config = parser.RouterOSConfig.parse_lines([
+        "/routing ospf instance",
+        "add name=core router-id=10.127.0.1",
+        "/routing ospf instance",
+        "add name=another-area router-id=10.127.0.1",
+    ])
+    assert len(config.sections) == 1
+    assert len(config.sections[0].expressions) == 2
+
+
+def test_parse_buffer():
+    config = parser.RouterOSConfig.parse_buffer(ENTIRE_CONFIG.encode())
+    assert config.timestamp == datetime(2021, 2, 21, 20, 53, 34)
+    assert config.router_os_version == (6, 46, 8)
+    assert str(config) == str(parser.RouterOSConfig.parse(ENTIRE_CONFIG))
+
+
+def test_parse_buffer_line_continuations():
+    config = parser.RouterOSConfig.parse_buffer(
+        b"/foo\r\n"
+        b"    \\\r\n"
+        b"add foo=\\\r\n"
+        b"    bar moo=cow \\\r\n"
+        b'    comment="A [\\\r\n'
+        b'    \\_ID:1 ]"\r\n'
+        b"/bar\r\n"
+        b"add foo=a\\\r\n"
+    )
+    assert str(config) == (
+        '/foo\nadd foo=bar moo=cow comment="A [ ID:1 ]"\n'
+        "\n"
+        "/bar\nadd foo=a\n"
+    )
+
+
+def test_parse_file(tmp_path):
+    path = tmp_path / "config.rsc"
+    path.write_bytes(ENTIRE_CONFIG.replace("\n", "\r\n").encode())
+    config = parser.RouterOSConfig.parse_file(path)
+    assert config.router_os_version == (6, 46, 8)
+    assert str(config) == str(parser.RouterOSConfig.parse(ENTIRE_CONFIG))
+
+
+def test_parse_file_empty(tmp_path):
+    path = tmp_path / "config.rsc"
+    path.write_bytes(b"")
+    assert parser.RouterOSConfig.parse_file(path).sections == []
+
+
+def test_parse_with_workers(monkeypatch):
+    monkeypatch.setattr(parser, "PARALLEL_PARSE_MIN_SIZE", 0)
+    monkeypatch.setattr(parser, "PARALLEL_PARSE_CHUNK_SIZE", 50)
+    config = parser.RouterOSConfig.parse(ENTIRE_CONFIG, workers=2)
+    expected = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    assert config.keys() == expected.keys()
+    assert str(config) == str(expected)
+
+
+def test_parse_with_workers_small_config_is_serial(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("Process pool should not be used")
+
+    monkeypatch.setattr(parser, "ProcessPoolExecutor", fail)
+    config = parser.RouterOSConfig.parse(ENTIRE_CONFIG, workers=2)
+    assert len(config.sections) == 17
+
+
+def test_split_section_text():
+    chunks = list(parser._split_section_text(
+        "/foo\n"
+        "add name=a \\\n"
+        "    comment=a\n"
+        "add name=b\n"
+        "add name=c",
+        chunk_size=5,
+    ))
+    assert chunks == [
+        "/foo\nadd name=a \\\n    comment=a",
+        "/foo\nadd name=b",
+        "/foo\nadd name=c",
+    ]
+
+
+def test_parse_lazy():
+    config = parser.RouterOSConfig.parse(ENTIRE_CONFIG, lazy=True)
+    expected = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    assert config.keys() == expected.keys()
+    assert not any(section.is_parsed for section in config.sections)
+
+    # Only the accessed section is parsed
+    section = config["/interface ethernet"]
+    assert not section.is_parsed
+    assert str(section) == str(expected["/interface ethernet"])
+    assert section.is_parsed
+    assert sum(section.is_parsed for section in config.sections) == 1
+
+    assert str(config) == str(expected)
+    assert all(section.is_parsed for section in config.sections)
+
+
+def test_parse_lazy_duplicate_section():
+    config = parser.RouterOSConfig.parse(
+        "/ip address\nadd address=1.1.1.1\n/interface bridge\nadd name=br\n/ip address\nadd address=2.2.2.2",
+        lazy=True,
+    )
+    assert config.keys() == ["/ip address", "/interface bridge"]
+    assert str(config["/ip address"]) == "/ip address\nadd address=1.1.1.1\nadd address=2.2.2.2\n"
+
+
+def test_parse_lazy_diff():
+    old = parser.RouterOSConfig.parse(ENTIRE_CONFIG, lazy=True)
+    new = parser.RouterOSConfig.parse(ENTIRE_CONFIG.replace("name=rr1", "name=rr2"), lazy=True)
+    expected = parser.RouterOSConfig.parse(ENTIRE_CONFIG.replace("name=rr1", "name=rr2")).diff(
+        parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    )
+    assert str(new.diff(old)) == str(expected)
+
+
+def test_reparse(monkeypatch):
+    previous = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    new_text = ENTIRE_CONFIG.replace("name=rr1", "name=rr2")
+
+    parsed = []
+    section_class = routeros_diff.sections.Section
+    original_parse = section_class.parse
+    monkeypatch.setattr(section_class, "parse", lambda s, settings=None: parsed.append(s) or original_parse(s, settings))
+    config = parser.RouterOSConfig.reparse(new_text, previous)
+
+    # Only the changed section is parsed
+    assert len(parsed) == 1
+    assert parsed[0].startswith("/routing bgp peer")
+    for section in config.sections:
+        assert (section is previous[section.path]) == (section.path != "/routing bgp peer")
+
+    assert str(config) == str(parser.RouterOSConfig.parse(new_text))
+    assert config.section_digests == parser.RouterOSConfig.parse(new_text)._get_section_digests()
+
+
+def test_parse_does_not_calculate_digests(monkeypatch):
+    def section_digest(s, spans):
+        raise AssertionError("Should not calculate digests")
+
+    monkeypatch.setattr(parser, "_section_digest", section_digest)
+    for lazy in (False, True):
+        config = parser.RouterOSConfig.parse(ENTIRE_CONFIG, lazy=lazy)
+        assert config.section_digests is None
+
+
+def test_reparse_added_and_removed_sections():
+    previous = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    new_text = ENTIRE_CONFIG.replace("/tool sniffer", "/tool sniffer2") + "\n/ip pool\nadd name=new\n"
+    config = parser.RouterOSConfig.reparse(new_text, previous)
+    assert config.keys() == parser.RouterOSConfig.parse(new_text).keys()
+    assert str(config) == str(parser.RouterOSConfig.parse(new_text))
+
+
+def test_reparse_settings_changed():
+    previous = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    config = parser.RouterOSConfig.reparse(ENTIRE_CONFIG, previous, settings=dict(natural_keys={"/routing bgp peer": "remote-address"}))
+    assert not any(section is previous[section.path] for section in config.sections)
+
+    # Equal settings can still be reused
+    config = parser.RouterOSConfig.reparse(ENTIRE_CONFIG, previous, settings=Settings())
+    assert all(section is previous[section.path] for section in config.sections)
+
+
+def test_reparse_without_digests():
+    previous = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    previous = parser.RouterOSConfig(
+        timestamp=previous.timestamp,
+        router_os_version=previous.router_os_version,
+        sections=list(previous.sections),
+        settings=previous.settings,
+    )
+    config = parser.RouterOSConfig.reparse(ENTIRE_CONFIG, previous)
+    assert not any(section is previous[section.path] for section in config.sections)
+    assert str(config) == str(previous)
+
+
+def test_parse_cache(tmp_path, monkeypatch):
+    cache = ParseCache(tmp_path)
+    expected = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    assert str(cache.parse(ENTIRE_CONFIG)) == str(expected)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # A cache hit does not tokenize anything
+    def tokenize(s):
+        raise AssertionError("Should not tokenize")
+
+    monkeypatch.setattr(routeros_diff.expressions, "tokenize", tokenize)
+    config = cache.parse(ENTIRE_CONFIG)
+    assert str(config) == str(expected)
+    assert config.timestamp == expected.timestamp
+    assert config.router_os_version == expected.router_os_version
+
+
+def test_parse_cache_settings(tmp_path):
+    cache = ParseCache(tmp_path)
+    s = "/ip address\nadd address=1.2.3.4 interface=ether1"
+    config = cache.parse(s)
+    assert config["/ip address"].expressions[0].natural_key_and_id == ("address", "1.2.3.4/32")
+
+    # Different settings should not use the same cache entry
+    config = cache.parse(s, settings=dict(natural_keys={"/ip address": "interface"}))
+    assert config["/ip address"].expressions[0].natural_key_and_id == ("interface", "ether1")
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_parse_cache_evicts_least_recently_used(tmp_path):
+    cache = ParseCache(tmp_path, max_entries=2)
+    configs = [f"/system identity\nset name=router{i}" for i in range(3)]
+    for i, s in enumerate(configs):
+        cache.parse(s)
+        # Make sure each entry has a different modification time
+        for path in tmp_path.iterdir():
+            os.utime(path, (path.stat().st_atime, path.stat().st_mtime - 10))
+
+    keys = {f"{cache.key(s, Settings())}.rosparse" for s in configs[1:]}
+    assert {path.name for path in tmp_path.iterdir()} == keys
+
+
+def test_parse_cache_evicts_by_size(tmp_path):
+    cache = ParseCache(tmp_path, max_size=1)
+    cache.parse("/system identity\nset name=router")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_parse_cache_corrupt_entry(tmp_path):
+    cache = ParseCache(tmp_path)
+    s = "/system identity\nset name=router"
+    cache.parse(s)
+    path, = tmp_path.iterdir()
+    path.write_bytes(b"corrupt")
+    assert str(cache.parse(s)) == "/system identity\nset name=router\n"
+
+
+def test_dump_and_load():
+    config = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    f = io.BytesIO()
+    config.dump(f)
+    assert len(f.getvalue()) < len(ENTIRE_CONFIG)
+
+    f.seek(0)
+    loaded = parser.RouterOSConfig.load(f)
+    assert str(loaded) == str(config)
+    assert loaded.keys() == config.keys()
+    assert loaded.timestamp == config.timestamp
+    assert loaded.router_os_version == config.router_os_version
+
+
+def test_dump_and_load_sub_expressions():
+    config = parser.RouterOSConfig.parse(
+        '/ip firewall filter\nadd chain=a comment="A comment" place-before=[ find where comment~ID:1 ]\n'
+        "set [ find name=core ] disabled=yes\n"
+        "/routing ospf instance\nset default disabled=yes"
+    )
+    f = io.BytesIO()
+    config.dump(f)
+    f.seek(0)
+    assert str(parser.RouterOSConfig.load(f)) == str(config)
+
+
+def test_load_section():
+    config = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    f = io.BytesIO()
+    config.dump(f)
+
+    f.seek(0)
+    section = parser.RouterOSConfig.load_section(f, "/routing ospf area")
+    assert str(section) == str(config["/routing ospf area"])
+
+    f.seek(0)
+    assert parser.RouterOSConfig.load_section(f, "/foo") is None
+
+
+def test_load_invalid_snapshot():
+    with pytest.raises(ValueError):
+        parser.RouterOSConfig.load(io.BytesIO(b"/ip address"))
+
+
+# Memory used by each parsed expression in a large address list (in bytes),
+# including the strings for the keys & values
+EXPRESSION_MEMORY_BUDGET = 850
+
+
+def test_expression_memory_budget(monkeypatch):
+    # Measure expressions objects, rather than columns
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 10_000_000)
+    count = 5000
+    s = "/ip firewall address-list\n" + "\n".join(
+        f'add address=10.0.{i // 256}.{i % 256} list=blocked comment="Entry {i}"' for i in range(count)
+    )
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        section = routeros_diff.sections.Section.parse(s)
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(section.expressions) == count
+    assert (after - before) / count < EXPRESSION_MEMORY_BUDGET
+
+
+def test_default_settings_are_shared():
+    section = routeros_diff.sections.Section.parse("/ip address\nadd address=1.2.3.4 interface=ether1")
+    expression = section.expressions[0]
+    assert section.settings is expression.settings
+    assert all(arg.settings is section.settings for arg in expression.args)
+    assert not hasattr(expression, "__dict__")
+    assert not hasattr(expression.args[0], "__dict__")
+    assert not hasattr(expression.args[0].value, "__dict__")
+
+
+def test_values_are_interned():
+    section = routeros_diff.sections.Section.parse(
+        "/ip firewall filter\nadd action=accept chain=input\nadd action=accept chain=forward comment~ID:1"
+    )
+    first, second = section.expressions
+    assert first.args["action"] is second.args["action"]
+    assert first.args[0].key is second.args[0].key
+    assert first.args["chain"] is not second.args["chain"]
+    # Quoted & unquoted values are interned separately
+    assert second.args["comment"].force_quote and not second.args["chain"].force_quote
+    assert routeros_diff.arguments.ArgValue.intern("ID:1", force_quote=True) is second.args["comment"]
+    assert hash(first.args["action"]) == hash("accept")
+
+
+def test_interned_values_are_limited(monkeypatch):
+    monkeypatch.setattr(routeros_diff.arguments, "MAX_INTERNED_VALUES", 2)
+    monkeypatch.setattr(routeros_diff.arguments, "_interned_values", {})
+    for value in ("a", "b", "c"):
+        routeros_diff.arguments.ArgValue.intern(value)
+    assert list(routeros_diff.arguments._interned_values) == ["c"]
+
+
+COLUMNAR_ADDRESS_LIST = """
+/ip firewall address-list
+add address=10.0.0.1 list=blocked
+add address=10.0.0.2 list=blocked comment="Blocked [ ID:2 ]"
+add address=10.0.0.3 list=allowed timeout=1d
+"""
+
+COLUMNAR_SETTINGS = Settings(columnar_sections={"/ip firewall address-list", "/ip dhcp-server lease", "/ip route"})
+
+
+def test_columnar_section(monkeypatch):
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 3)
+    section = routeros_diff.sections.Section.parse(COLUMNAR_ADDRESS_LIST, settings=COLUMNAR_SETTINGS)
+    assert isinstance(section.expressions, routeros_diff.columns.ExpressionColumns)
+    assert section.expressions.keys == ["address", "list", "timeout", "comment"]
+    assert str(section) == COLUMNAR_ADDRESS_LIST.lstrip()
+    assert len(section.expressions) == 3
+    assert str(section.expressions[-1]) == "add address=10.0.0.3 list=allowed timeout=1d"
+    assert [str(e) for e in section.expressions[1:]] == [
+        'add address=10.0.0.2 list=blocked comment="Blocked [ ID:2 ]"',
+        "add address=10.0.0.3 list=allowed timeout=1d",
+    ]
+    with pytest.raises(IndexError):
+        section.expressions[3]
+
+    # Not used unless enabled in the settings
+    section = routeros_diff.sections.Section.parse(COLUMNAR_ADDRESS_LIST)
+    assert isinstance(section.expressions, routeros_diff.expressions.ExpressionList)
+
+
+def test_columnar_section_mutated(monkeypatch):
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 3)
+    old = routeros_diff.sections.Section.parse(COLUMNAR_ADDRESS_LIST, settings=COLUMNAR_SETTINGS)
+    section = routeros_diff.sections.Section.parse(COLUMNAR_ADDRESS_LIST, settings=COLUMNAR_SETTINGS)
+
+    # Columnar expressions are read-only
+    with pytest.raises(TypeError):
+        section.expressions[0] = section.expressions[1]
+    assert not hasattr(section.expressions, "append")
+
+    # But can be replaced with a list, which can then be edited
+    section.expressions = list(section.expressions)
+    section.expressions[0].args.append(routeros_diff.arguments.Arg("disabled", "yes"))
+    section.expressions.append(routeros_diff.expressions.Expression.parse("add address=10.0.0.4 list=a", section.path))
+    assert str(section).splitlines()[1:] == [
+        "add address=10.0.0.1 list=blocked disabled=yes",
+        *COLUMNAR_ADDRESS_LIST.strip().splitlines()[2:],
+        "add address=10.0.0.4 list=a",
+    ]
+    assert str(section.diff(old)).splitlines()[1:] == [
+        "set [ find list=blocked address=10.0.0.1 ] disabled=yes",
+        "add address=10.0.0.4 list=a",
+    ]
+
+
+def test_columnar_section_not_used(monkeypatch):
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 2)
+    for s in (
+        # Too small
+        "/ip firewall address-list\nadd address=10.0.0.1 list=a",
+        # Not listed in Settings.columnar_sections
+        "/ip address\nadd address=10.0.0.1 interface=a\nadd address=10.0.0.2 interface=b",
+        # Find expressions, positional args & inconsistent key ordering
+        "/ip route\nadd gateway=a\nset [ find gateway=a ] distance=2",
+        "/ip route\nadd gateway=a\nadd disabled gateway=b",
+        "/ip route\nadd gateway=a distance=1\nadd distance=2 gateway=b",
+    ):
+        section = routeros_diff.sections.Section.parse(s, settings=COLUMNAR_SETTINGS)
+        assert isinstance(section.expressions, list), s
+
+
+def test_columnar_sections_merged(monkeypatch):
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 3)
+    config = parser.RouterOSConfig.parse(
+        "/ip route\nadd gateway=a\nadd gateway=b\n/ip address\nadd address=1.2.3.4\n/ip route\nadd gateway=c",
+        settings=COLUMNAR_SETTINGS,
+    )
+    assert isinstance(config["/ip route"].expressions, routeros_diff.columns.ExpressionColumns)
+    assert str(config["/ip route"]) == "/ip route\nadd gateway=a\nadd gateway=b\nadd gateway=c\n"
+
+
+def test_columnar_sections_loaded(monkeypatch, tmp_path):
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 3)
+    monkeypatch.setattr(parser, "PARALLEL_PARSE_MIN_SIZE", 0)
+    s = ENTIRE_CONFIG + COLUMNAR_ADDRESS_LIST
+    expected = parser.RouterOSConfig.parse(s, settings=COLUMNAR_SETTINGS)
+    with io.BytesIO() as f:
+        expected.dump(f)
+        f.seek(0)
+        loaded = parser.RouterOSConfig.load(f, settings=COLUMNAR_SETTINGS)
+        f.seek(0)
+        loaded_section = parser.RouterOSConfig.load_section(f, "/ip firewall address-list", settings=COLUMNAR_SETTINGS)
+    cache = ParseCache(tmp_path)
+    cache.parse(s, settings=COLUMNAR_SETTINGS)
+
+    # Loaded sections are stored as columns, just as when parsing
+    for config in (
+        loaded,
+        cache.parse(s, settings=COLUMNAR_SETTINGS),
+        parser.RouterOSConfig.parse(s, settings=COLUMNAR_SETTINGS, workers=2),
+    ):
+        assert isinstance(config["/ip firewall address-list"].expressions, routeros_diff.columns.ExpressionColumns)
+        assert str(config) == str(expected)
+    assert isinstance(loaded_section.expressions, routeros_diff.columns.ExpressionColumns)
+
+
+def test_columnar_concat(monkeypatch):
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 2)
+    first = routeros_diff.sections.Section.parse("/ip route\nadd gateway=a\nadd gateway=b distance=2", settings=COLUMNAR_SETTINGS)
+    second = routeros_diff.sections.Section.parse("/ip route\nadd comment=x gateway=c\nadd gateway=a", settings=COLUMNAR_SETTINGS)
+    merged = routeros_diff.sections.Section.merge([first, second])
+    assert merged.expressions.keys == ["comment", "gateway", "distance"]
+    assert str(merged) == "/ip route\nadd gateway=a\nadd gateway=b distance=2\nadd comment=x gateway=c\nadd gateway=a\n"
+
+    # Inconsistent key ordering, so fall back to a list
+    third = routeros_diff.sections.Section.parse("/ip route\nadd distance=1 gateway=d\nadd gateway=e", settings=COLUMNAR_SETTINGS)
+    merged = routeros_diff.sections.Section.merge([first, third])
+    assert isinstance(merged.expressions, list)
+    assert len(merged.expressions) == 4
+
+
+@pytest.mark.parametrize(
+    "old,new",
+    [
+        # By value
+        (
+            "/ip route\nadd dst-address=1.0.0.0/8 gateway=a\nadd dst-address=2.0.0.0/8 gateway=a\nadd dst-address=3.0.0.0/8 gateway=a disabled=yes",
+            "/ip route\nadd dst-address=1.0.0.0/8 gateway=a\nadd dst-address=2.0.0.0/8 gateway=b\nadd dst-address=4.0.0.0/8 gateway=a",
+        ),
+        # By compound ID
+        (
+            "/ip firewall address-list\nadd address=1.1.1.1 list=a\nadd address=2.2.2.2 list=a\nadd address=3.3.3.3 list=a disabled=yes",
+            "/ip firewall address-list\nadd address=1.1.1.1 list=a\nadd address=2.2.2.2 list=b\nadd address=4.4.4.4 list=a comment=\"[ ID:x ]\"",
+        ),
+        # By ID
+        (
+            "/ip dhcp-server lease\nadd address=10.0.0.1 mac-address=A\nadd address=10.0.0.2 mac-address=B\nadd address=10.0.0.3 mac-address=C",
+            "/ip dhcp-server lease\nadd address=10.0.0.1 mac-address=A\nadd address=10.0.0.9 mac-address=B\nadd address=10.0.0.4 mac-address=D",
+        ),
+        # Duplicate IDs
+        (
+            "/ip dhcp-server lease\nadd address=10.0.0.1 mac-address=A\nadd address=10.0.0.2 mac-address=A\nadd address=10.0.0.3 mac-address=C",
+            "/ip dhcp-server lease\nadd address=10.0.0.1 mac-address=A\nadd address=10.0.0.2 mac-address=A\nadd address=10.0.0.4 mac-address=C",
+        ),
+    ],
+)
+def test_columnar_diff(monkeypatch, old, new):
+    expected = str(parser.RouterOSConfig.parse(new).diff(parser.RouterOSConfig.parse(old)))
+
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 3)
+    old = parser.RouterOSConfig.parse(old, settings=COLUMNAR_SETTINGS)
+    new = parser.RouterOSConfig.parse(new, settings=COLUMNAR_SETTINGS)
+    assert isinstance(new.sections[0].expressions, routeros_diff.columns.ExpressionColumns)
+    assert isinstance(old.sections[0].expressions, routeros_diff.columns.ExpressionColumns)
+    assert str(new.diff(old)) == expected
+    assert expected
+
+
+COLUMNAR_MEMORY_BUDGET = 450
+
+
+def test_columnar_memory_budget():
+    count = 5000
+    s = "/ip firewall address-list\n" + "\n".join(
+        f'add address=10.1.{i // 256}.{i % 256} list=blocked comment="Entry {i}"' for i in range(count)
+    )
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        section = routeros_diff.sections.Section.parse(s, settings=COLUMNAR_SETTINGS)
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert isinstance(section.expressions, routeros_diff.columns.ExpressionColumns)
+    assert (after - before) / count < COLUMNAR_MEMORY_BUDGET
+
+
+
+def test_section_natural_id_index():
+    section = routeros_diff.sections.Section.parse("/interface vlan\nadd name=a vlan-id=1\nadd name=b vlan-id=2\nadd name=b vlan-id=3")
+    assert section.natural_id_positions() == {"a": 0, "b": 1}
+    assert str(section["b"]) == "add name=b vlan-id=2"
+    assert section.get("c") is None
+    assert section.expression_index_for_natural_key("name", "b") == 1
+    with pytest.raises(KeyError):
+        section.expression_index_for_natural_key("comment-id", "b")
+
+    # The index is kept up to date as the expressions change
+    section.expressions.insert(0, routeros_diff.expressions.Expression.parse("add name=c", "/interface vlan"))
+    assert section.natural_id_positions() == {"c": 0, "a": 1, "b": 2}
+    del section.expressions[0]
+    section.expressions[0] = routeros_diff.expressions.Expression.parse("add name=e", "/interface vlan")
+    assert section.natural_id_positions() == {"e": 0, "b": 1}
+
+    section.expressions = [routeros_diff.expressions.Expression.parse("add name=d", "/interface vlan")]
+    assert isinstance(section.expressions, routeros_diff.expressions.ExpressionList)
+    assert section.natural_id_positions() == {"d": 0}
+
+
+def test_section_natural_id_index_columnar(monkeypatch):
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 2)
+    section = routeros_diff.sections.Section.parse(
+        "/ip route\nadd distance=1 gateway=10.0.0.1 comment=\"[ ID:a ]\"\nadd distance=1 gateway=10.0.0.2 comment=\"[ ID:b ]\"",
+        settings=COLUMNAR_SETTINGS,
+    )
+    assert isinstance(section.expressions, routeros_diff.columns.ExpressionColumns)
+    assert section.natural_id_positions() == {"a": 0, "b": 1}
+    assert str(section["b"]) == 'add distance=1 gateway=10.0.0.2 comment="[ ID:b ]"'
+
+
+def test_section_natural_id_index_expression_changed_in_place():
+    old = parser.RouterOSConfig.parse("/interface vlan\nadd name=v1 vlan-id=1\nadd name=v3 vlan-id=3")
+    new = parser.RouterOSConfig.parse("/interface vlan\nadd name=v1 vlan-id=1\nadd name=v3 vlan-id=3")
+    section = new["/interface vlan"]
+    assert section.get("v1") is section.expressions[0]
+    assert str(new.diff(old)) == ""
+
+    # Replacing the args of an expression
+    section.expressions[0].args = routeros_diff.arguments.ArgList([
+        routeros_diff.arguments.Arg("name", "v2"), routeros_diff.arguments.Arg("vlan-id", "1"),
+    ])
+    assert section.get("v1") is None
+    assert section.get("v2") is section.expressions[0]
+    assert str(new.diff(old)) == (
+        "/interface vlan\n"
+        "remove [ find name=v1 ]\n"
+        "add name=v2 vlan-id=1\n"
+    )
+
+    # Changing the args themselves
+    del section.expressions[1].args["name"]
+    assert section.natural_id_positions() == {"v2": 0, None: 1}
+    assert not section.uses_natural_ids
+
+
+def test_section_lookups_are_constant_time(monkeypatch):
+    # Count how often expressions are checked for changes, which should not grow with each lookup
+    calls = 0
+    cache_key = routeros_diff.expressions.Expression._cache_key
+
+    def counted(expression):
+        nonlocal calls
+        calls += 1
+        return cache_key(expression)
+
+    monkeypatch.setattr(routeros_diff.expressions.Expression, "_cache_key", counted)
+    count = 500
+    section = routeros_diff.sections.Section.parse("/interface vlan\n" + "\n".join(f"add name=v{i}" for i in range(count)))
+    for i in range(count):
+        assert section.get(f"v{i}") is section.expressions[i]
+        assert section.expression_index_for_natural_key("name", f"v{i}") == i
+    assert calls < count * 4
+
+    # Changing an expression in place means the expressions are checked again, but only once
+    section.expressions[0].args.append(routeros_diff.arguments.Arg("mtu", "1500"))
+    calls = 0
+    for i in range(count):
+        section.get(f"v{i}")
+    assert calls < count * 4
+
+
+@pytest.mark.parametrize("path", ["/interface vlan", "/ip firewall filter"])
+def test_diff_by_id_is_linear(monkeypatch, path):
+    # Count how often natural IDs are calculated, which should grow linearly with the section size
+    calls = 0
+    natural_key_and_id = routeros_diff.expressions.Expression.natural_key_and_id
+
+    def counted(expression):
+        nonlocal calls
+        calls += 1
+        return natural_key_and_id.fget(expression)
+
+    monkeypatch.setattr(routeros_diff.expressions.Expression, "natural_key_and_id", property(counted))
+
+    def calls_for(count):
+        nonlocal calls
+        old = f"{path}\n" + "\n".join(f'add chain=a comment="[ ID:{i} ]"' for i in range(0, count, 2))
+        new = f"{path}\n" + "\n".join(f'add chain=b comment="[ ID:{i} ]"' for i in range(count))
+        old = routeros_diff.sections.Section.parse(old)
+        new = routeros_diff.sections.Section.parse(new)
+        calls = 0
+        new.diff(old, old_verbose=old)
+        return calls
+
+    assert calls_for(2000) <= calls_for(1000) * 2.1
+
+
+def test_config_section_index():
+    config = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    assert isinstance(config.sections, routeros_diff.sections.SectionList)
+    assert list(config.sections.by_path()) == config.keys()
+    assert config["/ip address"] is config.sections[6]
+    assert "/ip pool" not in config
+
+    # The index is kept up to date as sections are added & removed
+    pool = routeros_diff.sections.Section.parse("/ip pool\nadd name=dhcp")
+    config.sections.append(pool)
+    assert config["/ip pool"] is pool
+    config.sections.remove(pool)
+    assert config.get("/ip pool") is None
+
+    config.sections = [pool]
+    assert config.keys() == ["/ip pool"]
+    assert config["/ip pool"] is pool
+
+
+def test_diff_config_duplicate_sections():
+    config = parser.RouterOSConfig.parse("/ip pool\nadd name=a")
+    config.sections.append(routeros_diff.sections.Section.parse("/ip pool\nadd name=b"))
+    with pytest.raises(routeros_diff.exceptions.CannotDiff):
+        config.diff(parser.RouterOSConfig.parse(""))
+    with pytest.raises(routeros_diff.exceptions.CannotDiff):
+        parser.RouterOSConfig.parse("").diff(config)
+
+
+@pytest.mark.parametrize("count", [3, 20])
+def test_arg_list_by_key(count):
+    # Both short (searched) and long (indexed) lists
+    args = routeros_diff.arguments.ArgList([routeros_diff.arguments.Arg(f"k{i}", f"v{i}") for i in range(count)])
+    assert args["k2"] == "v2"
+    assert "k2" in args
+    assert "x" not in args
+    assert args.get("x") is None
+    with pytest.raises(KeyError):
+        args["x"]
+
+    # Lookups are kept up to date as the list changes
+    args.insert(0, routeros_diff.arguments.Arg("x", "1"))
+    assert args["x"] == "1"
+    args[0] = routeros_diff.arguments.Arg("y", "2")
+    assert "x" not in args
+    assert args["y"] == "2"
+    del args["y"]
+    assert "y" not in args
+    args.append(routeros_diff.arguments.Arg("k2", "again"))
+    del args["k2"]
+    assert "k2" not in args
+    assert args.keys() == [f"k{i}" for i in range(count) if i != 2]
+
+
+def test_arg_list_diff_wide():
+    old = routeros_diff.expressions.Expression.parse(
+        "set ether1 " + " ".join(f"k{i}=v{i}" for i in range(30)) + " disabled=yes", "/interface ethernet"
+    )
+    new = routeros_diff.expressions.Expression.parse(
+        "set ether1 " + " ".join(f"k{i}=v{i + (i % 10 == 0)}" for i in range(5, 40)), "/interface ethernet"
+    )
+    verbose = routeros_diff.expressions.Expression.parse("set ether1 k35=v35", "/interface ethernet")
+    assert str(new.args.diff(old.args, verbose.args)) == (
+        'ether1 disabled=no k0="" k1="" k2="" k3="" k4="" k10=v11 k20=v21 k30=v31 '
+        + " ".join(f"k{i}=v{i + (i % 10 == 0)}" for i in range(31, 40) if i != 35)
+    )
+
+
+def test_expression_properties_are_cached(monkeypatch):
+    expression = routeros_diff.expressions.Expression.parse("add name=a mtu=1500", "/interface vlan")
+    calls = []
+    find = routeros_diff.expressions.Expression._find_natural_key_and_id
+    monkeypatch.setattr(routeros_diff.expressions.Expression, "_find_natural_key_and_id", lambda e: calls.append(e) or find(e))
+
+    assert expression.natural_key_and_id == ("name", "a")
+    assert expression.natural_key_and_id == ("name", "a")
+    assert len(calls) == 1
+
+
+def test_expression_cached_properties_invalidated():
+    Arg = routeros_diff.arguments.Arg
+    expression = routeros_diff.expressions.Expression.parse("set [ find name=a ] mtu=1500", "/interface vlan")
+    assert expression.natural_key_and_id == ("name", "a")
+    assert expression.has_kw_args
+    assert not expression.finds_by_default
+    assert not expression.is_single_object_expression
+
+    # Replacing attributes
+    replaced = dataclasses.replace(expression, find_expression=None)
+    assert replaced.natural_key_and_id == (None, None)
+    assert replaced.is_single_object_expression
+    assert expression.natural_key_and_id == ("name", "a")
+
+    replaced = dataclasses.replace(expression, args=routeros_diff.arguments.ArgList([Arg("b", None)]))
+    assert not replaced.has_kw_args
+
+    expression.find_expression = routeros_diff.expressions.Expression.parse("find default=yes", "")
+    assert expression.finds_by_default
+    assert expression.natural_key_and_id == (None, None)
+
+    # Changing the args (or those of the find expression) in place
+    expression.find_expression.args.insert(0, Arg("name", "c"))
+    assert expression.natural_key_and_id == ("name", "c")
+    assert not expression.finds_by_default
+
+    expression.args.append(Arg("comment", "[ ID:d ]"))
+    assert expression.natural_key_and_id == ("comment-id", "d")
+
+    expression.args[:] = [Arg("e", None)]
+    assert not expression.has_kw_args
+
+
+@pytest.mark.parametrize("section,expected", [
+    ("/system identity\nset name=core", (True, False, False, True)),
+    ("/interface wireless security-profiles\nset [ find default=yes ] supplicant-identity=MikroTik", (False, True, True, False)),
+    ("/ip firewall filter\nadd chain=input\nadd chain=forward", (False, False, False, False)),
+    ("/interface vlan\nadd name=a\nset [ find default=yes ] name=b", (False, False, True, True)),
+    ("/interface vlan", (False, False, False, True)),
+])
+def test_section_classification(section, expected):
+    section = routeros_diff.sections.Section.parse(section)
+    assert section.classify() == expected
+    assert (
+        section.is_single_object_section,
+        section.modifies_default_only,
+        section.has_any_default_entry,
+        section.uses_natural_ids,
+    ) == expected
+
+
+def test_section_classification_is_cached():
+    section = routeros_diff.sections.Section.parse("/interface vlan\nadd name=a")
+    classification = section.classify()
+    assert section.classify() is classification
+
+    # Changing the expressions updates the classification
+    section.expressions.append(routeros_diff.expressions.Expression.parse("add mtu=1500", "/interface vlan"))
+    assert not section.uses_natural_ids
+    section.expressions = [routeros_diff.expressions.Expression.parse("set name=core", "/system identity")]
+    assert section.is_single_object_section
+
+    # Changing an expression in place also updates the classification
+    section.expressions[0].command = "add"
+    assert not section.is_single_object_section
+
+
+def test_section_classification_is_constant_time(monkeypatch):
+    section = routeros_diff.sections.Section.parse("/interface vlan\n" + "\n".join(f"add name=v{i}" for i in range(100)))
+    classification = section.classify()
+
+    def fail(expression):
+        raise AssertionError("Expressions should not be checked again")
+
+    # Fetching the cached classification does not check each expression
+    monkeypatch.setattr(routeros_diff.expressions.Expression, "_cache_key", fail)
+    for _ in range(10):
+        assert section.classify() is classification
+
+
+@pytest.mark.parametrize("path", [
+    "/ip firewall filter", "/ip firewall", "/ip firewall address-list", "/ipv6 firewall filter", "/ip address", "/ip addresses",
+])
+def test_compiled_patterns_match_fnmatch(path):
+    patterns = ["/ip firewall*", "/ip address", "/ipv? firewall filter", "/ip [ab]ddress"]
+    matches = routeros_diff.settings.compile_patterns(patterns)
+    assert matches(path) == any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+    assert not routeros_diff.settings.compile_patterns([])(path)
+
+
+def test_settings_results_are_remembered():
+    settings = Settings(no_deletions={"/ip pool*"})
+    assert not settings.deletion_allowed("/ip pool")
+    assert settings.deletion_allowed("/ip address")
+    assert settings._compiled.deletion_allowed_results == {"/ip pool": False, "/ip address": True}
+    assert settings.is_expression_order_important("/ip firewall filter")
+    assert not settings.creation_allowed("/interface ethernet")
+    assert not settings.is_columnar("/ip route")
+    settings.columnar_sections = {"/ip firewall*", "/ip route"}
+    assert not settings.is_columnar("/ip firewall filter")
+    assert settings.is_columnar("/ip route")
+
+    # Replacing a setting is detected automatically
+    settings.no_deletions = {"/ip address"}
+    assert settings.deletion_allowed("/ip pool")
+    assert not settings.deletion_allowed("/ip address")
+
+    # Changes made in place need compiling
+    settings.no_deletions.add("/ip pool")
+    assert settings.compile() is settings
+    assert not settings.deletion_allowed("/ip pool")
+
+    # The compiled patterns are not pickled
+    assert "_compiled" not in pickle.loads(pickle.dumps(settings)).__dict__
+    assert not pickle.loads(pickle.dumps(settings)).deletion_allowed("/ip pool")
+
+
+def test_settings_subclass_overrides():
+    class CustomSettings(Settings):
+        def deletion_allowed(self, section_path):
+            return section_path != "/ip pool"
+
+        def is_expression_order_important(self, section_path):
+            return section_path == "/ip route"
+
+    settings = CustomSettings(columnar_sections={"/ip firewall address-list", "/ip route"})
+    expression = routeros_diff.expressions.Expression.parse("add name=a", "/ip pool", settings=settings)
+    assert expression.as_delete() is None
+    assert str(dataclasses.replace(expression, section_path="/ip address").as_delete()) == "remove [ find name=a ]"
+    assert not settings.is_columnar("/ip route")
+    assert settings.is_columnar("/ip firewall address-list")
+
+
+def test_natural_key_patterns():
+    settings = Settings(natural_keys={
+        "/routing bgp *": "name",
+        "/routing *": "interface",
+        "/routing ospf interface": "network",
+        "/ip route": ["dst-address", "routing-table"],
+        "/ip pool": ["ranges"],
+    })
+    assert settings.get_natural_key("/routing bgp peer") == "name"
+    assert settings.get_natural_key("/routing ospf network") == "interface"
+    assert settings.get_natural_key("/routing ospf interface") == "network"
+    assert settings.get_natural_key("/ip route") == ("dst-address", "routing-table")
+    assert settings.get_natural_key("/ip pool") == "ranges"
+    assert settings.get_natural_key("/ip address") == "name"
+    assert settings._compiled.natural_key_results["/routing bgp peer"] == "name"
+
+
+def test_compound_natural_key():
+    settings = Settings(natural_keys={"/ip route": ("dst-address", "routing-table")})
+    expression = routeros_diff.expressions.Expression.parse("add dst-address=10.0.0.0/8 gateway=a routing-table=main", "/ip route", settings)
+    assert expression.natural_key_and_id == (("dst-address", "routing-table"), ("10.0.0.0/8", "main"))
+    assert str(expression.as_delete()) == 'remove [ find dst-address="10.0.0.0/8" routing-table=main ]'
+
+    # All keys must be present
+    expression = routeros_diff.expressions.Expression.parse("add dst-address=10.0.0.0/8 gateway=a", "/ip route", settings)
+    assert expression.natural_key_and_id == (None, None)
+
+    # Keys can also be given in the find expression
+    expression = routeros_diff.expressions.Expression.parse("set [ find dst-address=10.0.0.0/8 routing-table=main ] gateway=b", "/ip route", settings)
+    assert expression.natural_key_and_id == (("dst-address", "routing-table"), ("10.0.0.0/8", "main"))
+
+
+def test_diff_compound_natural_key():
+    old = parser.RouterOSConfig.parse(
+        "/ip firewall address-list\n"
+        "add address=1.1.1.1 list=a\n"
+        "add address=2.2.2.2 list=a comment=x\n"
+        "add address=3.3.3.3 list=a\n"
+        "add address=9.9.9.9 list=z comment=\"[ ID:foo ]\"\n"
+    )
+    new = parser.RouterOSConfig.parse(
+        "/ip firewall address-list\n"
+        "add address=1.1.1.1 list=a\n"
+        "add address=2.2.2.2 list=b\n"
+        "add address=2.2.2.2 list=a comment=y\n"
+        "add address=4.4.4.4 list=a\n"
+    )
+    assert str(new.diff(old)) == (
+        "/ip firewall address-list\n"
+        "remove [ find where comment~\"ID:foo\" ]\n"
+        "remove [ find list=a address=3.3.3.3 ]\n"
+        "set [ find list=a address=2.2.2.2 ] comment=y\n"
+        "add address=4.4.4.4 list=a\n"
+        "add address=2.2.2.2 list=b\n"
+    )
+
+
+@pytest.mark.parametrize("values,expected", [
+    ([], []),
+    ([1, 2, 3], [0, 1, 2]),
+    ([3, 2, 1], [2]),
+    ([3, 1, 2, 5, 4], [1, 2, 4]),
+    ([0, 8, 4, 12, 2, 10, 6, 14, 1, 9], [0, 4, 6, 9]),
+])
+def test_longest_increasing_subsequence(values, expected):
+    assert routeros_diff.ordering.longest_increasing_subsequence(values) == expected
+
+
+def _apply_placements(old_ids, new_ids, placements):
+    """Apply placements to old_ids in the same way that RouterOS would"""
+    ids = [i for i in old_ids if i in new_ids]
+    for placement in placements:
+        if not placement.create:
+            ids.remove(placement.natural_id)
+        position = ids.index(placement.before) if placement.before is not None else len(ids)
+        ids.insert(position, placement.natural_id)
+    return ids
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_plan_placements(seed):
+    import random
+    rng = random.Random(seed)
+    old_ids = list(range(rng.randint(0, 30)))
+    new_ids = [i for i in old_ids if rng.random() > 0.2] + list(range(100, 100 + rng.randint(0, 5)))
+    rng.shuffle(new_ids)
+    old_positions = {natural_id: i for i, natural_id in enumerate(old_ids)}
+
+    placements = routeros_diff.ordering.plan_placements(new_ids, old_positions)
+    assert _apply_placements(old_ids, new_ids, placements) == new_ids
+
+    # Only the expressions outside the longest increasing subsequence are moved
+    surviving = [old_positions[i] for i in new_ids if i in old_positions]
+    moves = [p for p in placements if not p.create]
+    assert len(moves) == len(surviving) - len(routeros_diff.ordering.longest_increasing_subsequence(surviving))
+    assert len(placements) - len(moves) == len([i for i in new_ids if i not in old_positions])
+
+
+def test_diff_section_order_important_reordered():
+    old = routeros_diff.sections.Section.parse(
+        "/ip firewall filter\n"
+        'add chain=a comment="[ ID:1 ]"\n'
+        'add chain=b comment="[ ID:2 ]"\n'
+        'add chain=c comment="[ ID:3 ]"\n'
+        'add chain=d comment="[ ID:4 ]"\n'
+        'add chain=e comment="[ ID:5 ]"\n'
+    )
+    new = routeros_diff.sections.Section.parse(
+        "/ip firewall filter\n"
+        'add chain=b comment="[ ID:2 ]"\n'
+        'add chain=a comment="[ ID:1 ]"\n'
+        'add chain=x comment="[ ID:new ]"\n'
+        'add chain=c comment="[ ID:3 ]"\n'
+        'add chain=e comment="[ ID:5 ]"\n'
+        'add chain=dd comment="[ ID:4 ]"\n'
+    )
+
+    diffed = new.diff(old)
+    assert [str(e) for e in diffed.expressions] == [
+        'set [ find where comment~"ID:4" ] chain=dd',
+        'move [ find where comment~"ID:2" ] destination=[ find where comment~"ID:1" ]',
+        'add chain=x comment="[ ID:new ]" place-before=[ find where comment~"ID:3" ]',
+        'move [ find where comment~"ID:5" ] destination=[ find where comment~"ID:4" ]',
+    ]
+
+    # The new section is not modified by the diff
+    assert "place-before" not in str(new)
+    assert [str(e) for e in new.diff(old).expressions] == [str(e) for e in diffed.expressions]
+
+    # Moving to the end of the section
+    new = routeros_diff.sections.Section.parse(
+        "/ip firewall filter\n"
+        'add chain=b comment="[ ID:2 ]"\n'
+        'add chain=c comment="[ ID:3 ]"\n'
+        'add chain=d comment="[ ID:4 ]"\n'
+        'add chain=e comment="[ ID:5 ]"\n'
+        'add chain=a comment="[ ID:1 ]"\n'
+    )
+    assert [str(e) for e in new.diff(old).expressions] == ['move [ find where comment~"ID:1" ]']
+
+    # Nothing to do if only the order of unordered sections changes
+    old.path = new.path = "/interface vlan"
+    assert not new.diff(old).expressions
+
+
+def test_diff_section_order_important_insert_after_deletion():
+    old = routeros_diff.sections.Section.parse(
+        "/ip firewall nat\n"
+        'add value=x comment="[ ID:x ]"\n'
+        'add value=y comment="[ ID:y ]"\n'
+        'add value=z comment="[ ID:z ]"\n'
+    )
+    new = routeros_diff.sections.Section.parse(
+        "/ip firewall nat\n"
+        'add value=a comment="[ ID:a ]"\n'
+        'add value=y comment="[ ID:y ]"\n'
+        'add value=z comment="[ ID:z ]"\n'
+    )
+
+    diffed = new.diff(old)
+    assert [str(e) for e in diffed.expressions] == [
+        'remove [ find where comment~"ID:x" ]',
+        'add value=a comment="[ ID:a ]" place-before=[ find where comment~"ID:y" ]',
+    ]
+
+
+def test_align():
+    assert routeros_diff.ordering.align([], []) == []
+    assert routeros_diff.ordering.align([1, 2, 3], [1, 2, 3]) == [(0, 0), (1, 1), (2, 2)]
+    assert routeros_diff.ordering.align([1, 2, 3, 4], [1, 5, 3, 2, 4]) in (
+        [(0, 0), (1, 3), (3, 4)],
+        [(0, 0), (2, 2), (3, 4)],
+    )
+    assert routeros_diff.ordering.align([1, 2, 3], [4, 5, 6], max_edits=5) is None
+    assert routeros_diff.ordering.align([1, 2, 3], [4, 5, 6], max_edits=6) == []
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_align_is_longest(seed):
+    import random
+    rng = random.Random(seed)
+    old = [rng.randint(0, 5) for _ in range(rng.randint(0, 15))]
+    new = [rng.randint(0, 5) for _ in range(rng.randint(0, 15))]
+
+    # Longest common subsequence, the slow way
+    lengths = [[0] * (len(new) + 1) for _ in range(len(old) + 1)]
+    for i, a in enumerate(old):
+        for j, b in enumerate(new):
+            lengths[i + 1][j + 1] = lengths[i][j] + 1 if a == b else max(lengths[i][j + 1], lengths[i + 1][j])
+
+    common = routeros_diff.ordering.align(old, new)
+    assert len(common) == lengths[-1][-1]
+    assert all(old[i] == new[j] for i, j in common)
+    assert common == sorted(common) and len({j for _, j in common}) == len(common)
+
+
+def test_diff_section_order_important_aligned():
+    old = routeros_diff.sections.Section.parse(
+        "/ip firewall filter\n"
+        "add action=accept chain=input connection-state=established\n"
+        "add action=drop chain=input src-address=10.0.0.1\n"
+        "add action=accept chain=input protocol=icmp\n"
+        "add action=drop chain=input\n"
+    )
+    new = routeros_diff.sections.Section.parse(
+        "/ip firewall filter\n"
+        "add action=accept chain=input connection-state=established\n"
+        "add action=accept chain=input protocol=icmp\n"
+        "add action=accept chain=input protocol=tcp dst-port=22\n"
+        "add action=drop chain=input\n"
+        "add action=drop chain=forward\n"
+    )
+
+    diffed = new.diff(old)
+    assert [str(e) for e in diffed.expressions] == [
+        "remove [ find action=drop chain=input src-address=10.0.0.1 ]",
+        "add action=accept chain=input protocol=tcp dst-port=22 place-before=[ find action=drop chain=input ]",
+        "add action=drop chain=forward",
+    ]
+
+    # "[ find action=drop chain=input ]" would also find the rule we are adding
+    new.expressions[2] = routeros_diff.expressions.Expression.parse("add action=drop chain=input protocol=tcp", "/ip firewall filter")
+    assert str(new.diff(old).expressions[0]) == "remove [ find ]"
+
+    # Reordering only
+    new = routeros_diff.sections.Section.parse(
+        "/ip firewall filter\n"
+        "add action=accept chain=input connection-state=established\n"
+        "add action=drop chain=input src-address=10.0.0.1\n"
+        "add action=drop chain=input\n"
+        "add action=accept chain=input protocol=icmp\n"
+    )
+    assert [str(e) for e in new.diff(old).expressions] == [
+        "remove [ find action=accept chain=input protocol=icmp ]",
+        "add action=accept chain=input protocol=icmp",
+    ]
+
+    # Reordering, but "[ find action=drop chain=input ]" would find both drop rules
+    new = routeros_diff.sections.Section.parse(
+        "/ip firewall filter\n"
+        "add action=accept chain=input connection-state=established\n"
+        "add action=accept chain=input protocol=icmp\n"
+        "add action=drop chain=input src-address=10.0.0.1\n"
+        "add action=drop chain=input\n"
+    )
+    assert str(new.diff(old).expressions[0]) == "remove [ find ]"
+
+
+def test_diff_section_order_important_alignment_limit(monkeypatch):
+    old = routeros_diff.sections.Section.parse("/ip firewall filter\n" + "\n".join(f"add chain=c{i}" for i in range(10)))
+    new = routeros_diff.sections.Section.parse("/ip firewall filter\n" + "\n".join(f"add chain=c{i}" for i in range(5, 15)))
+    assert len(new.diff(old).expressions) == 10
+
+    monkeypatch.setattr(routeros_diff.ordering, "ALIGNMENT_MAX_EDITS", 9)
+    assert str(new.diff(old).expressions[0]) == "remove [ find ]"
+
+
+def test_diff_with_workers(monkeypatch):
+    monkeypatch.setattr(parser, "PARALLEL_DIFF_MIN_EXPRESSIONS", 3)
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 2)
+    address_list = "\n/ip firewall address-list\n" + "\n".join(f"add address=10.0.0.{i} list=a" for i in range(20))
+    old = parser.RouterOSConfig.parse(ENTIRE_CONFIG + address_list, settings=COLUMNAR_SETTINGS)
+    new = parser.RouterOSConfig.parse(
+        ENTIRE_CONFIG.replace("name=rr1", "name=rr2").replace("10.127.0.1", "10.127.0.2")
+        + address_list.replace("10.0.0.1 ", "10.0.0.100 ").replace("list=a\nadd address=10.0.0.5 ", "list=b\nadd address=10.0.0.5 "),
+        settings=COLUMNAR_SETTINGS,
+    )
+    assert isinstance(new["/ip firewall address-list"].expressions, routeros_diff.columns.ExpressionColumns)
+
+    diffed = new.diff(old, workers=2)
+    expected = new.diff(old)
+    assert len(diffed.sections) > 3
+    assert str(diffed) == str(expected)
+    assert str(new.diff(old, old, workers=2)) == str(new.diff(old, old))
+
+
+def test_diff_with_workers_different_settings(monkeypatch):
+    monkeypatch.setattr(parser, "PARALLEL_DIFF_MIN_EXPRESSIONS", 3)
+    pools = "/ip pool\n" + "\n".join(f"add name=p{i} ranges=10.0.{i}.1-10.0.{i}.9" for i in range(5))
+    new = parser.RouterOSConfig.parse(pools.replace("name=p1 ", "name=renamed "))
+    # The old config identifies pools by their ranges, rather than by name
+    settings = Settings(natural_keys={**Settings.natural_keys, "/ip pool": "ranges"})
+    old = parser.RouterOSConfig.parse(pools, settings=settings)
+    assert new.settings is not old.settings
+
+    expected = str(new.diff(old))
+    assert str(new.diff(old, workers=2)) == expected
+    assert str(new.diff(old, old, workers=2)) == str(new.diff(old, old))
+    assert [(path, str(e)) for path, e in new.iter_diff(old, workers=2)] == [
+        (path, str(e)) for path, e in new.iter_diff(old)
+    ]
+
+
+def test_diff_with_workers_small_sections_are_serial(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("Process pool should not be used")
+
+    monkeypatch.setattr(parser, "ProcessPoolExecutor", fail)
+    old = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    new = parser.RouterOSConfig.parse(ENTIRE_CONFIG.replace("name=rr1", "name=rr2"))
+    assert str(new.diff(old, workers=2)) == str(new.diff(old))
+
+
+def test_indexed_lists_can_be_pickled():
+    config = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    loaded = pickle.loads(pickle.dumps(config.sections))
+    assert isinstance(loaded, routeros_diff.sections.SectionList)
+    assert str(parser.RouterOSConfig(None, None, loaded)) == str(config)
+    assert loaded.by_path().keys() == config.sections.by_path().keys()
+
+    args = config["/ip address"].expressions[0].args
+    assert dataclasses.replace(config["/ip address"]).expressions == config["/ip address"].expressions
+    copied = copy.copy(args)
+    assert copied == args and copied["address"] == args["address"]
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_fleet_differ(workers):
+    differ = FleetDiffer(ENTIRE_CONFIG)
+    olds = [
+        ("same", ENTIRE_CONFIG),
+        ("renamed", ENTIRE_CONFIG.replace("name=rr1", "name=rr2")),
+        ("parsed", parser.RouterOSConfig.parse(ENTIRE_CONFIG.replace("10.127.0.1", "10.127.0.2"))),
+        ("verbose", ENTIRE_CONFIG.replace("name=rr1", "name=rr2"), ENTIRE_CONFIG),
+        ("broken", ENTIRE_CONFIG + "\n/system identity\nset name=a\nset name=b\n"),
+        ("unparseable", ENTIRE_CONFIG + '\n/system identity\nset name="a\n'),
+        ("after", ENTIRE_CONFIG),
+        # Parses, but fails when diffing
+        ("undiffable", ENTIRE_CONFIG + "\n/ip address\nadd address=not-an-ip\n"),
+        ("last", ENTIRE_CONFIG),
+    ]
+    results = {result.key: result for result in differ.diff_many(olds, workers=workers)}
+    assert set(results) == {key for key, *_ in olds}
+
+    new = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    for key, old, *old_verbose in olds[:4]:
+        if isinstance(old, str):
+            old = parser.RouterOSConfig.parse(old)
+        old_verbose = [parser.RouterOSConfig.parse(v) for v in old_verbose]
+        assert results[key].error is None
+        assert str(results[key].diff) == str(new.diff(old, *old_verbose))
+
+    assert not results["same"].diff.sections
+    assert results["broken"].diff is None
+    assert isinstance(results["broken"].error, routeros_diff.exceptions.CannotDiff)
+    assert results["unparseable"].diff is None
+    assert isinstance(results["unparseable"].error, ValueError)
+    assert results["after"].error is None
+    assert results["undiffable"].diff is None
+    assert isinstance(results["undiffable"].error, ValueError)
+    assert results["last"].error is None
+    assert not results["last"].diff.sections
+
+    assert differ.routers_diffed == 9
+    assert differ.routers_per_second > 0
+
+
+def test_diff_many():
+    new = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    results = list(new.diff_many([("a", ENTIRE_CONFIG.replace("name=rr1", "name=rr2"))]))
+    assert [r.key for r in results] == ["a"]
+    assert "rr1" in str(results[0].diff)
+
+
+def test_expression_fingerprint():
+    def fingerprint(s):
+        return routeros_diff.expressions.Expression.parse(s, "/ip address").fingerprint()
+
+    assert fingerprint("add address=1.2.3.4 interface=a") == fingerprint('add interface="a" address=1.2.3.4')
+    assert fingerprint("add address=1.2.3.4 interface=a") != fingerprint("add address=1.2.3.4 interface=b")
+    assert fingerprint("add address=1.2.3.4 interface=a") != fingerprint("set address=1.2.3.4 interface=a")
+    assert fingerprint("set [ find name=a ] x=y") != fingerprint("set [ find name=b ] x=y")
+    assert fingerprint("add comment~a") != fingerprint("add comment=a")
+    assert fingerprint("set a b") != fingerprint("set b a")
+
+
+def test_section_fingerprint():
+    def fingerprint(s):
+        return routeros_diff.sections.Section.parse(s).fingerprint()
+
+    # Order only matters where it is important
+    assert fingerprint("/ip address\nadd address=1.1.1.1\nadd address=2.2.2.2") == fingerprint("/ip address\nadd address=2.2.2.2\nadd address=1.1.1.1")
+    assert fingerprint("/ip firewall filter\nadd chain=a\nadd chain=b") != fingerprint("/ip firewall filter\nadd chain=b\nadd chain=a")
+    assert fingerprint("/ip address\nadd address=1.1.1.1") != fingerprint("/ip pool\nadd address=1.1.1.1")
+
+    # Changing the expressions changes the fingerprint
+    section = routeros_diff.sections.Section.parse("/ip address\nadd address=1.1.1.1")
+    before = section.fingerprint()
+    section.expressions.append(routeros_diff.expressions.Expression.parse("add address=2.2.2.2", "/ip address"))
+    assert section.fingerprint() != before
+
+
+def test_section_fingerprint_columnar(monkeypatch):
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 2)
+    s = "/ip firewall address-list\n" + "\n".join(f"add address=10.0.0.{i} list=a comment=\"x {i}\"" for i in range(10))
+    columnar = routeros_diff.sections.Section.parse(s, settings=COLUMNAR_SETTINGS)
+    assert isinstance(columnar.expressions, routeros_diff.columns.ExpressionColumns)
+    listed = dataclasses.replace(columnar, expressions=list(columnar.expressions))
+    assert columnar.fingerprint() == listed.fingerprint()
+
+
+def test_config_fingerprint():
+    config = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    assert config.fingerprint() == parser.RouterOSConfig.parse(ENTIRE_CONFIG).fingerprint()
+    assert config.fingerprint() != parser.RouterOSConfig.parse(ENTIRE_CONFIG.replace("name=rr1", "name=rr2")).fingerprint()
+
+    # Section order & empty sections are ignored
+    reordered = parser.RouterOSConfig(None, None, list(reversed(config.sections)) + [routeros_diff.sections.Section("/foo", [], Settings())])
+    assert reordered.fingerprint() == config.fingerprint()
+
+
+def test_diff_skips_identical_sections(monkeypatch):
+    old = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    new = parser.RouterOSConfig.parse(ENTIRE_CONFIG.replace("name=rr1", "name=rr2"))
+    diffed = []
+    original_diff = routeros_diff.sections.Section.diff
+
+    def diff(self, *args, **kwargs):
+        diffed.append(self.path)
+        return original_diff(self, *args, **kwargs)
+
+    monkeypatch.setattr(routeros_diff.sections.Section, "diff", diff)
+    assert "rr2" in str(new.diff(old))
+    assert len(diffed) == 1
+
+
+def test_diff_expression_changed_in_place():
+    a = parser.RouterOSConfig.parse("/ip pool\nadd name=p ranges=10.0.0.1-10.0.0.9")
+    b = parser.RouterOSConfig.parse("/ip pool\nadd name=p ranges=10.0.0.1-10.0.0.9")
+    assert str(b.diff(a)) == ""
+    fingerprint = b.fingerprint()
+
+    b["/ip pool"].expressions[0].args.append(routeros_diff.arguments.Arg("comment", "x"))
+    assert b.fingerprint() != fingerprint
+    assert str(b.diff(a)) == "/ip pool\nset [ find name=p ] comment=x\n"
+    assert b.has_changes(a)
+    assert b.changed_sections(a) == ["/ip pool"]
+
+
+def test_fingerprint_is_constant_time(monkeypatch):
+    old = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    new = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    assert not new.has_changes(old)
+    fingerprint = new.fingerprint()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Expressions should not be checked or hashed again")
+
+    # The cached fingerprints are used without checking or hashing each expression
+    monkeypatch.setattr(routeros_diff.expressions.Expression, "_cache_key", fail)
+    monkeypatch.setattr(routeros_diff.expressions.Expression, "fingerprint", fail)
+    assert new.fingerprint() == fingerprint
+    assert not new.has_changes(old)
+    assert new.changed_sections(old) == []
+
+
+HAS_CHANGES_CASES = [
+    ("", ""),
+    ("/ip address\nadd address=1.1.1.1 interface=a", "/ip address\nadd address=1.1.1.1 interface=a"),
+    ("/ip address\nadd address=1.1.1.1 interface=a", "/ip address\nadd interface=a address=1.1.1.1"),
+    ("/ip address\nadd address=1.1.1.1 interface=a", "/ip address\nadd address=1.1.1.1 interface=b"),
+    ("/ip address\nadd address=1.1.1.1 interface=a", "/ip address\nadd address=2.2.2.2 interface=a"),
+    ("/ip address\nadd address=1.1.1.1 interface=a", ""),
+    ("", "/ip address\nadd address=1.1.1.1 interface=a"),
+    ("/interface ethernet\nset [ find default-name=ether1 ] name=a", ""),
+    ("/interface ethernet\nset [ find default-name=ether1 ] name=a", "/interface ethernet\nset [ find default-name=ether2 ] name=b"),
+    ("/system identity\nset name=a", "/system identity\nset name=b"),
+    ("/system identity\nset name=a", ""),
+    ("/routing bgp instance\nset default as=1", "/routing bgp instance\nset default as=2"),
+    ("/routing bgp instance\nset default as=1", ""),
+    ("/ip service\nset telnet disabled=yes", "/ip service\nset telnet disabled=yes address=1.1.1.1"),
+    ("/ip service\nset telnet disabled=yes", "/ip service\nset telnet"),
+    ('/ip firewall filter\nadd chain=a comment="[ ID:1 ]"\nadd chain=b comment="[ ID:2 ]"', '/ip firewall filter\nadd chain=b comment="[ ID:2 ]"\nadd chain=a comment="[ ID:1 ]"'),
+    ('/ip firewall filter\nadd chain=a comment="[ ID:1 ]"\nadd chain=b comment="[ ID:2 ]"', '/ip firewall filter\nadd chain=a comment="[ ID:1 ]"\nadd chain=c comment="[ ID:3 ]"\nadd chain=b comment="[ ID:2 ]"'),
+    ('/ip firewall filter\nadd chain=a comment="[ ID:1 ]"\nadd chain=b comment="[ ID:2 ]"', '/ip firewall filter\nadd chain=a comment="[ ID:1 ]"\nadd chain=b comment="[ ID:2 ]"\nadd chain=a comment="[ ID:1 ]"'),
+    ("/ip firewall filter\nadd chain=a\nadd chain=b", "/ip firewall filter\nadd chain=b\nadd chain=a"),
+    ("/ip firewall filter\nadd chain=a\nadd chain=b", "/ip firewall filter\nadd chain=a\nadd chain=b\nadd chain=a"),
+    ("/ip pool\nadd ranges=1\nadd ranges=2", "/ip pool\nadd ranges=2\nadd ranges=1"),
+    ("/ip pool\nadd ranges=1\nadd ranges=2", "/ip pool\nadd ranges=2\nadd ranges=1\nadd ranges=1"),
+    ("/tool sniffer\nadd filter=1", "/tool sniffer\nadd filter=2"),
+    ("/ip address\nadd address=1.1.1.1 interface=a", "/ip address\nadd address=1.1.1.1/32 interface=a"),
+    ('/ip firewall filter\nadd chain=a comment="x [ ID:1 ]"', '/ip firewall filter\nadd chain=a comment="y [ ID:1 ]"'),
+    ("/ip firewall address-list\nadd address=1.1.1.1 list=a\nadd address=2.2.2.2 list=a", "/ip firewall address-list\nadd address=2.2.2.2 list=a\nadd address=1.1.1.1 list=a"),
+    ("/ip firewall address-list\nadd address=1.1.1.1 list=a\nadd address=2.2.2.2 list=a", "/ip firewall address-list\nadd address=1.1.1.1 list=a timeout=1d\nadd address=2.2.2.2 list=a"),
+    ("/ip firewall address-list\nadd address=1.1.1.1 list=a\nadd address=2.2.2.2 list=a", "/ip firewall address-list\nadd address=1.1.1.1 list=a"),
+    ("/ip route\nadd gateway=a\nadd gateway=b", "/ip route\nadd gateway=b\nadd gateway=a"),
+    ("/ip route\nadd gateway=a\nadd gateway=b", "/ip route\nadd gateway=a\nadd gateway=c"),
+    ("/ip route\nadd gateway=a\nadd disabled=yes gateway=b", "/ip route\nadd gateway=a"),
+    # Replaced with ENTIRE_CONFIG (which is defined below)
+    ("ENTIRE_CONFIG", "ENTIRE_CONFIG"),
+    ("ENTIRE_CONFIG", "ENTIRE_CONFIG name=rr2"),
+    ("ENTIRE_CONFIG", "ENTIRE_CONFIG 10.127.0.2"),
+]
+
+
+def _has_changes_config(s, settings=None):
+    if s.startswith("ENTIRE_CONFIG"):
+        s = ENTIRE_CONFIG.replace("name=rr1", "name=rr2") if "rr2" in s else ENTIRE_CONFIG
+        s = s.replace("10.127.0.1", "10.127.0.2") if "10.127.0.2" in s else s
+    return parser.RouterOSConfig.parse(s, settings=settings)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+@pytest.mark.parametrize("old,new", HAS_CHANGES_CASES + [(new, old) for old, new in HAS_CHANGES_CASES])
+def test_has_changes(monkeypatch, old, new, columnar):
+    settings = None
+    if columnar:
+        monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 1)
+        settings = COLUMNAR_SETTINGS
+    old = _has_changes_config(old, settings)
+    new = _has_changes_config(new, settings)
+    diffed = new.diff(old)
+    assert new.has_changes(old) == bool(diffed.sections)
+    assert new.changed_sections(old) == [s.path for s in diffed.sections]
+
+    # With the old config as the verbose config
+    diffed = new.diff(old, old)
+    assert new.has_changes(old, old) == bool(diffed.sections)
+    assert new.changed_sections(old, old) == [s.path for s in diffed.sections]
+
+
+def test_has_changes_does_not_diff(monkeypatch):
+    old = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    new = parser.RouterOSConfig.parse(ENTIRE_CONFIG.replace("name=rr1", "name=rr2"))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Should not diff")
+
+    # Sections with natural IDs are checked without diffing
+    monkeypatch.setattr(routeros_diff.sections.Section, "diff", fail)
+    assert new.has_changes(old)
+    assert new.changed_sections(old) == ["/routing bgp peer"]
+
+
+def test_has_changes_columnar_does_not_diff(monkeypatch):
+    monkeypatch.setattr(routeros_diff.columns, "COLUMNAR_MIN_EXPRESSIONS", 2)
+    rows = [f"add address=10.0.0.{i} list=a" for i in range(10)]
+    old = parser.RouterOSConfig.parse("/ip firewall address-list\n" + "\n".join(rows), settings=COLUMNAR_SETTINGS)
+    rows[5] += " timeout=1d"
+    new = parser.RouterOSConfig.parse("/ip firewall address-list\n" + "\n".join(rows), settings=COLUMNAR_SETTINGS)
+    assert isinstance(new.sections[0].expressions, routeros_diff.columns.ExpressionColumns)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Should not diff")
+
+    monkeypatch.setattr(routeros_diff.sections.Section, "diff", fail)
+    monkeypatch.setattr(routeros_diff.expressions.Expression, "diff", fail)
+    monkeypatch.setattr(routeros_diff.arguments.ArgList, "diff", fail)
+    assert new.has_changes(old)
+    assert not new.has_changes(new)
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_iter_diff(monkeypatch, workers):
+    monkeypatch.setattr(parser, "PARALLEL_DIFF_MIN_EXPRESSIONS", 3)
+    old = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    new = parser.RouterOSConfig.parse(ENTIRE_CONFIG.replace("name=rr1", "name=rr2").replace("10.127.0.1", "10.127.0.2"))
+    expected = [(section.path, str(expression)) for section in new.diff(old).sections for expression in section.expressions]
+    assert len({path for path, _ in expected}) > 1
+    assert [(path, str(expression)) for path, expression in new.iter_diff(old, workers=workers)] == expected
+    assert list(new.iter_diff(new, workers=workers)) == []
+
+
+def test_iter_diff_is_lazy(monkeypatch):
+    old = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    new = parser.RouterOSConfig.parse(ENTIRE_CONFIG.replace("name=rr1", "name=rr2").replace("10.127.0.1", "10.127.0.2"))
+    diffed_paths = []
+    section_diff = routeros_diff.sections.Section.diff
+
+    def diff(self, *args, **kwargs):
+        diffed_paths.append(self.path)
+        return section_diff(self, *args, **kwargs)
+
+    monkeypatch.setattr(routeros_diff.sections.Section, "diff", diff)
+    path, expression = next(new.iter_diff(old))
+    # Sections after the first changed section have not been diffed yet
+    assert diffed_paths[-1] == path
+    assert len(diffed_paths) < len(new.sections)
+
+
+def test_ros_diff_command(monkeypatch, capsys, tmp_path):
+    from routeros_diff.commands import diff
+
+    old_path = tmp_path / "old.rsc"
+    new_path = tmp_path / "new.rsc"
+    old_path.write_text(ENTIRE_CONFIG)
+    new_path.write_text(ENTIRE_CONFIG.replace("name=rr1", "name=rr2").replace("10.127.0.1", "10.127.0.2"))
+
+    monkeypatch.setattr("sys.argv", ["ros_diff", str(old_path), str(new_path)])
+    diff.run()
+    old = parser.RouterOSConfig.parse(ENTIRE_CONFIG)
+    new = parser.RouterOSConfig.parse(new_path.read_text())
+    assert capsys.readouterr().out == f"{old.diff(new)}\n"
+
+    monkeypatch.setattr("sys.argv", ["ros_diff", str(old_path), str(old_path)])
+    diff.run()
+    assert capsys.readouterr().out == "\n"
+
 # fmt: on
 
 OSPF_SECTION = """